@@ -0,0 +1,274 @@
+# File: capture_plan.py
+# Purpose: Extraction plans compiled from the table/views of yamls/, reading the same records from a "| display json"
+# capture, a "| display xml" capture or the RPC reply of a live device.
+#
+# The table/views use the PyEZ syntax (rpc, args, item, key, view, fields), the field names of a view being the keys
+# of the records it builds, plus two additions to the views:
+# - lists: fields holding a value per repeated element, ie. members: l2ng-l2rtb-vlan-member/<member interface>. The
+#   first element of the path is the repeated one, the rest of the path is read in each of them.
+# - defaults: values of the fields an item doesn't have
+# A path is a "/" separated list of element names, "a | b" reads the first of the paths that is present. A field
+# naming a table (_Name) holds the records of that table, its item path read from the item of the field's view.
+#
+# Each view is compiled once, when its plan is built, into a list of field steps per format: functions reading a
+# field with the accessor of its path (see json_getter() and xml_getter()) and storing the value in the record's
+# slot, so the view isn't walked again for every item. In JSON each element is a list of {"data": ...} or nested
+# elements and the first one is read, in XML the child elements are matched by local name so the Junos namespaces
+# don't matter. Items without a key are skipped (RSTP instances, VLAN groups without a tag). Fields an item doesn't
+# have are left unset in a record type (see records.py) and set to None in a plain dict, like a PyEZ view.
+
+import glob
+import os
+
+import yaml
+from lxml import etree
+
+# Loads the tables and views of every YAML file of a folder {name: definition}
+def load_tables(yaml_dir):
+    tables = {}
+    for yaml_file in sorted(glob.glob(os.path.join(yaml_dir, "*.yml"))):
+        with open(yaml_file) as f:
+            for doc in yaml.safe_load_all(f):
+                if doc:
+                    tables.update(doc)
+    return tables
+
+# The alternatives of a path as lists of element names: "a/b | c" -> [['a', 'b'], ['c']]
+def split_path(path):
+    return [alternative.strip().split("/") for alternative in str(path).split("|")]
+
+# Accessor of the first of several alternatives that returns a value
+def first_of(getters):
+    if len(getters) == 1:
+        return getters[0]
+
+    def get(node):
+        for getter in getters:
+            value = getter(node)
+            if value is not None:
+                return value
+        return None
+    return get
+
+# The child elements of an element by local name, the first one of each name. One pass over the children is faster
+# than a find() per field.
+def xml_children(node):
+    children = {}
+    for child in node.iterchildren(tag=etree.Element):
+        name = child.tag.rpartition("}")[2]
+        if name not in children:
+            children[name] = child
+    return children
+
+# Text of a child element of xml_children(), default if there is none
+def xml_text(children, key, default=None):
+    child = children.get(key)
+    if child is None:
+        return default
+    return (child.text or "").strip()
+
+# Accessors of the paths, JSON nodes are the dicts of a capture's elements
+# Value of the first element of a path in a JSON node, None if the path isn't there
+def json_getter(names):
+    name = names[0]
+    if len(names) == 1:
+        def get(node):
+            entries = node.get(name)
+            if entries:
+                return entries[0].get("data")
+            return None
+        return get
+    rest = json_getter(names[1:])
+
+    def get(node):
+        entries = node.get(name)
+        if entries:
+            return rest(entries[0])
+        return None
+    return get
+
+# Values of a path in each of the repeated elements of its first name
+def json_list_getter(names):
+    name = names[0]
+    if len(names) == 1:
+        return lambda node: [entry.get("data") for entry in node.get(name, ())]
+    rest = json_getter(names[1:])
+    return lambda node: [rest(entry) for entry in node.get(name, ())]
+
+# The item nodes of an item path under a JSON node
+def json_items(names):
+    name = names[0]
+    if len(names) == 1:
+        return lambda node: node.get(name, ())
+    rest = json_items(names[1:])
+
+    def items(node):
+        for entry in node.get(name, ()):
+            yield from rest(entry)
+    return items
+
+# Accessors of the paths, XML nodes are the xml_children() of an element
+# Text of the first element of a path, None if the path isn't there
+def xml_getter(names):
+    name = names[0]
+    if len(names) == 1:
+        return lambda children: xml_text(children, name)
+    rest = xml_getter(names[1:])
+
+    def get(children):
+        child = children.get(name)
+        if child is None:
+            return None
+        return rest(xml_children(child))
+    return get
+
+# Values of a path in each of the repeated elements of its first name, read from the element itself
+def xml_list_getter(names):
+    tag = "{*}" + names[0]
+    if len(names) == 1:
+        return lambda elem: [(child.text or "").strip() for child in elem.iterchildren(tag)]
+    rest = xml_getter(names[1:])
+    return lambda elem: [rest(xml_children(child)) for child in elem.iterchildren(tag)]
+
+# The item elements of an item path under an element
+def xml_items(names):
+    tag = "{*}" + names[0]
+    if len(names) == 1:
+        return lambda elem: elem.iterchildren(tag)
+    rest = xml_items(names[1:])
+
+    def items(elem):
+        for child in elem.iterchildren(tag):
+            yield from rest(child)
+    return items
+
+class CapturePlan(object):
+    """ A table/view compiled into field steps building the records of the items of a JSON or XML capture. """
+
+    # tables is load_tables(), records maps table names to the record type of their items (a plain dict if not
+    # given), view replaces the table's own view
+    def __init__(self, tables, table_name, records=None, view=None):
+        records = records or {}
+        table = tables[table_name]
+        self.name = table_name
+        self.rpc = table.get("rpc")
+        self.args = table.get("args") or {}
+        item_names = split_path(table["item"])[0]
+        # Element name of the items, ie. for streaming an XML capture
+        self.item = item_names[-1]
+        self.json_items = json_items(item_names)
+        self.xml_items = xml_items(item_names)
+        self.record = records.get(table_name, dict)
+        self.json_key = self.xml_key = None
+        if table.get("key"):
+            self.json_key = first_of([json_getter(names) for names in split_path(table["key"])])
+            self.xml_key = first_of([xml_getter(names) for names in split_path(table["key"])])
+        self.view = tables[view or table["view"]]
+        # The nested tables of the view {field: CapturePlan}
+        self.tables = {}
+        for key, path in (self.view.get("fields") or {}).items():
+            if str(path).startswith("_") and path in tables:
+                self.tables[key] = CapturePlan(tables, path, records)
+        self.json_steps = self.field_steps("json")
+        self.xml_steps = self.field_steps("xml")
+
+    # Function reading a field of an item and storing its value in a record: step(record, item, fields), where the
+    # accessor reads the item itself (the JSON node or the element, for the lists and nested tables) if of_item is
+    # set, otherwise fields (the JSON node or xml_children() of the element). The default is stored if the item
+    # doesn't have the field. A record type converts the value (see records.py) and leaves a field without a value
+    # unset, a plain dict sets it to None.
+    def field_step(self, key, get, default=None, of_item=False):
+        if self.record is dict:
+            def step(record, item, fields):
+                value = get(item if of_item else fields)
+                record[key] = default if value is None else value
+            return step
+        convert = self.record.converter(key)
+
+        def step(record, item, fields):
+            value = get(item if of_item else fields)
+            if value is None:
+                value = default
+            if value is not None:
+                setattr(record, key, convert(value))
+        return step
+
+    # The field steps of a format, in view order
+    def field_steps(self, fmt):
+        getter = json_getter if fmt == "json" else xml_getter
+        list_getter = json_list_getter if fmt == "json" else xml_list_getter
+        defaults = self.view.get("defaults") or {}
+        steps = []
+        for key, path in (self.view.get("fields") or {}).items():
+            if key in self.tables:
+                table = self.tables[key]
+                steps.append(self.field_step(key, table.json_table if fmt == "json" else table.xml_table, of_item=True))
+                continue
+            get = first_of([getter(names) for names in split_path(path)])
+            steps.append(self.field_step(key, get, defaults.get(key)))
+        for key, path in (self.view.get("lists") or {}).items():
+            steps.append(self.field_step(key, list_getter(split_path(path)[0]), of_item=True))
+        return steps
+
+    # Builds the record of a JSON item node
+    def json_record(self, node):
+        record = self.record()
+        for step in self.json_steps:
+            step(record, node, node)
+        return record
+
+    # Builds the record of an XML item element, children is its xml_children() if they were already read
+    def xml_record(self, elem, children=None):
+        if children is None:
+            children = xml_children(elem)
+        record = self.record()
+        for step in self.xml_steps:
+            step(record, elem, children)
+        return record
+
+    # The records of a nested table's items under a JSON node or an element
+    def json_table(self, node):
+        return [self.json_record(item) for item in self.json_items(node)]
+
+    def xml_table(self, elem):
+        return [self.xml_record(item) for item in self.xml_items(elem)]
+
+    # The item nodes of a JSON capture, under its top element(s)
+    def json_nodes(self, raw_dict):
+        for top in raw_dict.values():
+            if type(top) is list:
+                for reply in top:
+                    if type(reply) is dict:
+                        yield from self.json_items(reply)
+
+    # Generates the records of a JSON capture, only the items whose key is selected unless it is 'all'
+    def from_json(self, raw_dict, selected='all'):
+        get_key = self.json_key
+        json_record = self.json_record
+        for node in self.json_nodes(raw_dict):
+            if get_key is not None:
+                key = get_key(node)
+                if key is None or (selected != 'all' and key != selected):
+                    continue
+            yield json_record(node)
+
+    # Generates the records of XML item elements (ie. streamed from a capture or found in an RPC reply), only the
+    # items whose key is selected unless it is 'all'
+    def from_xml(self, items, selected='all'):
+        get_key = self.xml_key
+        xml_record = self.xml_record
+        for elem in items:
+            children = xml_children(elem)
+            if get_key is not None:
+                key = get_key(children)
+                if key is None or (selected != 'all' and key != selected):
+                    continue
+            yield xml_record(elem, children)
+
+    # The non-empty keys of the items of a JSON capture, in item order
+    def json_keys(self, raw_dict):
+        return [key for key in map(self.json_key, self.json_nodes(raw_dict)) if key]
+
+    # The non-empty keys of XML item elements, in item order
+    def xml_keys(self, items):
+        return [key for key in (self.xml_key(xml_children(elem)) for elem in items) if key]
@@ -0,0 +1,111 @@
+# File: export.py
+# Purpose: Bulk export of the analysis results (root bridge analysis, MAC scan chassis and suspect interfaces) to CSV
+# and JSON Lines.
+#
+# Rows are streamed from the result structures straight to the file, nothing is built up in memory. CSV goes through
+# csv.writer, so values with commas, quotes or newlines (interface lists, hostnames) are quoted correctly. The files
+# are opened with a large write buffer, and a name ending in ".gz" is gzip compressed. The format is picked from the
+# file name: ".csv", ".jsonl" (optionally followed by ".gz").
+
+import csv
+import gzip
+import json
+
+# Size of the write buffer
+export_buffer = 1 << 20
+# Rows handed to csv.writer / written as one JSONL block at a time
+export_batch = 10000
+# Fastest gzip level, the exports are large and mostly repetitive
+export_compresslevel = 1
+
+# Column order of each export
+vlan_export_keys = ["vlan", "host", "root-bridge-mac", "root-bridge-priority", "local-mac", "local-priority",
+                    "root-cost", "root-port", "downstream-peers", "topo-changes", "time-since-last-tc", "l3-interface"]
+chassis_export_keys = ["chassis", "model", "interface", "admin_status", "oper_status", "speed", "duplex", "mac",
+                       "vlan_id", "tagged", "mode", "active"]
+suspect_export_keys = ["chassis", "interface", "admin-oper", "speed", "mac", "vlan_id", "mode", "rule"]
+
+# Opens an export file for writing text, gzip compressed if the name ends with ".gz"
+def open_export(file_name):
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, 'wt', newline='', compresslevel=export_compresslevel)
+    return open(file_name, 'w', newline='', buffering=export_buffer)
+
+# Export format of a file name, "csv" or "jsonl"
+def export_format(file_name):
+    base_name = file_name[:-3] if file_name.endswith(".gz") else file_name
+    if base_name.endswith(".csv"):
+        return "csv"
+    if base_name.endswith(".jsonl"):
+        return "jsonl"
+    raise ValueError("Unknown export format: {}".format(file_name))
+
+# CSV cell of a value, lists are joined with spaces and None is left empty
+def csv_value(value):
+    if value is None:
+        return ""
+    if type(value) in (list, tuple, set):
+        return " ".join(str(item) for item in value)
+    return value
+
+# Writes rows (dicts) to a CSV file, the keys are the columns. Returns the number of rows.
+def write_csv(rows, file_name, keys):
+    count = 0
+    with open_export(file_name) as f:
+        writer = csv.writer(f)
+        writer.writerow(keys)
+        batch = []
+        for row in rows:
+            batch.append([csv_value(row.get(key)) for key in keys])
+            if len(batch) >= export_batch:
+                writer.writerows(batch)
+                count += len(batch)
+                batch = []
+        writer.writerows(batch)
+        count += len(batch)
+    return count
+
+# Writes rows (dicts) to a JSON Lines file, one object per line with the keys in order. Returns the number of rows.
+def write_jsonl(rows, file_name, keys):
+    count = 0
+    encode = json.JSONEncoder(default=str).encode
+    with open_export(file_name) as f:
+        batch = []
+        for row in rows:
+            batch.append(encode({key: row.get(key) for key in keys}))
+            if len(batch) >= export_batch:
+                f.write("\n".join(batch) + "\n")
+                count += len(batch)
+                batch = []
+        if batch:
+            f.write("\n".join(batch) + "\n")
+            count += len(batch)
+    return count
+
+# Writes rows to a CSV or JSONL file, depending on the file name. Returns the number of rows.
+def export_rows(rows, file_name, keys):
+    if export_format(file_name) == "csv":
+        return write_csv(rows, file_name, keys)
+    return write_jsonl(rows, file_name, keys)
+
+# One row per VLAN and chassis of the root bridge analysis vlans_ld
+def vlan_export_rows(vlans_ld):
+    for vlan in vlans_ld:
+        for chassis in vlan["chassis"]:
+            row = dict(chassis)
+            row["vlan"] = vlan["vlan"]
+            yield row
+
+# One row per MAC (or per interface without MACs) of the MAC scan all_chassis
+def chassis_export_rows(all_chassis):
+    for chassis in all_chassis:
+        for intf in chassis["interfaces"]:
+            row = {"chassis": chassis["chassis"], "model": chassis.get("model"), "interface": intf["name"],
+                   "admin_status": intf.get("admin_status"), "oper_status": intf.get("oper_status"),
+                   "speed": intf.get("speed"), "duplex": intf.get("duplex")}
+            if not intf["macs"]:
+                yield row
+            for one_mac in intf["macs"]:
+                mac_row = dict(row)
+                mac_row.update(one_mac)
+                yield mac_row
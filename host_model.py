@@ -0,0 +1,395 @@
+# File: host_model.py
+# Purpose: The per-host model every spanning tree analysis of stpmap.py reads, and the collectors filling it from a live
+# device (NETCONF), from the JSON or XML captures of a repository, or from the replies netconf_sim.py would send.
+#
+# A host model holds the records extracted with the plans of yamls/ (see capture_plan.py), whatever collected them:
+# host_model {'vlan': [VlanInfo], 'stp': [StpBridge], 'stp-int': [StpInstance],
+#             'lldp': [{'parent_int': '', 'local_port': '', 'remote_chassis_id': '', 'remote_sysname': '',
+#                       'remote_port': ''}]}
+# The LLDP data is kept as links, the neighbors are filtered by the members of a VLAN when it is analyzed (see
+# lldp_neighbors() in repo_store.py). A model collected for one VLAN only holds that VLAN's records.
+#
+# A collector reads one host's data of a kind ("vlan", "stp", "stp-int" or "lldp") as a source the extractors take: a
+# JSON capture (dict), a "| display xml" capture (file name) or an RPC reply (element). New sources of data only need a
+# collector, the extraction and the analyses stay the same. When a scan is limited to one VLAN or a short VLAN range,
+# the network collectors pass the VLAN in the RPC arguments (vlan-id for the spanning tree RPCs, vlan-name for
+# get-vlan-information), so a device only builds and sends the data of the scanned VLANs.
+
+import os
+import random
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+
+from lxml import etree
+
+from capture_plan import load_tables, CapturePlan
+from records import StpBridge, StpInterface, StpInstance, VlanInfo
+from repo_source import open_source, source_exists
+from profiler import timed_phase, device_timer, record_device_metric
+from utility import json_to_dict
+
+# Extraction plans of the table/views in yamls/, shared by every collector (see capture_plan.py)
+capture_tables = load_tables(os.path.join(os.path.dirname(os.path.abspath(__file__)), "yamls"))
+vlan_plan = CapturePlan(capture_tables, "VlanTable", {"VlanTable": VlanInfo})
+vlan_intf_plan = CapturePlan(capture_tables, "VlanTable", view="VlanIntfView")
+stp_plan = CapturePlan(capture_tables, "STPBridgeTable", {"STPBridgeTable": StpBridge})
+stp_int_plan = CapturePlan(capture_tables, "STPInterfaceTable", {"STPInterfaceTable": StpInstance,
+                                                                 "_STPInterfaceEntryTable": StpInterface})
+lldp_plan = CapturePlan(capture_tables, "LLDPNeighborTable")
+
+# Plan, capture file suffixes (JSON, XML) and device metric name of each kind of data
+source_plans = {"vlan": vlan_plan, "stp": stp_plan, "stp-int": stp_int_plan, "lldp": lldp_plan}
+host_file_suffixes = {"vlan": "_vlan-ext.json", "stp": "_stp.json", "stp-int": "_stp-int.json", "lldp": "_lldp.json"}
+xml_file_suffixes = {"vlan": "_vlan-ext.xml", "stp": "_stp.xml", "stp-int": "_stp-int.xml", "lldp": "_lldp.xml"}
+metric_names = {"vlan": "vlan", "stp": "stp_bridge", "stp-int": "stp_interface", "lldp": "lldp"}
+# Progress messages of the network collector
+pull_messages = {"vlan": "VLAN", "stp": "Spanning-Tree", "stp-int": "Spanning-Tree interface", "lldp": "LLDP"}
+
+# Streams the record elements (ie. vst-bridge-parameters) of a "| display xml" capture, matched by local name so the
+# Junos namespaces don't matter. Each element is cleared once it has been read, so memory doesn't grow with the file.
+# A capture that isn't well-formed raises ValueError, like a bad JSON file.
+def xml_records(xml_file, tag):
+    with open_source(xml_file) as f:
+        try:
+            for event, elem in etree.iterparse(f, events=("end",), tag="{*}" + tag, remove_blank_text=True):
+                yield elem
+                elem.clear(keep_tail=False)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        except etree.XMLSyntaxError as err:
+            raise ValueError("{}: {}".format(xml_file, err))
+
+# The item elements of a plan in a source: a JSON capture (dict), a "| display xml" capture (file name) or an RPC reply
+# (element). Returns (True if the source is JSON, items)
+def plan_items(plan, source):
+    if type(source) is dict:
+        return True, source
+    if type(source) is str:
+        return False, xml_records(source, plan.item)
+    if hasattr(source, "iter"):
+        return False, source.iter("{*}" + plan.item)
+    # An RPC without a reply (ie. no LLDP neighbors)
+    return False, ()
+
+# Extracts the records of a plan from a JSON capture, an XML capture or an RPC reply
+# Returns LD if selected_vlan is "all"
+# Returns the record of selected_vlan if it is set, an empty list if the source doesn't have it
+def extract_records(plan, source, selected_vlan='all'):
+    is_json, items = plan_items(plan, source)
+    if is_json:
+        records = plan.from_json(items, selected_vlan)
+    else:
+        records = plan.from_xml(items, selected_vlan)
+    if selected_vlan == 'all':
+        return list(records)
+    for record in records:
+        return record
+    return []
+
+# The keys (ie. VLAN tags) of the items of a plan in a JSON capture, an XML capture or an RPC reply
+def extract_keys(plan, source):
+    is_json, items = plan_items(plan, source)
+    if is_json:
+        return plan.json_keys(items)
+    return plan.xml_keys(items)
+
+# "show vlan extensive" output or the get-vlan-information RPC
+# vlan_dict {'tag': '','name': '','members': [], 'l3-interface': ''}
+@timed_phase()
+def extract_vlan_info(source, selected_vlan='all'):
+    return extract_records(vlan_plan, source, selected_vlan)
+
+# Collects all VLANs from the provided VLAN output
+def collect_vlan_list(source):
+    return extract_keys(vlan_plan, source)
+
+# "show vlans extensive" output or the get-vlan-information RPC, with the tagging and mode of the members
+# temp_ld [
+# vlan_dict {'name': '', 'tag': '', 'state': '', 'interfaces': [], 'tagness': [], 'modes': []}
+# ]
+@timed_phase()
+def extract_vlan_intf_info(source):
+    return extract_records(vlan_intf_plan, source)
+
+# "show spanning-tree interface" output or the get-stp-interface-information RPC, RSTP instances are skipped
+# stp_int_dict {'vlan_id': '', 'interfaces': [StpInterface, ...]}
+@timed_phase()
+def extract_stp_int(source, selected_vlan='all'):
+    return extract_records(stp_int_plan, source, selected_vlan)
+
+# Completes an STP bridge record: without topology changes there is no time or source of the last one, and the root
+# bridge has no root port or cost
+def finish_stp_bridge(stp_dict):
+    if stp_dict.get("topo_change_count") == "0":
+        stp_dict["time_since_last_tc"] = "0"
+        stp_dict["tc_initiator"] = ""
+        stp_dict["tc_last_recvd_from"] = ""
+    if stp_dict.is_root():
+        stp_dict["vlan_root_port"] = None
+        stp_dict["vlan_root_cost"] = None
+    return stp_dict
+
+# "show spanning-tree bridge" output or the get-stp-bridge-information RPC. The TC source is only in "show
+# spanning-tree bridge detail" captures.
+# stp_dict {'vlan-id': '', 'vlan_rb_mac': '', 'vlan_rb_prio': '', 'vlan_local_mac': '', 'vlan_local_prio': '',
+#           'topology_change_count': '', 'time_since_last_tc': '', 'vlan_root_port': '', 'vlan_root_cost': '',
+#           'tc_initiator': '', 'tc_last_recvd_from': ''}
+# Returns LD if selected_vlan is "all"
+# Returns Dict if selected_vlan is set
+@timed_phase()
+def extract_stp_info(source, selected_vlan='all'):
+    stp_ld = extract_records(stp_plan, source, selected_vlan)
+    if selected_vlan != 'all':
+        return finish_stp_bridge(stp_ld) if stp_ld else stp_ld
+    for stp_dict in stp_ld:
+        finish_stp_bridge(stp_dict)
+    return stp_ld
+
+# "show lldp neighbors" output or the get-lldp-neighbors-information RPC, as LLDP links. The parent (ie. ae0) and the
+# local port of each neighbor are both kept, so the links can be filtered by VLAN members (see lldp_neighbors())
+# links [{'parent_int': '', 'local_port': '', 'remote_chassis_id': '', 'remote_sysname': '',
+#         'remote_port': ''}]
+@timed_phase()
+def extract_lldp_links(source):
+    return extract_records(lldp_plan, source)
+
+# Extractors of a host's data: {kind: (kind of source, extractor of a JSON capture, XML capture or RPC reply)}
+host_extractors = {"vlan": ("vlan", extract_vlan_info),
+                   "vlan-list": ("vlan", collect_vlan_list),
+                   "vlan-intf": ("vlan", extract_vlan_intf_info),
+                   "stp": ("stp", extract_stp_info),
+                   "stp-int": ("stp-int", extract_stp_int),
+                   "lldp": ("lldp", extract_lldp_links)}
+
+# VLAN ranges of up to this many VLANs are collected with filtered RPCs, VLAN by VLAN. A longer range pulls every
+# VLAN at once, fewer round trips cost less than the larger replies.
+rpc_filter_limit = 16
+
+# Runs the RPC of an extraction plan's table, recording the RPC latency and the size of the reply
+# Returns the reply element
+def timed_plan_rpc(jdev, ip, name, plan, **kvargs):
+    rpc_args = dict(plan.args, **kvargs)
+    with device_timer(ip, "rpc", name):
+        reply = getattr(jdev.rpc, plan.rpc.replace("-", "_"))(**rpc_args)
+    if hasattr(reply, "iter"):
+        record_device_metric(ip, "payload", name, len(etree.tostring(reply)))
+    return reply
+
+# RPC arguments limiting a kind of data to one VLAN: the spanning tree RPCs take the VLAN id, get-vlan-information
+# only takes the VLAN name (vlan_names {tag: name}). None if the RPC can't be filtered.
+def vlan_rpc_args(kind, vlan, vlan_names):
+    if kind in ("stp", "stp-int"):
+        return {"vlan_id": vlan}
+    if kind == "vlan" and vlan in vlan_names:
+        return {"vlan_name": vlan_names[vlan]}
+    return None
+
+# The VLANs of a VLAN range like "100-120,300", as VLAN ids
+# Raises ValueError if an item isn't a VLAN id (1-4094) or an ascending range of them
+def parse_vlan_range(range_str):
+    vlans = []
+    for item in range_str.split(","):
+        if not item.strip():
+            continue
+        bounds = item.split("-")
+        if len(bounds) > 2 or not all(bound.strip().isdigit() for bound in bounds):
+            raise ValueError("{} isn't a VLAN id or a range of VLAN ids".format(item))
+        first, last = int(bounds[0]), int(bounds[-1])
+        if not 1 <= first <= 4094 or not 1 <= last <= 4094:
+            raise ValueError("{} is outside of the VLAN ids 1-4094".format(item))
+        if first > last:
+            raise ValueError("{} is a reversed range".format(item))
+        vlans.extend(str(vlan) for vlan in range(first, last + 1))
+    if not vlans:
+        raise ValueError("No VLANs in {}".format(range_str))
+    return vlans
+
+class Collector(ABC):
+    """ Reads one host's data for the extractors, the base of the collectors. """
+    # True if read() limits the data to the selected VLAN at the source, see collect_host_model()
+    filters_vlans = False
+
+    # The source of a kind of data (see the header), the collector may leave out the VLANs that aren't selected
+    @abstractmethod
+    def read(self, kind, selected_vlan='all'):
+        pass
+
+    # Context timing the extraction of a kind of data, only the network collector records it
+    def parsing(self, kind):
+        return nullcontext()
+
+    # Extracts a kind of data (see host_extractors), the record of the selected VLAN only if it is set
+    def extract(self, kind, selected_vlan='all'):
+        source_kind, extract = host_extractors[kind]
+        source = self.read(source_kind, selected_vlan)
+        with self.parsing(source_kind):
+            if selected_vlan == 'all':
+                return extract(source)
+            return extract(source, selected_vlan)
+
+class JsonCollector(Collector):
+    """ The "| display json" captures of a host in a repository. """
+
+    def __init__(self, repo, host):
+        self.repo = repo
+        self.host = host
+
+    def path(self, kind):
+        return os.path.join(self.repo, (self.host + host_file_suffixes[kind]))
+
+    def read(self, kind, selected_vlan='all'):
+        return json_to_dict(self.path(kind))
+
+class XmlCollector(JsonCollector):
+    """ The "| display xml" captures of a host in a repository, streamed by the extractors. """
+
+    def path(self, kind):
+        return os.path.join(self.repo, (self.host + xml_file_suffixes[kind]))
+
+    def read(self, kind, selected_vlan='all'):
+        return self.path(kind)
+
+class FileCollector(Collector):
+    """ The captures of a host in a repository, the JSON capture of each kind or the XML one if it only has that. """
+
+    def __init__(self, repo, host):
+        self.json = JsonCollector(repo, host)
+        self.xml = XmlCollector(repo, host)
+
+    # The XML capture of a kind, None if the host has the JSON capture (or neither)
+    def xml_file(self, kind):
+        if source_exists(self.json.path(kind)):
+            return None
+        if source_exists(self.xml.path(kind)):
+            return self.xml.path(kind)
+        return None
+
+    def read(self, kind, selected_vlan='all'):
+        return self.xml_file(kind) or self.json.read(kind)
+
+class NetconfCollector(Collector):
+    """ The RPC replies of a device over an open NETCONF session, with the RPC, payload and parse device metrics. """
+    filters_vlans = True
+
+    # log writes the progress messages (ie. stdout.write), none if it isn't set. vlan_names {tag: name} is shared by
+    # the collectors of a scan, the name of a VLAN is learned from the first device that returns it.
+    def __init__(self, jdev, ip, log=None, vlan_names=None):
+        self.jdev = jdev
+        self.ip = ip
+        self.log = log
+        self.vlan_names = vlan_names if vlan_names is not None else {}
+        # The records of the device's whole VLAN table, pulled at most once (see all_vlans())
+        self.vlan_table = None
+
+    # Sends the RPC of a kind of data with extra arguments, returns the reply element
+    def rpc(self, kind, rpc_args):
+        return timed_plan_rpc(self.jdev, self.ip, metric_names[kind], source_plans[kind], **rpc_args)
+
+    # A selected VLAN is filtered in the RPC arguments, so the device only returns (and builds) that VLAN's data
+    def read(self, kind, selected_vlan='all'):
+        rpc_args = None
+        if selected_vlan != 'all':
+            rpc_args = vlan_rpc_args(kind, selected_vlan, self.vlan_names)
+        if self.log:
+            vlan_text = " for VLAN " + selected_vlan if rpc_args else ""
+            self.log("-> Pulling " + pull_messages[kind] + " info" + vlan_text + " from " + self.ip + " ... \n")
+        return self.rpc(kind, rpc_args or {})
+
+    def parsing(self, kind):
+        return device_timer(self.ip, "parse", metric_names[kind])
+
+    # The records of the device's whole VLAN table, pulled once for all the selected VLANs whose name isn't known.
+    # The names of its VLANs are learned (replacing the names other devices gave them), so the devices collected after
+    # it pull those VLANs by name.
+    def all_vlans(self):
+        if self.vlan_table is None:
+            self.vlan_table = Collector.extract(self, "vlan")
+            for vlan_dict in self.vlan_table:
+                if vlan_dict.get("name"):
+                    self.vlan_names[vlan_dict["tag"]] = vlan_dict["name"]
+        return self.vlan_table
+
+    # A VLAN is pulled by the name the devices collected before gave it. Without a name, or once the device's VLAN
+    # table was pulled, it is read from the whole table. If it isn't returned by name but the device has its spanning
+    # tree instance, the device names it differently and it is read from the whole table too.
+    def extract(self, kind, selected_vlan='all'):
+        if kind != "vlan" or selected_vlan == 'all':
+            return Collector.extract(self, kind, selected_vlan)
+        if selected_vlan not in self.vlan_names or self.vlan_table is not None:
+            return select_vlan_record(self.all_vlans(), "tag", selected_vlan)
+        records = Collector.extract(self, kind, selected_vlan)
+        if not records and Collector.extract(self, "stp", selected_vlan):
+            return select_vlan_record(self.all_vlans(), "tag", selected_vlan)
+        return records
+
+class SimCollector(NetconfCollector):
+    """ The RPC replies netconf_sim.py builds from a host's JSON files, without a NETCONF session. """
+
+    def __init__(self, repo, host, sim_config=None, vlan_names=None):
+        from netconf_sim import SimDevice, default_sim_config
+        NetconfCollector.__init__(self, None, host, vlan_names=vlan_names)
+        self.device = SimDevice(host, "", repo, dict(default_sim_config, **(sim_config or {})), random.Random(1))
+
+    # Builds the RPC element like PyEZ does: True is an empty element, False leaves the argument out
+    def rpc(self, kind, rpc_args):
+        plan = source_plans[kind]
+        rpc = etree.Element(plan.rpc)
+        for name, value in dict(plan.args, **rpc_args).items():
+            if value is False:
+                continue
+            arg = etree.SubElement(rpc, name.replace("_", "-"))
+            if value is not True:
+                arg.text = str(value)
+        return etree.fromstring(self.device.reply_body(rpc))
+
+    def parsing(self, kind):
+        return nullcontext()
+
+# Collects the model of a host (see the header) for all VLANs, a selected VLAN or a list of VLANs (ie. a range).
+# Only the records of the selected VLANs are kept, and nothing but the VLAN is read for a VLAN the host doesn't carry.
+# A collector filtering at the source reads each selected VLAN on its own, unless there are more than rpc_filter_limit.
+# The network collectors pull a device's whole VLAN table at most once, for the VLANs whose name isn't known yet.
+@timed_phase()
+def collect_host_model(collector, selected_vlan='all'):
+    host_model = {}
+    if selected_vlan == 'all':
+        for kind in ("vlan", "stp", "stp-int", "lldp"):
+            host_model[kind] = collector.extract(kind)
+        return host_model
+    vlans = [selected_vlan] if type(selected_vlan) is str else list(selected_vlan)
+    if len(vlans) == 1 or (collector.filters_vlans and len(vlans) <= rpc_filter_limit):
+        host_model = {"vlan": [], "stp": [], "stp-int": []}
+        for vlan in vlans:
+            vlan_dict = collector.extract("vlan", vlan)
+            if not vlan_dict:
+                continue
+            host_model["vlan"].append(vlan_dict)
+            for kind in ("stp", "stp-int"):
+                record = collector.extract(kind, vlan)
+                if record:
+                    host_model[kind].append(record)
+    else:
+        selected = set(vlans)
+        host_model["vlan"] = [vlan_dict for vlan_dict in collector.extract("vlan") if vlan_dict["tag"] in selected]
+        host_model["stp"] = []
+        host_model["stp-int"] = []
+        if host_model["vlan"]:
+            for kind in ("stp", "stp-int"):
+                host_model[kind] = [record for record in collector.extract(kind) if record["vlan_id"] in selected]
+    host_model["lldp"] = collector.extract("lldp") if host_model["vlan"] else []
+    return host_model
+
+# Returns the first record of an LD matching the selected VLAN, or an empty list if none match
+def select_vlan_record(record_ld, key, selected_vlan):
+    for record in record_ld:
+        if record[key] == selected_vlan:
+            return record
+    return []
+
+# The records of a host model for a VLAN, like host_vlan_records() of the repository store ([] where it has none)
+# Returns (VlanInfo, StpBridge, StpInstance, the host's LLDP links)
+def model_vlan_records(host_model, selected_vlan):
+    vlan_dict = select_vlan_record(host_model["vlan"], "tag", selected_vlan)
+    stp_dict = select_vlan_record(host_model["stp"], "vlan_id", selected_vlan)
+    stp_int_dict = select_vlan_record(host_model["stp-int"], "vlan_id", selected_vlan)
+    return vlan_dict, stp_dict, stp_int_dict, host_model["lldp"]
@@ -0,0 +1,310 @@
+# File: macs.py
+# Purpose: MAC addresses as 48-bit integers, bridge IDs and a compact MAC table.
+#
+# MACs are parsed once with netaddr, so any format a chassis prints (2c:6b:f5:aa:bb:cc, 2C-6B-F5-AA-BB-CC,
+# 2c6b.f5aa.bbcc) gives the same integer and comparisons don't depend on formatting. The integers are formatted back
+# the way Junos prints them. A bridge ID is the priority in the top 16 bits and the MAC in the low 48 bits, so bridge
+# IDs order like STP elects the root bridge.
+#
+# MacTable keeps MAC table entries in typed arrays (8 bytes MAC, 2 bytes VLAN, 4 bytes interface index per entry)
+# instead of a dict per entry. Once sorted it supports lookup, merge joins with another table and OUI grouping.
+# Sorting a table briefly takes a Python int per entry, it is the table of one chassis.
+#
+# MacLocationIndex combines the MAC tables of all chassis, keyed by (MAC, VLAN) packed in one 64-bit integer, so a
+# million entries take about 15 MB and finding a MAC is a binary search. Each entry is flagged as learned on an access
+# edge port or on an uplink (trunk or LLDP port), a MAC on more than one edge port in a VLAN is reported as flapping.
+# The tables are added sorted, so sorting the index is a merge of the chassis runs that only takes a 4-byte position
+# per entry on top of the arrays it rebuilds.
+
+import bisect
+import functools
+import heapq
+import re
+from array import array
+
+import netaddr
+
+# Canonical Junos format, parsed without going through netaddr
+junos_mac_re = re.compile(r"^[0-9a-fA-F]{2}(:[0-9a-fA-F]{2}){5}$")
+
+# Parses a MAC address to a 48-bit integer, None if the value isn't a MAC
+@functools.lru_cache(maxsize=262144)
+def mac_to_int(value):
+    if type(value) is int:
+        return value
+    if not value:
+        return None
+    if junos_mac_re.match(value):
+        return int(value.replace(":", ""), 16)
+    try:
+        return netaddr.EUI(value).value
+    except (netaddr.AddrFormatError, TypeError, ValueError):
+        return None
+
+# Formats a 48-bit integer the way Junos prints a MAC address (ie. 2c:6b:f5:aa:bb:cc)
+@functools.lru_cache(maxsize=65536)
+def int_to_mac(value):
+    digits = "{:012x}".format(value)
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+# Returns the MAC normalized to the Junos format, or the value unchanged if it isn't a MAC
+def normalize_mac(value):
+    mac = mac_to_int(value)
+    if mac is None:
+        return value
+    return int_to_mac(mac)
+
+# Organizationally unique identifier (vendor part) of a MAC integer
+def mac_oui(mac):
+    return mac >> 24
+
+# Combines a bridge priority and MAC into a 64-bit bridge ID
+def bridge_id(priority, mac):
+    return (int(priority) << 48) | mac
+
+# Splits a bridge ID into (priority, MAC)
+def split_bridge_id(bid):
+    return bid >> 48, bid & 0xFFFFFFFFFFFF
+
+# MAC integer of a bridge given either as a MAC or as "priority.mac" (ie. 32768.2c:6b:f5:aa:bb:cc), None if neither
+def bridge_mac(value):
+    if not value:
+        return None
+    prefix, dot, rest = value.partition(".")
+    if dot and prefix.isdigit():
+        return mac_to_int(rest)
+    return mac_to_int(value)
+
+class MacTable(object):
+    """ Column store of MAC table entries: MAC, VLAN id and interface, one typed array per column. """
+    __slots__ = ("macs", "vlans", "intf_index", "interfaces", "intf_ids", "is_sorted")
+
+    def __init__(self):
+        self.macs = array('Q')
+        self.vlans = array('H')
+        self.intf_index = array('I')
+        # Interface names, stored once and referenced by index
+        self.interfaces = []
+        self.intf_ids = {}
+        self.is_sorted = True
+
+    # Adds an entry, the MAC as an integer or any MAC format, the VLAN id as a number (0 if unknown)
+    # Returns False if the MAC couldn't be parsed
+    def add(self, mac, vlan, interface):
+        mac = mac_to_int(mac)
+        if mac is None:
+            return False
+        intf_id = self.intf_ids.get(interface)
+        if intf_id is None:
+            intf_id = self.intf_ids[interface] = len(self.interfaces)
+            self.interfaces.append(interface)
+        vlan = vlan_number(vlan)
+        if self.is_sorted and self.macs and (mac, vlan) < (self.macs[-1], self.vlans[-1]):
+            self.is_sorted = False
+        self.macs.append(mac)
+        self.vlans.append(vlan)
+        self.intf_index.append(intf_id)
+        return True
+
+    def __len__(self):
+        return len(self.macs)
+
+    # Yields (mac, vlan, interface) of every entry
+    def __iter__(self):
+        interfaces = self.interfaces
+        for mac, vlan, intf_id in zip(self.macs, self.vlans, self.intf_index):
+            yield mac, vlan, interfaces[intf_id]
+
+    # Sorts the entries by MAC, then VLAN
+    def sort(self):
+        if self.is_sorted:
+            return self
+        # One packed (MAC, VLAN) int per entry instead of a key tuple
+        macs = self.macs
+        vlans = self.vlans
+        order = sorted(range(len(macs)), key=lambda i: (macs[i] << 16) | vlans[i])
+        self.macs = array('Q', (self.macs[i] for i in order))
+        self.vlans = array('H', (self.vlans[i] for i in order))
+        self.intf_index = array('I', (self.intf_index[i] for i in order))
+        self.is_sorted = True
+        return self
+
+    # Returns the [(vlan, interface)] entries of a MAC
+    def find(self, mac):
+        mac = mac_to_int(mac)
+        self.sort()
+        entries = []
+        index = bisect.bisect_left(self.macs, mac)
+        while index < len(self.macs) and self.macs[index] == mac:
+            entries.append((self.vlans[index], self.interfaces[self.intf_index[index]]))
+            index += 1
+        return entries
+
+    # Merge join on the MAC with another table
+    # Yields (mac, [(vlan, interface)] of this table, [(vlan, interface)] of the other table) for each common MAC
+    def join(self, other):
+        self.sort()
+        other.sort()
+        i = j = 0
+        while i < len(self.macs) and j < len(other.macs):
+            if self.macs[i] < other.macs[j]:
+                i += 1
+            elif self.macs[i] > other.macs[j]:
+                j += 1
+            else:
+                mac = self.macs[i]
+                mine = []
+                while i < len(self.macs) and self.macs[i] == mac:
+                    mine.append((self.vlans[i], self.interfaces[self.intf_index[i]]))
+                    i += 1
+                theirs = []
+                while j < len(other.macs) and other.macs[j] == mac:
+                    theirs.append((other.vlans[j], other.interfaces[other.intf_index[j]]))
+                    j += 1
+                yield mac, mine, theirs
+
+    # Number of entries per OUI
+    def oui_counts(self):
+        counts = {}
+        for mac in self.macs:
+            oui = mac >> 24
+            counts[oui] = counts.get(oui, 0) + 1
+        return counts
+
+# VLAN id as a number for the MAC table, 0 if it isn't numeric
+def vlan_number(vlan):
+    try:
+        return int(vlan)
+    except (TypeError, ValueError):
+        return 0
+
+class MacLocationIndex(object):
+    """ Where each (MAC, VLAN) is learned across all chassis, in typed arrays sorted by MAC then VLAN. """
+    __slots__ = ("keys", "chassis_index", "intf_index", "edge", "chassis", "interfaces", "intf_ids", "runs",
+                 "is_sorted")
+
+    # An entry takes 15 bytes: the (MAC, VLAN) key packed in 8 bytes, chassis and interface indexes and the edge flag
+    def __init__(self):
+        self.keys = array('Q')
+        self.chassis_index = array('H')
+        self.intf_index = array('I')
+        self.edge = array('B')
+        self.chassis = []
+        # Interface names, shared by all chassis and referenced by index
+        self.interfaces = []
+        self.intf_ids = {}
+        # Start of the sorted run of each added table
+        self.runs = []
+        self.is_sorted = True
+
+    # Adds the MAC table of a chassis, uplinks are the physical trunk and LLDP ports (ie. ge-0/0/0, ae0)
+    # A MAC learned on any other port is on an access edge port. The table is sorted, it is one run of the index.
+    def add_table(self, chassis, mac_table, uplinks):
+        mac_table.sort()
+        self.runs.append(len(self.keys))
+        chassis_id = len(self.chassis)
+        self.chassis.append(chassis)
+        # Map the interface indexes of the MAC table to this index once, not per entry
+        intf_map = []
+        edge_map = []
+        for interface in mac_table.interfaces:
+            intf_id = self.intf_ids.get(interface)
+            if intf_id is None:
+                intf_id = self.intf_ids[interface] = len(self.interfaces)
+                self.interfaces.append(interface)
+            intf_map.append(intf_id)
+            edge_map.append(0 if interface.split(".")[0] in uplinks else 1)
+        keys = array('Q', ((mac << 12) | (vlan & 0xFFF) for mac, vlan in zip(mac_table.macs, mac_table.vlans)))
+        intf_index = mac_table.intf_index
+        # The packed keys of VLAN ids above 12 bits don't keep the order of the sorted table
+        if mac_table.vlans and max(mac_table.vlans) > 0xFFF:
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            keys = array('Q', (keys[i] for i in order))
+            intf_index = array('I', (intf_index[i] for i in order))
+        self.keys.extend(keys)
+        self.chassis_index.extend([chassis_id] * len(mac_table))
+        self.intf_index.extend(intf_map[i] for i in intf_index)
+        self.edge.extend(edge_map[i] for i in intf_index)
+        self.is_sorted = len(self.runs) == 1
+        return self
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Sorts the entries by MAC, then VLAN, merging the sorted runs of the tables. Equal keys keep the order the
+    # tables were added in.
+    def sort(self):
+        if self.is_sorted:
+            return self
+        keys = self.keys
+        ends = self.runs[1:] + [len(keys)]
+        order = array('I', heapq.merge(*[range(start, end) for start, end in zip(self.runs, ends)],
+                                        key=keys.__getitem__))
+        self.keys = array('Q', (self.keys[i] for i in order))
+        self.chassis_index = array('H', (self.chassis_index[i] for i in order))
+        self.intf_index = array('I', (self.intf_index[i] for i in order))
+        self.edge = array('B', (self.edge[i] for i in order))
+        self.runs = [0]
+        self.is_sorted = True
+        return self
+
+    # Location of the entry at a position
+    # location {'mac': 0, 'vlan': 0, 'chassis': '', 'interface': '', 'edge': True}
+    def location(self, index):
+        key = self.keys[index]
+        return {"mac": key >> 12, "vlan": key & 0xFFF, "chassis": self.chassis[self.chassis_index[index]],
+                "interface": self.interfaces[self.intf_index[index]], "edge": bool(self.edge[index])}
+
+    # Returns the locations of a MAC, in every VLAN or only the given one
+    def locate(self, mac, vlan=None):
+        mac = mac_to_int(mac)
+        if mac is None:
+            return []
+        self.sort()
+        if vlan is None:
+            low, high = mac << 12, (mac + 1) << 12
+        else:
+            low = (mac << 12) | (vlan_number(vlan) & 0xFFF)
+            high = low + 1
+        locations = []
+        index = bisect.bisect_left(self.keys, low)
+        while index < len(self.keys) and self.keys[index] < high:
+            locations.append(self.location(index))
+            index += 1
+        return locations
+
+    # Yields (mac, vlan, [(chassis, interface)]) for each (MAC, VLAN) learned on more than one edge port
+    def flaps(self):
+        self.sort()
+        keys = self.keys
+        count = len(keys)
+        index = 1
+        while index < count:
+            # Only keys that repeat can be on more than one port
+            if keys[index] != keys[index - 1]:
+                index += 1
+                continue
+            key = keys[index]
+            start = index - 1
+            while index < count and keys[index] == key:
+                index += 1
+            edge_ports = []
+            for entry in range(start, index):
+                if self.edge[entry]:
+                    port = (self.chassis[self.chassis_index[entry]], self.interfaces[self.intf_index[entry]])
+                    if port not in edge_ports:
+                        edge_ports.append(port)
+            if len(edge_ports) > 1:
+                yield key >> 12, key & 0xFFF, edge_ports
+
+    # stats {'entries': 0, 'edge_entries': 0, 'mac_vlans': 0, 'chassis': 0}
+    def stats(self):
+        self.sort()
+        mac_vlans = 0
+        last_key = None
+        for key in self.keys:
+            if key != last_key:
+                mac_vlans += 1
+                last_key = key
+        return {"entries": len(self.keys), "edge_entries": sum(self.edge), "mac_vlans": mac_vlans,
+                "chassis": len(self.chassis)}
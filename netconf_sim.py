@@ -0,0 +1,495 @@
+# File: netconf_sim.py
+# Purpose: Local NETCONF-over-SSH stand-in for the switches of a repository, used to test and benchmark the
+# network-based functions of stpmap.py without real chassis.
+#
+# Each host of the repository gets its own loopback address (127.1.0.1, 127.1.0.2, ...), all listening on the same
+# port, so the network functions connect to a simulated switch exactly like a real one. The whole 127.0.0.0/8 range is
+# local on Linux, other platforms need the addresses added to the loopback interface first.
+#
+# RPC replies are built from the host's JSON files, converted back to the XML the RPC returns on a real chassis:
+# - get-vlan-information                        <host>_vlan-ext.json
+# - get-stp-bridge-information                  <host>_stp.json
+# - get-stp-interface-information               <host>_stp-int.json
+# - get-lldp-neighbors-information              <host>_lldp.json
+# - get-ethernet-switching-table-information    <host>_ether-sw.json (empty table if missing)
+# - get-interface-information                   <host>_int.json (built from the VLAN and LLDP ports if missing)
+# - get-software-information, "show version"    facts (hostname, model, version)
+# The VLAN filters of the RPCs are honored like on a chassis: vlan-name for get-vlan-information, vlan-id for the
+# spanning tree RPCs. A filtered reply only holds the items of that VLAN.
+# Any other RPC is answered with an rpc-error, which the PyEZ fact gathering tolerates.
+#
+# Only NETCONF base:1.0 is advertised, so every message is framed with "]]>]]>". Replies can be delayed per RPC and
+# failures injected, either as an rpc-error reply or as a session dropped without a reply.
+#
+# Usage:
+# python netconf_sim.py -r <repo dir> [-w <dev_list dir>] [--port N] [--base 127.1.0.1] [--latency S]
+#                       [--rpc-latency rpc=S,rpc=S] [--jitter S] [--fail-rate P] [--drop-rate P]
+# python netconf_sim.py --synthetic 50x200 ...  (generates the repository with stpbench.py)
+
+import fnmatch
+import getopt
+import ipaddress
+import json
+import os
+import random
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+from lxml import etree
+
+# NETCONF framing and namespaces
+netconf_base = "urn:ietf:params:xml:ns:netconf:base:1.0"
+netconf_eom = b"]]>]]>"
+junos_ns = "http://xml.juniper.net/junos/18.4R2/junos"
+
+# Repository file answering each RPC
+rpc_files = {"get-vlan-information": "_vlan-ext.json",
+             "get-stp-bridge-information": "_stp.json",
+             "get-stp-interface-information": "_stp-int.json",
+             "get-lldp-neighbors-information": "_lldp.json",
+             "get-ethernet-switching-table-information": "_ether-sw.json",
+             "get-interface-information": "_int.json"}
+
+# VLAN filters of the RPCs: {rpc: {argument: (item element, key element)}}
+rpc_filters = {"get-vlan-information": {"vlan-name": ("l2ng-l2ald-vlan-instance-group", "l2ng-l2rtb-vlan-name")},
+               "get-stp-bridge-information": {"vlan-id": ("vst-bridge-parameters", "vlan-id")},
+               "get-stp-interface-information": {"vlan-id": ("stp-instance", "vlan-id")}}
+
+# Reply root used when the host has no file for the RPC
+empty_replies = {"get-ethernet-switching-table-information": "l2ng-l2ald-rtb-macdb",
+                 "get-interface-information": "interface-information"}
+
+# Default simulator settings
+# latency: seconds before each reply, per RPC name with a "default" entry, jitter: random extra seconds (0 to jitter)
+# fail_rate: chance an RPC gets an rpc-error, drop_rate: chance the session is dropped instead of replying
+default_sim_config = {"port": 8300, "base": "127.1.0.1", "latency": {"default": 0.0}, "jitter": 0.0,
+                      "fail_rate": 0.0, "drop_rate": 0.0, "user": None, "password": None, "model": "ex4300-48t",
+                      "version": "18.4R2.7", "seed": 1}
+
+# --------------------------------------
+# REPLY BUILDING
+# --------------------------------------
+# Adds the elements of a Junos JSON value to a parent element
+# The JSON of each element is a list of entries, an entry holds the text in "data" and the children under their tags
+def add_json_elements(parent, tag, value):
+    if not isinstance(value, list):
+        value = [value]
+    for entry in value:
+        child = etree.SubElement(parent, tag)
+        if not isinstance(entry, dict):
+            child.text = str(entry)
+            continue
+        for key, sub_value in entry.items():
+            if key == "data":
+                child.text = str(sub_value)
+            elif key == "attributes":
+                # Namespaced attributes (ie. junos:style) are left out, they only carry formatting hints
+                for name, attr in sub_value.items():
+                    if ":" not in name:
+                        child.set(name, str(attr))
+            else:
+                add_json_elements(child, key, sub_value)
+
+# Converts a Junos JSON document (ie. the output of "| display json") to the XML element of the RPC reply
+def json_to_xml(raw_dict):
+    holder = etree.Element("holder")
+    for tag, value in raw_dict.items():
+        add_json_elements(holder, tag, value)
+    return holder[0]
+
+# Interface names of a host, from the VLAN members and the LLDP neighbors
+def host_interfaces(repo, host):
+    intf_list = []
+    vlan_file = os.path.join(repo, host + rpc_files["get-vlan-information"])
+    lldp_file = os.path.join(repo, host + rpc_files["get-lldp-neighbors-information"])
+    if os.path.isfile(vlan_file):
+        with open(vlan_file) as f:
+            vlan_xml = json_to_xml(json.load(f))
+        for member in vlan_xml.iter("l2ng-l2rtb-vlan-member-interface"):
+            intf_list.append(member.text.rstrip("*").split(".")[0])
+    if os.path.isfile(lldp_file):
+        with open(lldp_file) as f:
+            lldp_xml = json_to_xml(json.load(f))
+        for local_port in lldp_xml.iter("lldp-local-port-id", "lldp-local-interface"):
+            intf_list.append(local_port.text.split(".")[0])
+    return sorted(set(intf_list))
+
+# Builds an interface-information reply from the interfaces a host uses, all up at 1G
+def build_interface_xml(repo, host):
+    intf_xml = etree.Element("interface-information")
+    for index, name in enumerate(host_interfaces(repo, host)):
+        phy = etree.SubElement(intf_xml, "physical-interface")
+        for tag, text in (("name", name), ("admin-status", "up"), ("oper-status", "up"), ("mtu", "1514"),
+                          ("speed", "1000mbps"), ("link-mode", "Full-duplex"),
+                          ("current-physical-address", "02:00:00:00:{:02x}:{:02x}".format(index // 256, index % 256))):
+            etree.SubElement(phy, tag).text = text
+    return intf_xml
+
+# Builds a software-information reply for the device facts
+def build_software_xml(host, sim_config):
+    sw_xml = etree.Element("software-information")
+    etree.SubElement(sw_xml, "host-name").text = host
+    etree.SubElement(sw_xml, "product-model").text = sim_config["model"]
+    etree.SubElement(sw_xml, "product-name").text = sim_config["model"]
+    etree.SubElement(sw_xml, "junos-version").text = sim_config["version"]
+    return sw_xml
+
+# Keeps only the physical interfaces matching the requested interface name (ie. '[efgx][et]-*')
+def filter_interfaces(intf_xml, pattern):
+    for phy in intf_xml.findall("physical-interface"):
+        if not fnmatch.fnmatch(phy.findtext("name", ""), pattern):
+            intf_xml.remove(phy)
+    return intf_xml
+
+# Keeps only the items (ie. vst-bridge-parameters) whose key element is the requested value
+def filter_items(body_xml, item_tag, key_tag, value):
+    for item in list(body_xml.iter(item_tag)):
+        if (item.findtext(key_tag) or "").strip() != value:
+            item.getparent().remove(item)
+    return body_xml
+
+# Returns an rpc-error body
+def rpc_error_body(message):
+    error_xml = etree.Element("rpc-error")
+    for tag, text in (("error-type", "protocol"), ("error-tag", "operation-failed"), ("error-severity", "error"),
+                      ("error-message", message)):
+        etree.SubElement(error_xml, tag).text = text
+    return etree.tostring(error_xml).decode()
+
+# --------------------------------------
+# SIMULATED DEVICE
+# --------------------------------------
+class SimDevice(object):
+    """ One simulated switch: its address and the replies built from its repository files. """
+
+    def __init__(self, host, address, repo, sim_config, rand):
+        self.host = host
+        self.address = address
+        self.repo = repo
+        self.sim_config = sim_config
+        self.rand = rand
+        self.lock = threading.Lock()
+        # rpc name -> serialized reply body, built on first use
+        self.replies = {}
+        self.rpc_count = 0
+
+    # Returns the serialized reply body of an RPC, None if the RPC isn't supported
+    def reply_body(self, rpc):
+        name = etree.QName(rpc).localname
+        if name == "command":
+            if (rpc.text or "").strip().startswith("show version"):
+                name = "get-software-information"
+            else:
+                return None
+        if name == "get-interface-information":
+            # The interface name filter changes the reply, so it isn't cached
+            intf_xml = etree.fromstring(self.cached_body(name))
+            for child in rpc:
+                if etree.QName(child).localname == "interface-name" and child.text:
+                    filter_interfaces(intf_xml, child.text)
+            return etree.tostring(intf_xml).decode()
+        if name not in rpc_files and name != "get-software-information":
+            return None
+        filters = []
+        for child in rpc:
+            arg = etree.QName(child).localname
+            if arg in rpc_filters.get(name, {}) and child.text:
+                filters.append(rpc_filters[name][arg] + (child.text.strip(),))
+        if filters:
+            # The VLAN filters change the reply, so it isn't cached
+            body_xml = etree.fromstring(self.cached_body(name))
+            for item_tag, key_tag, value in filters:
+                filter_items(body_xml, item_tag, key_tag, value)
+            return etree.tostring(body_xml).decode()
+        return self.cached_body(name)
+
+    # Builds (once) and returns the reply body of an RPC
+    def cached_body(self, name):
+        with self.lock:
+            if name not in self.replies:
+                if name == "get-software-information":
+                    body_xml = build_software_xml(self.host, self.sim_config)
+                else:
+                    json_file = os.path.join(self.repo, self.host + rpc_files[name])
+                    if os.path.isfile(json_file):
+                        with open(json_file) as f:
+                            body_xml = json_to_xml(json.load(f))
+                    elif name == "get-interface-information":
+                        body_xml = build_interface_xml(self.repo, self.host)
+                    else:
+                        body_xml = etree.Element(empty_replies.get(name, name.replace("get-", "", 1)))
+                self.replies[name] = etree.tostring(body_xml).decode()
+            return self.replies[name]
+
+    # Seconds to wait before replying to an RPC
+    def rpc_latency(self, name):
+        latency_dict = self.sim_config["latency"]
+        delay = latency_dict.get(name, latency_dict.get("default", 0.0))
+        if self.sim_config["jitter"]:
+            with self.lock:
+                delay += self.rand.uniform(0, self.sim_config["jitter"])
+        return delay
+
+    # Draws the injected failure of an RPC: "drop", "error" or None
+    def rpc_failure(self):
+        with self.lock:
+            draw = self.rand.random()
+        if draw < self.sim_config["drop_rate"]:
+            return "drop"
+        if draw < self.sim_config["drop_rate"] + self.sim_config["fail_rate"]:
+            return "error"
+        return None
+
+# SSH side of a simulated device, accepts the configured credentials (any if not set) and the netconf subsystem
+class SimSSHServer(paramiko.ServerInterface):
+
+    def __init__(self, sim_config):
+        self.sim_config = sim_config
+        self.netconf_event = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.sim_config["user"] and username != self.sim_config["user"]:
+            return paramiko.AUTH_FAILED
+        if self.sim_config["password"] and password != self.sim_config["password"]:
+            return paramiko.AUTH_FAILED
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name == "netconf":
+            self.netconf_event.set()
+            return True
+        return False
+
+# Reads NETCONF messages from a channel, yields each message without its end of message marker
+def read_messages(channel):
+    buffer = b""
+    while True:
+        data = channel.recv(65536)
+        if not data:
+            return
+        buffer += data
+        while netconf_eom in buffer:
+            message, buffer = buffer.split(netconf_eom, 1)
+            yield message
+
+# Runs the NETCONF session of one device on an SSH channel
+def netconf_session(channel, device, session_id):
+    hello = ('<?xml version="1.0" encoding="UTF-8"?><hello xmlns="{}"><capabilities>'
+             '<capability>urn:ietf:params:netconf:base:1.0</capability>'
+             '<capability>http://xml.juniper.net/netconf/junos/1.0</capability>'
+             '</capabilities><session-id>{}</session-id></hello>').format(netconf_base, session_id)
+    channel.sendall(hello.encode() + netconf_eom)
+    for message in read_messages(channel):
+        try:
+            request = etree.fromstring(message.strip())
+        except etree.XMLSyntaxError:
+            continue
+        # The client hello needs no reply
+        if etree.QName(request).localname != "rpc" or not len(request):
+            continue
+        rpc = request[0]
+        name = etree.QName(rpc).localname
+        device.rpc_count += 1
+        if name == "close-session":
+            body = "<ok/>"
+        else:
+            failure = device.rpc_failure()
+            if failure == "drop":
+                return
+            delay = device.rpc_latency(name)
+            if delay:
+                time.sleep(delay)
+            body = rpc_error_body("injected failure of " + name) if failure else device.reply_body(rpc)
+            if body is None:
+                body = rpc_error_body("syntax error, expecting <command>: " + name)
+        reply = '<rpc-reply xmlns="{}" xmlns:junos="{}" message-id="{}">{}</rpc-reply>'.format(
+            netconf_base, junos_ns, request.get("message-id", ""), body)
+        channel.sendall(reply.encode() + netconf_eom)
+        if name == "close-session":
+            return
+
+# --------------------------------------
+# SIMULATOR
+# --------------------------------------
+class NetconfSimulator(object):
+    """ Serves every host of a repository as a NETCONF device on its own loopback address. """
+
+    def __init__(self, repo, sim_config=None):
+        self.repo = repo
+        self.sim_config = dict(default_sim_config)
+        self.sim_config.update(sim_config or {})
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.selector = selectors.DefaultSelector()
+        self.devices = {}
+        self.sessions = 0
+        self.running = False
+        self.accept_thread = None
+        with open(os.path.join(repo, "dev_list.json")) as f:
+            hosts = sorted(json.load(f))
+        rand = random.Random(self.sim_config["seed"])
+        address = ipaddress.ip_address(self.sim_config["base"])
+        for host in hosts:
+            self.devices[str(address)] = SimDevice(host, str(address), repo, self.sim_config,
+                                                   random.Random(rand.random()))
+            address += 1
+
+    # Host -> simulated address, in the dev_list.json format
+    def dev_list(self):
+        return dict((device.host, address) for address, device in self.devices.items())
+
+    # Writes the dev_list.json of the simulated devices into a directory
+    def write_dev_list(self, out_dir):
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        with open(os.path.join(out_dir, "dev_list.json"), 'w') as w:
+            json.dump(self.dev_list(), w, indent=2)
+
+    # Opens a listening socket per device and starts accepting sessions in the background
+    def start(self):
+        for address in self.devices:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((address, self.sim_config["port"]))
+            listener.listen(64)
+            listener.setblocking(False)
+            self.selector.register(listener, selectors.EVENT_READ, self.devices[address])
+        self.running = True
+        self.accept_thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self.accept_thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.accept_thread:
+            self.accept_thread.join()
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def accept_loop(self):
+        while self.running:
+            for key, mask in self.selector.select(timeout=0.2):
+                try:
+                    sock, peer = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                sock.setblocking(True)
+                self.sessions += 1
+                threading.Thread(target=self.serve_connection, args=(sock, key.data, self.sessions),
+                                 daemon=True).start()
+
+    # Runs the SSH transport of one connection
+    def serve_connection(self, sock, device, session_id):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.host_key)
+        server = SimSSHServer(self.sim_config)
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(timeout=30)
+            if channel is not None and server.netconf_event.wait(timeout=30):
+                netconf_session(channel, device, session_id)
+        except (paramiko.SSHException, EOFError, OSError):
+            pass
+        finally:
+            transport.close()
+
+    # Total RPCs served, per host
+    def rpc_counts(self):
+        return dict((device.host, device.rpc_count) for device in self.devices.values())
+
+# Parses "get-vlan-information=0.5,get-stp-bridge-information=0.2" into a latency dictionary
+def parse_rpc_latency(latency_str, latency_dict):
+    for item in latency_str.split(","):
+        name, seconds = item.split("=")
+        latency_dict[name.strip()] = float(seconds)
+    return latency_dict
+
+usage = ("netconf_sim.py -r <repo dir> | --synthetic <switches>x<vlans> [-w <dev_list dir>] [--port N] "
+         "[--base 127.1.0.1]\n"
+         "               [--latency S] [--rpc-latency rpc=S,...] [--jitter S] [--fail-rate P] [--drop-rate P] "
+         "[--user U] [--password P]")
+
+# Main execution
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hr:w:", ["synthetic=", "port=", "base=", "latency=",
+                                                           "rpc-latency=", "jitter=", "fail-rate=", "drop-rate=",
+                                                           "user=", "password="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    sim_config = {"latency": {"default": 0.0}}
+    repo = ""
+    synthetic = ""
+    dev_list_dir = ""
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-r":
+            repo = arg
+        elif opt == "-w":
+            dev_list_dir = arg
+        elif opt == "--synthetic":
+            synthetic = arg
+        elif opt == "--port":
+            sim_config["port"] = int(arg)
+        elif opt == "--base":
+            sim_config["base"] = arg
+        elif opt == "--latency":
+            sim_config["latency"]["default"] = float(arg)
+        elif opt == "--rpc-latency":
+            parse_rpc_latency(arg, sim_config["latency"])
+        elif opt in ("--jitter", "--fail-rate", "--drop-rate"):
+            sim_config[opt.lstrip("-").replace("-", "_")] = float(arg)
+        else:
+            sim_config[opt.lstrip("-")] = arg
+    work_dir = ""
+    if synthetic:
+        from stpbench import generate_repository, parse_scales
+        switches, vlans = parse_scales(synthetic)[0]
+        work_dir = tempfile.mkdtemp(prefix="netconf_sim_")
+        repo = os.path.join(work_dir, "{}x{}".format(switches, vlans))
+        generate_repository(repo, switches, vlans)
+    if not repo:
+        print(usage)
+        sys.exit(2)
+    try:
+        simulator = NetconfSimulator(repo, sim_config)
+        if dev_list_dir:
+            simulator.write_dev_list(dev_list_dir)
+            print("Simulated dev_list.json written to {}".format(dev_list_dir))
+        with simulator:
+            addresses = list(simulator.devices)
+            print("Simulating {} devices from {} on port {} ({} - {}), Ctrl-C to stop".format(
+                len(addresses), repo, simulator.sim_config["port"], addresses[0], addresses[-1]))
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                print("\n-> Served {} RPCs over {} sessions".format(sum(simulator.rpc_counts().values()),
+                                                                     simulator.sessions))
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,416 @@
+# File: profiler.py
+# Purpose: Per-phase timing spans for the "--profile" report.
+#
+# Spans are aggregated per phase and per host. When profiling is disabled a timed function only pays for one extra
+# call and a flag check. Phase times are inclusive, ie. the "root_bridge_analysis" phase contains the file reads and
+# extraction phases it runs.
+#
+# Memory profiling ("--memory") uses the same phases to record the peak memory of each phase and host: the peak of the
+# Python allocations traced by tracemalloc and the peak RSS of the process, sampled by a background thread. Like the
+# times, the peaks are inclusive of the nested phases. Tracing slows everything down, so the times of a memory
+# profiled run aren't representative.
+#
+# Phases may run in worker threads (ie. the parallel MAC scan): the host of the spans is kept per thread and the
+# aggregates are updated under a lock. The tracemalloc and RSS peaks are process-wide, so memory is only recorded for
+# the phases of the thread that enabled memory profiling, the phases of the workers count towards its enclosing phase.
+
+import functools
+import json
+import mmap
+import platform
+import threading
+import time
+import tracemalloc
+
+# Unix only, the RSS isn't sampled without /proc or resource (ie. Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from prettytable import PrettyTable
+
+# Profiling state
+profile_enabled = False
+# The host being processed by each thread (profile_state.host), spans are attributed to it
+profile_state = threading.local()
+# Guards the aggregates updated by worker threads (profile_spans, device_metrics)
+profile_lock = threading.Lock()
+# (phase, host) -> [calls, total seconds, max seconds]
+profile_spans = {}
+# Phases that run inside another timed phase of the same host
+nested_phases = {"file_read", "json_decode"}
+
+def enable_profiling(enabled=True):
+    global profile_enabled
+    profile_enabled = enabled
+
+# Set the host that following spans of this thread are attributed to
+def set_profile_host(host):
+    profile_state.host = host
+
+# The host that spans of this thread are attributed to
+def profile_host():
+    return getattr(profile_state, "host", "")
+
+# True if memory is recorded for the phases of this thread
+def memory_thread_active():
+    return memory_enabled and threading.current_thread() is memory_thread
+
+# Clear the collected spans
+def reset_profile():
+    profile_spans.clear()
+    reset_memory()
+
+# Add one timing to the aggregated spans
+def add_span(phase, host, elapsed):
+    with profile_lock:
+        span = profile_spans.get((phase, host))
+        if span is None:
+            profile_spans[(phase, host)] = [1, elapsed, elapsed]
+        else:
+            span[0] += 1
+            span[1] += elapsed
+            if elapsed > span[2]:
+                span[2] = elapsed
+
+# Decorator that times every call of a function, the phase defaults to the function name
+def timed_phase(phase=None):
+    def decorator(func):
+        phase_name = phase or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profile_enabled:
+                return func(*args, **kwargs)
+            memory = memory_thread_active()
+            if memory:
+                memory_enter()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_span(phase_name, profile_host(), time.perf_counter() - start)
+                if memory:
+                    memory_exit(phase_name, profile_host())
+        return wrapper
+    return decorator
+
+# Context manager that times a block of code as a phase
+class timed_span(object):
+    __slots__ = ("phase", "start", "memory")
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.start = 0.0
+        self.memory = False
+
+    def __enter__(self):
+        if profile_enabled:
+            self.memory = memory_thread_active()
+            if self.memory:
+                memory_enter()
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if profile_enabled:
+            add_span(self.phase, profile_host(), time.perf_counter() - self.start)
+            if self.memory:
+                memory_exit(self.phase, profile_host())
+        return False
+
+# Aggregate the spans per phase and per host
+# profile_dict {'phases': {phase: {'calls': 0, 'total': 0.0, 'max': 0.0}}, 'hosts': {host: {phase: {...}}}}
+def profile_summary():
+    profile_dict = {"phases": {}, "hosts": {}}
+    for (phase, host), (calls, total, longest) in profile_spans.items():
+        phase_dict = profile_dict["phases"].setdefault(phase, {"calls": 0, "total": 0.0, "max": 0.0})
+        phase_dict["calls"] += calls
+        phase_dict["total"] += total
+        phase_dict["max"] = max(phase_dict["max"], longest)
+        if host:
+            profile_dict["hosts"].setdefault(host, {})[phase] = {"calls": calls, "total": total, "max": longest}
+    return profile_dict
+
+# Print the phase and slowest host tables and write the summary to a JSON file
+def print_profile_report(json_file, top=10):
+    if not profile_enabled or not profile_spans:
+        return
+    profile_dict = profile_summary()
+    phase_table = PrettyTable(["Phase", "Calls", "Total (s)", "Mean (ms)", "Max (ms)"])
+    phase_table.align = "r"
+    phase_table.align["Phase"] = "l"
+    for phase, phase_dict in sorted(profile_dict["phases"].items(), key=lambda p: -p[1]["total"]):
+        phase_table.add_row([phase, phase_dict["calls"], "{:.3f}".format(phase_dict["total"]),
+                             "{:.2f}".format(phase_dict["total"] * 1000 / phase_dict["calls"]),
+                             "{:.2f}".format(phase_dict["max"] * 1000)])
+    host_table = PrettyTable(["Host", "Total (s)", "Slowest Phase", "Phase Total (s)"])
+    host_table.align = "r"
+    host_table.align["Host"] = "l"
+    host_totals = []
+    for host, phases in profile_dict["hosts"].items():
+        slowest = max(phases, key=lambda p: phases[p]["total"])
+        # Only count the outermost phases of a host, nested phases would be counted twice
+        total = sum(phase_dict["total"] for phase, phase_dict in phases.items() if phase not in nested_phases)
+        host_totals.append((total, host, slowest, phases[slowest]["total"]))
+    for total, host, slowest, slowest_total in sorted(host_totals, reverse=True)[:top]:
+        host_table.add_row([host, "{:.3f}".format(total), slowest, "{:.3f}".format(slowest_total)])
+    print("*" * 50 + "\n" + " " * 10 + "Profile Report\n" + "*" * 50)
+    print(phase_table)
+    print("Slowest {} hosts".format(top))
+    print(host_table)
+    with open(json_file, 'w') as w:
+        json.dump(profile_dict, w, indent=2)
+    print("Profile written to {}".format(json_file))
+
+# --------------------------------------
+# DEVICE METRICS
+# --------------------------------------
+# ip -> {'connect': {name: seconds}, 'rpc': {name: seconds}, 'parse': {name: seconds}, 'payload': {name: bytes}}
+device_metrics = {}
+
+# Clear the collected device metrics
+def reset_device_metrics():
+    device_metrics.clear()
+
+# Record one metric of a device, repeated metrics of the same name are added together
+def record_device_metric(ip, kind, name, value):
+    with profile_lock:
+        kind_dict = device_metrics.setdefault(ip, {"connect": {}, "rpc": {}, "parse": {}, "payload": {}})[kind]
+        kind_dict[name] = kind_dict.get(name, 0) + value
+
+# Context manager that times a block of code as a device metric
+class device_timer(object):
+    __slots__ = ("ip", "kind", "name", "start")
+
+    def __init__(self, ip, kind, name):
+        self.ip = ip
+        self.kind = kind
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record_device_metric(self.ip, self.kind, self.name, time.perf_counter() - self.start)
+        return False
+
+# Nearest-rank percentile of a sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+# Print the latency percentiles and the slowest devices, and write the metrics to a JSON file
+# names is an optional ip -> hostname dictionary used to label the devices
+def print_device_report(json_file, names=None, top=10):
+    if not device_metrics:
+        return
+    names = names or {}
+    # Collect the values of each metric across the devices
+    metric_values = {}
+    for ip, metrics in device_metrics.items():
+        for kind in ("connect", "rpc", "parse"):
+            for name, value in metrics[kind].items():
+                metric_values.setdefault((kind, name), []).append(value)
+        for name, value in metrics["payload"].items():
+            metric_values.setdefault(("payload", name), []).append(value / 1024.0)
+    pct_table = PrettyTable(["Metric", "Devices", "p50", "p90", "p99", "Max"])
+    pct_table.align = "r"
+    pct_table.align["Metric"] = "l"
+    for (kind, name), values in sorted(metric_values.items()):
+        values.sort()
+        unit = "KB" if kind == "payload" else "s"
+        pct_table.add_row(["{} {} ({})".format(kind, name, unit), len(values)] +
+                          ["{:.3f}".format(percentile(values, pct)) for pct in (50, 90, 99)] +
+                          ["{:.3f}".format(values[-1])])
+
+    # Rank the devices by their total collection time
+    device_totals = []
+    for ip, metrics in device_metrics.items():
+        connect = sum(metrics["connect"].values())
+        rpc = sum(metrics["rpc"].values())
+        parse = sum(metrics["parse"].values())
+        slowest_rpc = max(metrics["rpc"], key=metrics["rpc"].get) if metrics["rpc"] else "-"
+        device_totals.append((connect + rpc + parse, ip, connect, rpc, parse,
+                              sum(metrics["payload"].values()) / 1024.0, slowest_rpc))
+    slow_table = PrettyTable(["Device", "Connect (s)", "RPC (s)", "Parse (s)", "Payload (KB)", "Total (s)",
+                              "Slowest RPC"])
+    for total, ip, connect, rpc, parse, payload, slowest_rpc in sorted(device_totals, reverse=True)[:top]:
+        label = "{} ({})".format(names[ip], ip) if ip in names else ip
+        slow_table.add_row([label, "{:.3f}".format(connect), "{:.3f}".format(rpc), "{:.3f}".format(parse),
+                            "{:.1f}".format(payload), "{:.3f}".format(total), slowest_rpc])
+    print("*" * 50 + "\n" + " " * 10 + "Device Collection Metrics\n" + "*" * 50)
+    print(pct_table)
+    print("Slowest {} devices".format(top))
+    print(slow_table)
+    with open(json_file, 'w') as w:
+        json.dump(device_metrics, w, indent=2)
+    print("Device metrics written to {}".format(json_file))
+
+# --------------------------------------
+# MEMORY PROFILING
+# --------------------------------------
+memory_enabled = False
+# (phase, host) -> [traced peak bytes, rss peak bytes, traced growth bytes]
+# The growth is the traced peak of the phase above the traced memory it started with, ie. what a host's files cost
+memory_spans = {}
+# Open phases, each [traced peak, rss peak, traced at start], the peaks seen before a nested phase reset them
+memory_stack = []
+# Background RSS sampler, running while memory profiling is enabled
+rss_sampler = None
+# The thread whose phases are memory profiled, the one that enabled memory profiling
+memory_thread = None
+
+# Current RSS of the process in bytes, the peak RSS where /proc isn't available (ie. Mac), 0 if neither is (Windows)
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, IndexError, ValueError):
+        if resource is None:
+            return 0
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, Mac reports bytes
+        return maxrss * 1024 if platform.system() == "Linux" else maxrss
+
+class RssSampler(threading.Thread):
+    """ Samples the RSS of the process, keeping the peak since the last reset. """
+
+    def __init__(self, interval=0.01):
+        threading.Thread.__init__(self, daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        rss = current_rss()
+        if rss > self.peak:
+            self.peak = rss
+        return rss
+
+    # Returns the peak since the last reset and starts a new peak from the current RSS
+    def reset_peak(self):
+        peak = self.peak
+        self.peak = current_rss()
+        return max(peak, self.peak)
+
+    def stop(self):
+        self.running = False
+
+# Starts (or stops) tracemalloc and the RSS sampler, memory is recorded for the timed phases so profiling is enabled too
+def enable_memory_profiling(enabled=True, interval=0.01):
+    global memory_enabled
+    global rss_sampler
+    global memory_thread
+    if enabled and not memory_enabled:
+        tracemalloc.start()
+        rss_sampler = RssSampler(interval)
+        rss_sampler.start()
+        memory_thread = threading.current_thread()
+        enable_profiling()
+    elif not enabled and memory_enabled:
+        rss_sampler.stop()
+        rss_sampler = None
+        tracemalloc.stop()
+    memory_enabled = enabled
+
+# Clear the collected memory peaks
+def reset_memory():
+    memory_spans.clear()
+    del memory_stack[:]
+    if memory_enabled:
+        tracemalloc.reset_peak()
+        rss_sampler.reset_peak()
+
+# Start of a phase, the peaks so far are kept for the enclosing phase before they are reset
+def memory_enter():
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    rss_peak = rss_sampler.reset_peak()
+    if memory_stack:
+        outer = memory_stack[-1]
+        outer[0] = max(outer[0], traced_peak)
+        outer[1] = max(outer[1], rss_peak)
+    tracemalloc.reset_peak()
+    memory_stack.append([0, 0, tracemalloc.get_traced_memory()[0]])
+
+# End of a phase, records its peaks, which also count towards the enclosing phase
+def memory_exit(phase, host):
+    if not memory_stack:
+        return
+    frame = memory_stack.pop()
+    traced_peak = max(frame[0], tracemalloc.get_traced_memory()[1])
+    rss_peak = max(frame[1], rss_sampler.peak, rss_sampler.sample())
+    if memory_stack:
+        outer = memory_stack[-1]
+        outer[0] = max(outer[0], traced_peak)
+        outer[1] = max(outer[1], rss_peak)
+    growth = max(traced_peak - frame[2], 0)
+    span = memory_spans.get((phase, host))
+    if span is None:
+        memory_spans[(phase, host)] = [traced_peak, rss_peak, growth]
+    else:
+        span[0] = max(span[0], traced_peak)
+        span[1] = max(span[1], rss_peak)
+        span[2] = max(span[2], growth)
+
+# Peaks per phase and per host, in MB
+# memory_dict {'peak_traced': 0.0, 'peak_rss': 0.0, 'phases': {phase: {'traced': 0.0, 'rss': 0.0, 'growth': 0.0}},
+#              'hosts': {host: {phase: {...}}}}
+def memory_summary():
+    memory_dict = {"peak_traced": 0.0, "peak_rss": 0.0, "phases": {}, "hosts": {}}
+    for (phase, host), (traced_peak, rss_peak, growth) in memory_spans.items():
+        traced_mb = traced_peak / 1048576.0
+        rss_mb = rss_peak / 1048576.0
+        growth_mb = growth / 1048576.0
+        phase_dict = memory_dict["phases"].setdefault(phase, {"traced": 0.0, "rss": 0.0, "growth": 0.0})
+        phase_dict["traced"] = max(phase_dict["traced"], traced_mb)
+        phase_dict["rss"] = max(phase_dict["rss"], rss_mb)
+        phase_dict["growth"] = max(phase_dict["growth"], growth_mb)
+        if host:
+            memory_dict["hosts"].setdefault(host, {})[phase] = {"traced": traced_mb, "rss": rss_mb,
+                                                                 "growth": growth_mb}
+        memory_dict["peak_traced"] = max(memory_dict["peak_traced"], traced_mb)
+        memory_dict["peak_rss"] = max(memory_dict["peak_rss"], rss_mb)
+    return memory_dict
+
+# Print the peak memory of each phase and the hosts with the highest peaks
+# The summary is also written to a JSON file if one is given
+def print_memory_report(json_file=None, top=10):
+    if not memory_enabled or not memory_spans:
+        return
+    memory_dict = memory_summary()
+    phase_table = PrettyTable(["Phase", "Peak Traced (MB)", "Max Growth (MB)", "Peak RSS (MB)"])
+    phase_table.align = "r"
+    phase_table.align["Phase"] = "l"
+    for phase, phase_dict in sorted(memory_dict["phases"].items(), key=lambda p: -p[1]["traced"]):
+        phase_table.add_row([phase, "{:.1f}".format(phase_dict["traced"]), "{:.1f}".format(phase_dict["growth"]),
+                             "{:.1f}".format(phase_dict["rss"])])
+    host_table = PrettyTable(["Host", "Max Growth (MB)", "Phase", "Peak Traced (MB)"])
+    host_table.align = "r"
+    host_table.align["Host"] = "l"
+    host_peaks = []
+    for host, phases in memory_dict["hosts"].items():
+        growth_phase = max(phases, key=lambda p: phases[p]["growth"])
+        host_peaks.append((phases[growth_phase]["growth"], host, growth_phase,
+                           max(phase_dict["traced"] for phase_dict in phases.values())))
+    for growth, host, growth_phase, traced in sorted(host_peaks, reverse=True)[:top]:
+        host_table.add_row([host, "{:.2f}".format(growth), growth_phase, "{:.1f}".format(traced)])
+    print("*" * 50 + "\n" + " " * 10 + "Memory Report\n" + "*" * 50)
+    print("Peak traced: {:.1f} MB  Peak RSS: {:.1f} MB".format(memory_dict["peak_traced"], memory_dict["peak_rss"]))
+    print(phase_table)
+    print("Top {} hosts".format(top))
+    print(host_table)
+    if json_file:
+        with open(json_file, 'w') as w:
+            json.dump(memory_dict, w, indent=2)
+        print("Memory report written to {}".format(json_file))
@@ -0,0 +1,196 @@
+# File: records.py
+# Purpose: Compact record types for the STP, VLAN and LLDP data extracted from the JSON captures.
+#
+# A repository of a few hundred hosts with thousands of VLANs produces millions of these rows, so they are slotted
+# objects instead of dicts: no per-row key table, MACs and priorities stored as integers and the repeated strings
+# (VLAN ids, interface names, port states and roles) interned so every row shares one copy. MACs are parsed with
+# macs.py, so any MAC format gives the same integer.
+#
+# The records keep the dict interface the rest of stpmap.py uses (record["vlan_rb_mac"], "key" in record,
+# record.get(), keys(), ==), reading a MAC or priority by key returns it formatted exactly as Junos prints it. An unset
+# field behaves like a missing dict key and an empty record is falsy, like an empty dict.
+
+import functools
+import sys
+
+from macs import mac_to_int, int_to_mac, bridge_id
+
+# Parses a MAC address to a 48-bit integer, the value is kept as is if it isn't a MAC
+def parse_mac(value):
+    mac = mac_to_int(value)
+    if mac is None:
+        return value
+    return mac
+
+# Memoized so every row with the same priority shares the formatted string
+@functools.lru_cache(maxsize=1024)
+def format_int(value):
+    return str(value)
+
+# Parses a numeric string to an integer, the value is kept as is if it isn't a number
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+# Interns a string so repeated values share one copy
+def intern_str(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+# Interns the members of a VLAN, they repeat across the VLANs of a host
+def intern_members(value):
+    if type(value) is list:
+        return [intern_str(member) for member in value]
+    return intern_str(value)
+
+# Bridge ID from the stored priority and MAC, None if either isn't an integer
+def record_bridge_id(priority, mac):
+    if type(priority) is int and type(mac) is int:
+        return bridge_id(priority, mac)
+    return None
+
+class Record(object):
+    """ Base of the slotted records, provides the dict interface over the slots. """
+    __slots__ = ()
+    # Fields stored as integers, formatted as MACs or numbers when read by key
+    mac_fields = frozenset()
+    int_fields = frozenset()
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    # The conversion of a value stored under a key: MAC and number parsing, interning for the other strings. Used to
+    # fill the slots directly (see capture_plan.py), the value read back by key is the same as with record[key] = value.
+    @classmethod
+    def converter(cls, key):
+        if key in cls.mac_fields:
+            return parse_mac
+        if key in cls.int_fields:
+            return parse_int
+        return intern_str
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+        if type(value) is int:
+            if key in self.mac_fields:
+                return int_to_mac(value)
+            if key in self.int_fields:
+                return format_int(value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if key in self.mac_fields:
+            value = parse_mac(value)
+        elif key in self.int_fields:
+            value = parse_int(value)
+        else:
+            value = intern_str(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    # Mutable, like the dicts they replace
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+# Output of extract_stp_info
+# {'vlan_id': '', 'vlan_rb_mac': '', 'vlan_rb_prio': '', 'vlan_local_mac': '', 'vlan_local_prio': '',
+#  'topo_change_count': '', 'time_since_last_tc': '', 'vlan_root_port': '', 'vlan_root_cost': '',
+#  'tc_initiator': '', 'tc_last_recvd_from': ''}
+class StpBridge(Record):
+    __slots__ = ("vlan_id", "vlan_rb_mac", "vlan_rb_prio", "vlan_local_mac", "vlan_local_prio", "topo_change_count",
+                 "tc_initiator", "tc_last_recvd_from", "time_since_last_tc", "vlan_root_port", "vlan_root_cost")
+    mac_fields = frozenset(("vlan_rb_mac", "vlan_local_mac"))
+    int_fields = frozenset(("vlan_rb_prio", "vlan_local_prio"))
+
+    # True if this bridge is the root bridge of the VLAN, compares the MAC integers
+    def is_root(self):
+        return getattr(self, "vlan_rb_mac", None) == getattr(self, "vlan_local_mac", None)
+
+    # 64-bit bridge ID of the root bridge, None if the priority or MAC isn't numeric
+    def root_bridge_id(self):
+        return record_bridge_id(getattr(self, "vlan_rb_prio", None), getattr(self, "vlan_rb_mac", None))
+
+    # 64-bit bridge ID of this bridge, None if the priority or MAC isn't numeric
+    def local_bridge_id(self):
+        return record_bridge_id(getattr(self, "vlan_local_prio", None), getattr(self, "vlan_local_mac", None))
+
+# One interface of an StpInstance
+# {'int_name': '', 'port_cost': '', 'port_state': '', 'desg_bridge_mac': '', 'desg_bridge_prio': '', 'port_role': ''}
+class StpInterface(Record):
+    __slots__ = ("int_name", "port_cost", "port_state", "desg_bridge_mac", "desg_bridge_prio", "port_role")
+    mac_fields = frozenset(("desg_bridge_mac",))
+    int_fields = frozenset(("desg_bridge_prio",))
+
+# Output of extract_stp_int
+# {'vlan_id': '', 'interfaces': [StpInterface, ...]}
+class StpInstance(Record):
+    __slots__ = ("vlan_id", "interfaces")
+
+# Output of extract_vlan_info
+# {'tag': '', 'name': '', 'members': [], 'l3interface': ''}
+class VlanInfo(Record):
+    __slots__ = ("tag", "name", "members", "l3interface")
+
+    @classmethod
+    def converter(cls, key):
+        if key == "members":
+            return intern_members
+        return super(VlanInfo, cls).converter(key)
+
+    def __setitem__(self, key, value):
+        # The member interfaces repeat across the VLANs of a host
+        if key == "members" and type(value) is list:
+            value = intern_members(value)
+        Record.__setitem__(self, key, value)
+
+# Output of lldp_neighbors
+# {'local_int': '', 'remote_chassis_id': '', 'remote_sysname': ''}
+class LldpNeighbor(Record):
+    __slots__ = ("local_int", "remote_chassis_id", "remote_sysname")
@@ -0,0 +1,127 @@
+# File: repo_index.py
+# Purpose: Index file of a repository (repo_index.json, next to dev_list.json or beside an archived repository) so the
+# VLAN picker and host filtering don't have to open every host's JSON files.
+#
+# The index holds, per host, the VLANs it carries, its bridge MAC and its LLDP neighbors, plus the stamp (mtime, size)
+# and SHA-1 checksum of every capture file. Updating it only stats the files: a host is extracted again only when the
+# checksum of one of its files changed (a file that was just touched keeps its entry). The VLAN->hosts and bridge
+# MAC->host maps are derived from the host entries in device list order, so they match a full scan of the files.
+#
+# Index format:
+# {'version': 1,
+#  'files': {file name: {'stamp': [mtime_ns, size], 'sha1': ''}},
+#  'hosts': {host: {'vlans': [vlan, ...], 'bridge_mac': '', 'lldp': [neighbor, ...]}},
+#  'vlans': {vlan: [host, ...]},
+#  'bridge_macs': {mac: host}}
+
+import json
+import os
+
+from repo_source import source_checksum, source_stamp, repo_side_path
+
+index_file_name = "repo_index.json"
+index_version = 2
+
+# SHA-1 of a file's contents as stored, read in blocks
+def file_checksum(path):
+    return source_checksum(path)
+
+# Stamp of a file, None if it doesn't exist
+def file_stamp(path):
+    stamp = source_stamp(path)
+    if stamp is None:
+        return None
+    return list(stamp)
+
+def empty_index():
+    return {"version": index_version, "files": {}, "hosts": {}, "vlans": {}, "bridge_macs": {}}
+
+# Loads the index of a repository, an empty index if there is none or it is from another version
+def load_index(repo):
+    try:
+        with open(repo_side_path(repo, index_file_name)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return empty_index()
+    if index.get("version") != index_version:
+        return empty_index()
+    return index
+
+# Writes the index, through a temporary file so a reader never sees a partial index
+def save_index(repo, index):
+    path = repo_side_path(repo, index_file_name)
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# Brings the index up to date with the capture files of the hosts
+# file_suffixes maps a file kind to its suffix (ie. {'vlan': '_vlan-ext.json'}), extract_host(host) returns the
+# host's entry ({'vlans': [], 'bridge_mac': '', 'lldp': []}).
+# Returns (hosts that were extracted again, True if anything in the index changed)
+def update_index(repo, index, hosts, file_suffixes, extract_host):
+    files = index["files"]
+    changed = []
+    updated = False
+    for host in hosts:
+        host_changed = host not in index["hosts"]
+        for suffix in file_suffixes.values():
+            file_name = host + suffix
+            path = os.path.join(repo, file_name)
+            stamp = file_stamp(path)
+            entry = files.get(file_name)
+            if stamp is None:
+                if entry is not None:
+                    del files[file_name]
+                    host_changed = updated = True
+                continue
+            if entry is not None and entry["stamp"] == stamp:
+                continue
+            # Stamp changed, only a different checksum means different contents
+            checksum = file_checksum(path)
+            if entry is None or entry["sha1"] != checksum:
+                host_changed = True
+            files[file_name] = {"stamp": stamp, "sha1": checksum}
+            updated = True
+        if host_changed:
+            index["hosts"][host] = extract_host(host)
+            changed.append(host)
+            updated = True
+    # Drop the hosts that left the device list
+    host_set = set(hosts)
+    for host in list(index["hosts"]):
+        if host not in host_set:
+            del index["hosts"][host]
+            updated = True
+            for suffix in file_suffixes.values():
+                files.pop(host + suffix, None)
+    derive_maps(index, hosts)
+    return changed, updated
+
+# Rebuilds the VLAN->hosts and bridge MAC->host maps from the host entries, in host order
+def derive_maps(index, hosts):
+    vlans = {}
+    bridge_macs = {}
+    for host in hosts:
+        host_entry = index["hosts"].get(host)
+        if not host_entry:
+            continue
+        for vlan in host_entry["vlans"]:
+            vlans.setdefault(vlan, []).append(host)
+        if host_entry.get("bridge_mac"):
+            bridge_macs[host_entry["bridge_mac"]] = host
+    index["vlans"] = vlans
+    index["bridge_macs"] = bridge_macs
+
+# The VLAN/host LD of the index, in the order collect_all_vlans_json() returns it
+# vlan_host_ld [{'vlan': '', 'hosts': [host, ...]}]
+def index_vlan_hosts(index):
+    vlan_host_ld = []
+    for vlan, hosts in index["vlans"].items():
+        vlan_host_ld.append({"vlan": vlan, "hosts": list(hosts)})
+    return vlan_host_ld
@@ -0,0 +1,350 @@
+# File: repo_source.py
+# Purpose: Reads the capture files of a repository stored as a directory of plain or compressed JSON files, or as a
+# .zip / .tar(.gz|.xz) archive, without extracting it next to the repository.
+#
+# A capture file is always addressed by its plain path (<repo>/<host>_stp.json), whatever the repository is stored as:
+# - the file itself
+# - a compressed sibling, <host>_stp.json.gz or <host>_stp.json.xz
+# - a member of an archive in the path, ie. json/nightly.tar.gz/<host>_stp.json. The members may also sit in one top
+#   folder of the archive (tar czf nightly.tar.gz nightly/).
+# Zip members and the members of a plain .tar are read on demand. A compressed tar can only be read front to back, so
+# on first use it is decompressed in one pass to a spool file (in memory up to tar_spool_memory, then on disk) and its
+# members are read from there until the archive changes. The readers are closed with close_archives() when an
+# analysis finishes or another repository is selected.
+#
+# The files a loop is about to parse can be prefetched: a thread pool decompresses them a few files ahead of the
+# reader. zlib and lzma release the GIL, so the hosts are decompressed in parallel while the JSON is being parsed.
+# Plain files are never prefetched, they are read as they are.
+
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Compressed siblings of a file, tried in this order
+compressed_suffixes = {".gz": gzip.open, ".xz": lzma.open}
+# Archive file names a repository can be
+zip_suffixes = (".zip",)
+tar_suffixes = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz")
+archive_suffixes = zip_suffixes + tar_suffixes
+# Threads decompressing ahead of the reader, and files held decompressed per thread
+prefetch_workers = 4
+prefetch_depth = 2
+# Bytes of decompressed tar members a spool holds in memory before it rolls over to a temporary file
+tar_spool_memory = 32 << 20
+
+# Opened archives {archive path: ArchiveReader}
+archive_readers = {}
+archive_lock = threading.Lock()
+# Prefetch of the loop currently reading the repository, see prefetch_sources()
+active_prefetch = None
+
+def is_archive(path):
+    return path.lower().endswith(archive_suffixes)
+
+class ArchiveReader(object):
+    """ Members of a zip or tar archive by name, opened as it was when stamp was taken. """
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.path = path
+        self.stamp = (stat.st_mtime_ns, stat.st_size)
+        # {member name: (size, mtime)}
+        self.members = {}
+        # Member names without the top folder of the archive
+        self.aliases = {}
+        self.zip = None
+        # Tar members are read from the spool (the .tar itself, or the decompressed members) at their offsets
+        self.spool = None
+        self.offsets = {}
+        self.spool_lock = threading.Lock()
+        if path.lower().endswith(zip_suffixes):
+            self.zip = zipfile.ZipFile(path)
+            for info in self.zip.infolist():
+                if not info.is_dir():
+                    self.add_member(info.filename, info.file_size, info.date_time)
+        elif path.lower().endswith(".tar"):
+            with tarfile.open(path, "r:") as tar:
+                for info in tar:
+                    if info.isfile():
+                        self.add_member(info.name, info.size, info.mtime)
+                        self.offsets[info.name] = info.offset_data
+            self.spool = open(path, "rb")
+        else:
+            # Decompressed front to back, once
+            self.spool = tempfile.SpooledTemporaryFile(max_size=tar_spool_memory)
+            with tarfile.open(path, "r|*") as tar:
+                for info in tar:
+                    if info.isfile():
+                        self.add_member(info.name, info.size, info.mtime)
+                        self.offsets[info.name] = self.spool.tell()
+                        shutil.copyfileobj(tar.extractfile(info), self.spool)
+
+    def add_member(self, name, size, mtime):
+        self.members[name] = (size, mtime)
+        if "/" in name:
+            self.aliases.setdefault(name.split("/", 1)[1], name)
+
+    # Archive name of a member, None if the archive doesn't have it
+    def lookup(self, name):
+        name = name.replace(os.sep, "/").strip("/")
+        if name in self.members:
+            return name
+        return self.aliases.get(name)
+
+    def open(self, name):
+        if self.zip is not None:
+            return self.zip.open(name)
+        with self.spool_lock:
+            self.spool.seek(self.offsets[name])
+            return io.BytesIO(self.spool.read(self.members[name][0]))
+
+    # Names of the members, relative to the archive folder
+    def names(self):
+        names = set()
+        for name in self.members:
+            if "/" in name and self.aliases.get(name.split("/", 1)[1]) == name:
+                names.add(name.split("/", 1)[1])
+            else:
+                names.add(name)
+        return names
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        if self.spool is not None:
+            self.spool.close()
+
+# Returns the reader of an archive, opened again if the archive changed since it was read
+def archive_reader(path):
+    stat = os.stat(path)
+    with archive_lock:
+        reader = archive_readers.get(path)
+        if reader is None or reader.stamp != (stat.st_mtime_ns, stat.st_size):
+            if reader is not None:
+                reader.close()
+            reader = archive_readers[path] = ArchiveReader(path)
+    return reader
+
+# Closes the opened archives, an archive is opened (and a compressed tar decompressed) again on its next use
+def close_archives():
+    with archive_lock:
+        for reader in archive_readers.values():
+            reader.close()
+        archive_readers.clear()
+
+# Splits a path into (archive, member name) at the first archive file in it, (None, path) if there is none
+def split_archive(path):
+    parts = path.replace(os.sep, "/").split("/")
+    for i in range(1, len(parts) + 1):
+        archive = "/".join(parts[:i])
+        if is_archive(archive) and os.path.isfile(archive):
+            return archive, "/".join(parts[i:])
+    return None, path
+
+# Where the file of a plain path is stored: ("file", path), ("gz", path.gz), ("xz", path.xz) or
+# ("archive", (reader, member name)). None if there is no such file.
+def resolve_source(path):
+    if os.path.isfile(path):
+        return "file", path
+    for suffix in compressed_suffixes:
+        if os.path.isfile(path + suffix):
+            return suffix[1:], path + suffix
+    archive, name = split_archive(path)
+    if archive:
+        reader = archive_reader(archive)
+        member = reader.lookup(name)
+        if member is not None:
+            return "archive", (reader, member)
+    return None
+
+def source_exists(path):
+    return resolve_source(path) is not None
+
+# Stamp (mtime, size) of a file, None if it doesn't exist. An archive member has the stamp of the archive with its
+# own size, so every member changes when the archive is replaced.
+def source_stamp(path):
+    source = resolve_source(path)
+    if source is None:
+        return None
+    kind, location = source
+    if kind == "archive":
+        reader, member = location
+        return reader.stamp[0], reader.members[member][0]
+    stat = os.stat(location)
+    return stat.st_mtime_ns, stat.st_size
+
+# Modification time (seconds) of a file, the member's own time for an archive member
+def source_mtime(path):
+    source = resolve_source(path)
+    if source is None:
+        raise FileNotFoundError(path)
+    kind, location = source
+    if kind == "archive":
+        reader, member = location
+        mtime = reader.members[member][1]
+        if type(mtime) == tuple:
+            # Zip members carry a local date and time
+            return time.mktime(mtime + (0, 0, -1))
+        return mtime
+    return os.path.getmtime(location)
+
+# Opens a file for reading bytes, decompressed, from the prefetch if it is there. Raises FileNotFoundError if the file
+# doesn't exist.
+def open_source(path):
+    if active_prefetch is not None:
+        data = active_prefetch.take(path)
+        if data is not None:
+            return io.BytesIO(data)
+    return open_stored(path)
+
+# Opens a file for reading bytes from where it is stored, decompressed
+def open_stored(path):
+    source = resolve_source(path)
+    if source is None:
+        raise FileNotFoundError(2, "No such file", path)
+    kind, location = source
+    if kind == "file":
+        return open(location, "rb")
+    if kind == "archive":
+        reader, member = location
+        return reader.open(member)
+    return compressed_suffixes["." + kind](location, "rb")
+
+# The decompressed contents of a file, read by the prefetch threads
+def read_source(path):
+    with open_stored(path) as f:
+        return f.read()
+
+# True if reading the file means decompressing it
+def is_compressed_source(path):
+    source = resolve_source(path)
+    return source is not None and source[0] != "file"
+
+# SHA-1 of a file as it is stored (a compressed file isn't decompressed), read in blocks
+def source_checksum(path):
+    source = resolve_source(path)
+    if source is None:
+        raise FileNotFoundError(2, "No such file", path)
+    kind, location = source
+    digest = hashlib.sha1()
+    if kind == "archive":
+        reader, member = location
+        f = reader.open(member)
+    else:
+        f = open(location, "rb")
+    with f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# The capture files of a repository {file name: stamp}, compressed files under their plain name
+def list_sources(repo):
+    repo = repo.rstrip("/" + os.sep)
+    if os.path.isdir(repo):
+        sources = {}
+        for entry in os.scandir(repo):
+            name = entry.name
+            for suffix in compressed_suffixes:
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            if entry.is_file():
+                stat = entry.stat()
+                sources[name] = (stat.st_mtime_ns, stat.st_size)
+        return sources
+    archive, folder = split_archive(repo)
+    if not archive:
+        raise FileNotFoundError(2, "No such repository", repo)
+    reader = archive_reader(archive)
+    prefix = folder.strip("/") + "/" if folder.strip("/") else ""
+    sources = {}
+    for name in reader.names():
+        if name.startswith(prefix) and "/" not in name[len(prefix):]:
+            member = reader.lookup(name)
+            sources[name[len(prefix):]] = (reader.stamp[0], reader.members[member][0])
+    return sources
+
+# Path of a file kept next to a repository (index, store), beside the archive for an archived repository:
+# json/nightly.tar.gz -> json/nightly.tar.gz.<name>
+def repo_side_path(repo, name):
+    repo = repo.rstrip("/" + os.sep)
+    if os.path.isdir(repo):
+        return os.path.join(repo, name)
+    archive, folder = split_archive(repo)
+    if not archive:
+        return os.path.join(repo, name)
+    if folder.strip("/"):
+        archive += "." + folder.strip("/").replace("/", "_")
+    return archive + "." + name
+
+# Path of a file kept next to a repository, in fallback_dir when the repository can't be written to (ie. a read-only or
+# shared capture directory). The fallback file is named after a hash of the repository path.
+def writable_side_path(repo, name, fallback_dir):
+    path = repo_side_path(repo, name)
+    if os.access(os.path.dirname(path) or ".", os.W_OK) and (not os.path.exists(path) or os.access(path, os.W_OK)):
+        return path
+    repo_key = hashlib.sha1(os.path.abspath(repo.rstrip("/" + os.sep)).encode()).hexdigest()[:12]
+    return os.path.join(fallback_dir, repo_key + "." + name)
+
+class Prefetch(object):
+    """ Decompresses files ahead of the reader with a thread pool, in the order they will be read. """
+
+    def __init__(self, paths, workers, depth):
+        self.pending = deque(paths)
+        self.futures = {}
+        self.window = workers * depth
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.fill()
+
+    # Keeps the window full
+    def fill(self):
+        while self.pending and len(self.futures) < self.window:
+            path = self.pending.popleft()
+            if path not in self.futures:
+                self.futures[path] = self.executor.submit(read_source, path)
+
+    # The decompressed contents of a prefetched file, None if it wasn't prefetched. Errors (ie. a missing file) are
+    # raised here, to the reader.
+    def take(self, path):
+        future = self.futures.pop(path, None)
+        if future is None:
+            try:
+                self.pending.remove(path)
+            except ValueError:
+                pass
+            return None
+        self.fill()
+        return future.result()
+
+    def close(self):
+        self.pending.clear()
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.executor.shutdown(wait=True)
+
+# Decompresses the compressed or archived files of paths, in parallel, while the with block reads them in order
+@contextmanager
+def prefetch_sources(paths, workers=prefetch_workers, depth=prefetch_depth):
+    global active_prefetch
+    paths = [path for path in paths if is_compressed_source(path)]
+    if not paths or active_prefetch is not None:
+        yield
+        return
+    active_prefetch = Prefetch(paths, workers, depth)
+    try:
+        yield
+    finally:
+        active_prefetch.close()
+        active_prefetch = None
@@ -0,0 +1,368 @@
+# File: repo_store.py
+# Purpose: SQLite store of a repository's extracted data, for repositories too large to hold in memory.
+#
+# Each host's files are extracted once and loaded into indexed tables (hosts, vlans, stp_bridge, stp_instances,
+# stp_interfaces, lldp_links, macs), a host is loaded again only when the stamps of its files change. The analyses
+# then query one VLAN (or one MAC) at a time and rebuild the same records the extractors return, so memory depends on
+# the size of a VLAN, not of the repository. Values are stored the way the records print them and parsed again when
+# the records are rebuilt. The store lives next to dev_list.json (repo_store.db), beside an archived repository, or in
+# the script directory when the repository can't be written to.
+
+import json
+import sqlite3
+
+from macs import mac_to_int, vlan_number
+from records import StpBridge, StpInterface, StpInstance, VlanInfo, LldpNeighbor
+
+store_file_name = "repo_store.db"
+
+# Schema of the repository store, "position" is the host's place in the device list and "seq" the order of a row in
+# its host's file, so queries return rows in the order the extractors do
+store_schema = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    position INTEGER NOT NULL,
+    stamps TEXT NOT NULL,
+    mac_scanned INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS vlans (
+    host_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    tag TEXT,
+    name TEXT,
+    members TEXT,
+    l3interface TEXT,
+    PRIMARY KEY (host_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_vlans_tag ON vlans (tag, host_id);
+CREATE TABLE IF NOT EXISTS stp_bridge (
+    host_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    vlan_id TEXT,
+    vlan_rb_mac TEXT,
+    vlan_rb_prio TEXT,
+    vlan_local_mac TEXT,
+    vlan_local_prio TEXT,
+    topo_change_count TEXT,
+    tc_initiator TEXT,
+    tc_last_recvd_from TEXT,
+    time_since_last_tc TEXT,
+    vlan_root_port TEXT,
+    vlan_root_cost TEXT,
+    PRIMARY KEY (host_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stp_bridge_vlan ON stp_bridge (vlan_id, host_id);
+CREATE TABLE IF NOT EXISTS stp_instances (
+    host_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    vlan_id TEXT,
+    PRIMARY KEY (host_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stp_instances_vlan ON stp_instances (vlan_id, host_id);
+CREATE TABLE IF NOT EXISTS stp_interfaces (
+    host_id INTEGER NOT NULL,
+    instance_seq INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    int_name TEXT,
+    port_cost TEXT,
+    port_state TEXT,
+    desg_bridge_mac TEXT,
+    desg_bridge_prio TEXT,
+    port_role TEXT,
+    PRIMARY KEY (host_id, instance_seq, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lldp_links (
+    host_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    parent_int TEXT,
+    local_port TEXT,
+    remote_chassis_id TEXT,
+    remote_sysname TEXT,
+    PRIMARY KEY (host_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS macs (
+    host_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    mac INTEGER NOT NULL,
+    vlan INTEGER NOT NULL,
+    interface TEXT NOT NULL,
+    edge INTEGER NOT NULL,
+    PRIMARY KEY (host_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_macs_mac ON macs (mac, vlan);
+CREATE INDEX IF NOT EXISTS idx_macs_edge ON macs (edge, mac, vlan);
+"""
+
+# Tables holding the rows of a host
+host_tables = ("vlans", "stp_bridge", "stp_instances", "stp_interfaces", "lldp_links", "macs")
+
+stp_bridge_fields = ("vlan_id", "vlan_rb_mac", "vlan_rb_prio", "vlan_local_mac", "vlan_local_prio",
+                     "topo_change_count", "tc_initiator", "tc_last_recvd_from", "time_since_last_tc", "vlan_root_port",
+                     "vlan_root_cost")
+stp_interface_fields = ("int_name", "port_cost", "port_state", "desg_bridge_mac", "desg_bridge_prio", "port_role")
+
+# Opens (and creates if needed) a repository store
+def open_store(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.executescript(store_schema)
+    return conn
+
+# Stamps the host was last loaded with, None if it isn't in the store
+def stored_stamps(conn, host):
+    row = conn.execute("SELECT stamps FROM hosts WHERE name = ?", (host,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+# Sets the device list order of the hosts and drops the hosts that left the device list
+def sync_hosts(conn, hosts):
+    positions = {}
+    for position, host in enumerate(hosts):
+        positions[host] = position
+    for host_id, name in conn.execute("SELECT host_id, name FROM hosts").fetchall():
+        if name in positions:
+            conn.execute("UPDATE hosts SET position = ? WHERE host_id = ?", (positions[name], host_id))
+        else:
+            delete_host_rows(conn, host_id)
+            conn.execute("DELETE FROM hosts WHERE host_id = ?", (host_id,))
+    conn.commit()
+
+def delete_host_rows(conn, host_id):
+    for table in host_tables:
+        conn.execute("DELETE FROM {} WHERE host_id = ?".format(table), (host_id,))
+
+# Record fields as a row, None for the fields that aren't set
+def record_row(record, fields):
+    return tuple(record.get(field) for field in fields)
+
+# Replaces the rows of a host with its extracted data, in one transaction
+# host_data {'vlan': [VlanInfo], 'stp': [StpBridge], 'stp-int': [StpInstance],
+#            'lldp': [{'parent_int': '', 'local_port': '', 'remote_chassis_id': '', 'remote_sysname': ''}],
+#            'macs': [(mac, vlan_id, interface, edge)]}, 'macs' only if the host has a MAC table capture
+def load_host(conn, host, position, stamps, host_data):
+    with conn:
+        row = conn.execute("SELECT host_id FROM hosts WHERE name = ?", (host,)).fetchone()
+        if row is None:
+            host_id = conn.execute("INSERT INTO hosts (name, position, stamps) VALUES (?, ?, ?)",
+                                   (host, position, json.dumps(stamps))).lastrowid
+        else:
+            host_id = row[0]
+            delete_host_rows(conn, host_id)
+            conn.execute("UPDATE hosts SET position = ?, stamps = ? WHERE host_id = ?",
+                         (position, json.dumps(stamps), host_id))
+        conn.execute("UPDATE hosts SET mac_scanned = ? WHERE host_id = ?", (int("macs" in host_data), host_id))
+        conn.executemany("INSERT INTO vlans VALUES (?, ?, ?, ?, ?, ?)",
+                         ((host_id, seq, vlan.get("tag"), vlan.get("name"), json.dumps(vlan.get("members")),
+                           vlan.get("l3interface")) for seq, vlan in enumerate(host_data["vlan"])))
+        conn.executemany("INSERT INTO stp_bridge VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         ((host_id, seq) + record_row(stp, stp_bridge_fields)
+                          for seq, stp in enumerate(host_data["stp"])))
+        interface_rows = []
+        for instance_seq, instance in enumerate(host_data["stp-int"]):
+            conn.execute("INSERT INTO stp_instances VALUES (?, ?, ?)", (host_id, instance_seq, instance.get("vlan_id")))
+            for seq, intf in enumerate(instance.get("interfaces") or []):
+                interface_rows.append((host_id, instance_seq, seq) + record_row(intf, stp_interface_fields))
+        conn.executemany("INSERT INTO stp_interfaces VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", interface_rows)
+        conn.executemany("INSERT INTO lldp_links VALUES (?, ?, ?, ?, ?, ?)",
+                         ((host_id, seq, link["parent_int"], link["local_port"], link["remote_chassis_id"],
+                           link["remote_sysname"]) for seq, link in enumerate(host_data["lldp"])))
+        mac_rows = []
+        for mac, vlan_id, interface, edge in host_data.get("macs", ()):
+            mac = mac_to_int(mac)
+            if mac is not None:
+                mac_rows.append((host_id, len(mac_rows), mac, vlan_number(vlan_id) & 0xFFF, interface, int(edge)))
+        conn.executemany("INSERT INTO macs VALUES (?, ?, ?, ?, ?, ?)", mac_rows)
+    return host_id
+
+# The VLAN ids of the store, in the order they are first seen going over the hosts in device list order
+def store_vlan_list(conn):
+    query = """
+    SELECT v.tag FROM vlans v JOIN hosts h ON h.host_id = v.host_id
+    WHERE v.tag IS NOT NULL AND v.tag != ''
+    GROUP BY v.tag
+    ORDER BY MIN(h.position * 1000000 + v.seq)
+    """
+    return [row[0] for row in conn.execute(query)]
+
+def vlan_record(row):
+    vlan_dict = VlanInfo()
+    vlan_dict["tag"] = row[0]
+    vlan_dict["name"] = row[1]
+    vlan_dict["members"] = json.loads(row[2]) if row[2] is not None else None
+    vlan_dict["l3interface"] = row[3]
+    return vlan_dict
+
+def stp_bridge_record(row):
+    return StpBridge(**dict(zip(stp_bridge_fields, row)))
+
+# The hosts carrying a VLAN and their VLAN record, in device list order
+# Returns [(host, VlanInfo)]
+def vlan_hosts(conn, vlan):
+    query = """
+    SELECT h.name, v.tag, v.name, v.members, v.l3interface FROM vlans v JOIN hosts h ON h.host_id = v.host_id
+    WHERE v.tag = ? ORDER BY h.position, v.seq
+    """
+    return [(row[0], vlan_record(row[1:])) for row in conn.execute(query, (vlan,))]
+
+# The STP bridge records of a VLAN, {host: StpBridge}, the first record of a host wins
+def vlan_stp_bridges(conn, vlan, host=None):
+    query = """
+    SELECT h.name, {} FROM stp_bridge s JOIN hosts h ON h.host_id = s.host_id
+    WHERE s.vlan_id = ? AND (? IS NULL OR h.name = ?) ORDER BY h.position, s.seq
+    """.format(", ".join("s." + field for field in stp_bridge_fields))
+    bridges = {}
+    for row in conn.execute(query, (vlan, host, host)):
+        if row[0] not in bridges:
+            bridges[row[0]] = stp_bridge_record(row[1:])
+    return bridges
+
+# The STP instances of a VLAN with their interfaces, {host: StpInstance}, the first instance of a host wins
+def vlan_stp_instances(conn, vlan, host=None):
+    query = """
+    SELECT h.name, i.seq, i.vlan_id, f.seq, {} FROM stp_instances i JOIN hosts h ON h.host_id = i.host_id
+    LEFT JOIN stp_interfaces f ON f.host_id = i.host_id AND f.instance_seq = i.seq
+    WHERE i.vlan_id = ? AND (? IS NULL OR h.name = ?) ORDER BY h.position, i.seq, f.seq
+    """.format(", ".join("f." + field for field in stp_interface_fields))
+    instances = {}
+    instance_seqs = {}
+    for row in conn.execute(query, (vlan, host, host)):
+        if row[0] not in instances:
+            instances[row[0]] = StpInstance(vlan_id=row[2], interfaces=[])
+            instance_seqs[row[0]] = row[1]
+        # Rows of the host's later instances of the VLAN are ignored
+        elif instance_seqs[row[0]] != row[1]:
+            continue
+        if row[3] is not None:
+            instances[row[0]]["interfaces"].append(StpInterface(**dict(zip(stp_interface_fields, row[4:]))))
+    return instances
+
+# The records of one host for a VLAN, like select_vlan_record() over the extractor output ([] where it has none)
+# Returns (VlanInfo, StpBridge, StpInstance, the host's LLDP links)
+def host_vlan_records(conn, host, vlan):
+    query = """
+    SELECT v.tag, v.name, v.members, v.l3interface FROM vlans v JOIN hosts h ON h.host_id = v.host_id
+    WHERE h.name = ? AND v.tag = ? ORDER BY v.seq LIMIT 1
+    """
+    row = conn.execute(query, (host, vlan)).fetchone()
+    vlan_dict = vlan_record(row) if row else []
+    stp_dict = vlan_stp_bridges(conn, vlan, host).get(host, [])
+    stp_int_dict = vlan_stp_instances(conn, vlan, host).get(host, [])
+    return vlan_dict, stp_dict, stp_int_dict, host_lldp_links(conn, host)
+
+# Chassis MAC of each host, the local MAC of the first of its VLANs with an STP record, in device list order
+# mac_ld [{'hostname': '', 'mac': ''}]
+def host_bridge_macs(conn):
+    query = """
+    SELECT h.name, s.vlan_local_mac FROM hosts h
+    JOIN vlans v ON v.host_id = h.host_id
+    JOIN stp_bridge s ON s.host_id = h.host_id AND s.vlan_id = v.tag
+    WHERE v.tag IS NOT NULL AND v.tag != ''
+    ORDER BY h.position, v.seq, s.seq
+    """
+    mac_ld = []
+    last_host = None
+    for host, mac in conn.execute(query):
+        if host != last_host:
+            mac_ld.append({"hostname": host, "mac": mac})
+            last_host = host
+    return mac_ld
+
+# The LLDP links of a host, in file order
+# Returns [{'parent_int': '', 'local_port': '', 'remote_chassis_id': '', 'remote_sysname': ''}]
+def host_lldp_links(conn, host):
+    query = """
+    SELECT l.parent_int, l.local_port, l.remote_chassis_id, l.remote_sysname FROM lldp_links l
+    JOIN hosts h ON h.host_id = l.host_id WHERE h.name = ? ORDER BY l.seq
+    """
+    return [{"parent_int": row[0], "local_port": row[1], "remote_chassis_id": row[2], "remote_sysname": row[3]}
+            for row in conn.execute(query, (host,))]
+
+# The LLDP neighbors of a set of links on the given members ('all', a list or a single member, which only matches the
+# first neighbor on it)
+def lldp_neighbors(links, members='all'):
+    lldp_ld = []
+    if not members:
+        return lldp_ld
+    member_list = members if type(members) == list else [members]
+    for link in links:
+        parent_int = link["parent_int"]
+        if members == 'all':
+            local_int = parent_int if parent_int != "-" else link["local_port"]
+        else:
+            local_int = None
+            for member in member_list:
+                base = member.split(".")[0]
+                if parent_int != "-" and parent_int == base:
+                    local_int = parent_int
+                    break
+                if link["local_port"] == base:
+                    local_int = link["local_port"]
+                    break
+            if local_int is None:
+                continue
+        lldp_ld.append(LldpNeighbor(local_int=local_int, remote_chassis_id=link["remote_chassis_id"],
+                                    remote_sysname=link["remote_sysname"]))
+        if type(members) != list and members != 'all':
+            break
+    return lldp_ld
+
+class RowSource(object):
+    """ Runs a generator function again each time it is iterated, so a result can be walked more than once (ie.
+    measured, then rendered) without holding it in memory. """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __iter__(self):
+        return iter(self.func(*self.args))
+
+class StoreMacIndex(object):
+    """ The MAC location queries of MacLocationIndex, answered from the macs table of a store. """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    # Returns the locations of a MAC, in every VLAN or only the given one
+    # location {'mac': 0, 'vlan': 0, 'chassis': '', 'interface': '', 'edge': True}
+    def locate(self, mac, vlan=None):
+        mac = mac_to_int(mac)
+        if mac is None:
+            return []
+        query = """
+        SELECT m.mac, m.vlan, h.name, m.interface, m.edge FROM macs m JOIN hosts h ON h.host_id = m.host_id
+        WHERE m.mac = ? AND (? IS NULL OR m.vlan = ?) ORDER BY m.vlan, h.position, m.seq
+        """
+        vlan = None if vlan is None else vlan_number(vlan) & 0xFFF
+        return [{"mac": row[0], "vlan": row[1], "chassis": row[2], "interface": row[3], "edge": bool(row[4])}
+                for row in self.conn.execute(query, (mac, vlan, vlan))]
+
+    # Yields (mac, vlan, [(chassis, interface)]) for each (MAC, VLAN) learned on more than one edge port
+    def flaps(self):
+        query = """
+        SELECT m.mac, m.vlan, h.name, m.interface FROM macs m JOIN hosts h ON h.host_id = m.host_id
+        WHERE m.edge = 1 AND (m.mac, m.vlan) IN (
+            SELECT mac, vlan FROM macs WHERE edge = 1 GROUP BY mac, vlan
+            HAVING COUNT(DISTINCT host_id || ' ' || interface) > 1)
+        ORDER BY m.mac, m.vlan, h.position, m.seq
+        """
+        key = None
+        edge_ports = []
+        for mac, vlan, chassis, interface in self.conn.execute(query):
+            if (mac, vlan) != key:
+                if key is not None:
+                    yield key[0], key[1], edge_ports
+                key = (mac, vlan)
+                edge_ports = []
+            if (chassis, interface) not in edge_ports:
+                edge_ports.append((chassis, interface))
+        if key is not None:
+            yield key[0], key[1], edge_ports
+
+    # stats {'entries': 0, 'edge_entries': 0, 'mac_vlans': 0, 'chassis': 0}
+    def stats(self):
+        entries, edge_entries = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(edge), 0) FROM macs").fetchone()
+        chassis = self.conn.execute("SELECT COUNT(*) FROM hosts WHERE mac_scanned = 1").fetchone()[0]
+        mac_vlans = self.conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM macs GROUP BY mac, vlan)").fetchone()[0]
+        return {"entries": entries, "edge_entries": edge_entries, "mac_vlans": mac_vlans, "chassis": chassis}
@@ -0,0 +1,112 @@
+# File: result_cache.py
+# Purpose: On-disk cache of analysis results, addressed by the inputs they were computed from.
+#
+# An entry's key is a SHA-256 of the analysis name, its parameters and the modification stamps (mtime, size) of every
+# input file, so an unchanged repository finds the stored result and a changed file gives new keys for just the
+# entries that read it. Entries are pickled one per file (<key>.pkl). A hit touches the file, so the modification times
+# order the entries by last use and the least recently used are removed first once the cache is over its size cap.
+# Stale entries are never looked up again, they age out through the same eviction.
+
+import hashlib
+import json
+import os
+import pickle
+
+# Suffix of the entry files
+entry_suffix = ".pkl"
+
+class ResultCache(object):
+    """ Pickled results in a directory, one file per key, evicted least recently used first over max_bytes. """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Key of a result: the analysis name, its parameters and the stamps of its input files (JSON serializable)
+    @staticmethod
+    def key(name, params, stamps):
+        blob = json.dumps([name, params, stamps], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + entry_suffix)
+
+    # Returns the stored result of a key, or default if there is none (or it can't be read)
+    def get(self, key, default=None):
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # Truncated or written by an incompatible version, drop it
+            self.misses += 1
+            self.remove(path)
+            return default
+        self.hits += 1
+        # Mark it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    # True if a result is stored under the key, without reading it
+    def contains(self, key):
+        return os.path.exists(self.entry_path(key))
+
+    # Stores a result, written to a temporary file first so a reader never sees a partial entry
+    def put(self, key, value):
+        path = self.entry_path(key)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # The entries as [(mtime, size, path)], least recently used first
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(entry_suffix):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+    # Removes the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            self.remove(path)
+
+    # stats {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0}
+    def stats(self):
+        entries = self.entries()
+        return {"entries": len(entries), "bytes": sum(size for mtime, size, path in entries), "hits": self.hits,
+                "misses": self.misses}
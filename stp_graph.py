@@ -0,0 +1,251 @@
+# File: stp_graph.py
+# Purpose: Per-VLAN spanning tree graphs (DOT and GraphML) built from the parsed repository.
+#
+# A VLAN's tree is built from every host carrying the VLAN: the hosts are the nodes (the root bridge marked), the LLDP
+# neighbors on the VLAN's member ports are the links (a link is blocked if a port of it isn't forwarding) and the
+# member ports without an LLDP neighbor are the non-LLDP edges. A link is keyed by the interfaces of its two ends, so
+# parallel links between two switches are drawn as one edge each and the members of a LAG as one. VLANs with identical
+# trees (same hosts, roles, ports and states) form one class: its graph body is rendered once and shared by the files
+# of all the VLANs in the class, or written once for the class. The files are written by a thread pool.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape, quoteattr
+
+# Port states of a forwarding port, any other state (BLK, DIS, ...) blocks the link
+forwarding_states = ("FWD", "Forwarding")
+
+# Interface of an LLDP link on its host, the parent for the members of a LAG (ie. ae0)
+def lldp_interface(link):
+    parent_int = link["parent_int"]
+    if parent_int and parent_int != "-":
+        return parent_int
+    return link["local_port"].split(".")[0]
+
+# Interface of the remote end of an LLDP link: the remote port, or its LAG if the remote host's links are known. Without
+# a remote port, the remote host's only interface toward the host if it has one, "" otherwise.
+def remote_interface(host, link, port_intfs, intfs_toward):
+    remote = link["remote_sysname"]
+    remote_port = link["remote_port"].split(".")[0]
+    if remote_port:
+        return port_intfs.get(remote, {}).get(remote_port, remote_port)
+    toward = intfs_toward.get(remote, {}).get(host, ())
+    if len(toward) == 1:
+        return next(iter(toward))
+    return ""
+
+# vlan_tree {'vlan': '', 'name': '',
+#            'nodes': {host: {'root': False, 'priority': '', 'root_cost': '', 'root_port': '', 'external': False}},
+#            'links': {((host_a, intf_a), (host_b, intf_b)): [(host, intf, state, role), ...]},
+#            'edges': [(host, intf, active), ...]}
+# host_data {host: {'vlan': [VlanInfo], 'stp': [StpBridge], 'stp-int': [StpInstance],
+#                   'lldp': [{'parent_int': '', 'local_port': '', 'remote_chassis_id': '', 'remote_sysname': '',
+#                             'remote_port': ''}]}}
+def build_vlan_trees(host_data):
+    # The interface of each LLDP port of a host and the interfaces of a host toward each neighbor, to find the remote
+    # end of a link
+    port_intfs = {}
+    intfs_toward = {}
+    for host, data in host_data.items():
+        ports = port_intfs[host] = {}
+        toward = intfs_toward[host] = {}
+        for link in data["lldp"]:
+            intf = lldp_interface(link)
+            ports[link["local_port"].split(".")[0]] = intf
+            toward.setdefault(link["remote_sysname"], set()).add(intf)
+    trees = {}
+    for host in sorted(host_data):
+        data = host_data[host]
+        stp_by_vlan = {}
+        for stp_dict in data["stp"]:
+            stp_by_vlan[stp_dict["vlan_id"]] = stp_dict
+        ports_by_vlan = {}
+        for stp_int in data["stp-int"]:
+            ports = {}
+            for intf in stp_int.get("interfaces", []):
+                ports[intf["int_name"]] = intf
+            ports_by_vlan[stp_int["vlan_id"]] = ports
+        neighbors = {}
+        for link in data["lldp"]:
+            remote = (link["remote_sysname"], remote_interface(host, link, port_intfs, intfs_toward))
+            neighbors.setdefault(lldp_interface(link), set()).add(remote)
+
+        for vlan_dict in data["vlan"]:
+            vlan = vlan_dict["tag"]
+            tree = trees.get(vlan)
+            if tree is None:
+                tree = trees[vlan] = {"vlan": vlan, "name": vlan_dict.get("name", ""), "nodes": {}, "links": {},
+                                      "edges": []}
+            stp_dict = stp_by_vlan.get(vlan)
+            node = {"root": False, "priority": "", "root_cost": "", "root_port": "", "external": False}
+            if stp_dict:
+                node["root"] = stp_dict.is_root()
+                node["priority"] = stp_dict.get("vlan_local_prio") or ""
+                node["root_cost"] = stp_dict.get("vlan_root_cost") or ("0" if node["root"] else "")
+                node["root_port"] = stp_dict.get("vlan_root_port") or ""
+            tree["nodes"][host] = node
+            ports = ports_by_vlan.get(vlan, {})
+            members = vlan_dict.get("members") or []
+            if type(members) != list:
+                members = [members]
+            for member in members:
+                intf = member.split(".")[0].rstrip("*")
+                stp_port = ports.get(intf) or ports.get(member.rstrip("*")) or {}
+                port = (host, intf, stp_port.get("port_state") or "", stp_port.get("port_role") or "")
+                if intf in neighbors:
+                    for remote in sorted(neighbors[intf]):
+                        link = tuple(sorted(((host, intf), remote)))
+                        tree["links"].setdefault(link, []).append(port)
+                else:
+                    tree["edges"].append((host, intf, "*" in member))
+    # LLDP neighbors that don't carry the VLAN themselves (ie. not in the device list) are external nodes
+    for tree in trees.values():
+        for link in tree["links"]:
+            for host, intf in link:
+                if host not in tree["nodes"]:
+                    tree["nodes"][host] = {"root": False, "priority": "", "root_cost": "", "root_port": "",
+                                           "external": True}
+    return trees
+
+# True if a port of the link isn't forwarding
+def link_blocked(ports):
+    return any(state and state not in forwarding_states for host, intf, state, role in ports)
+
+# Hashable form of a tree without its VLAN id and name, VLANs with the same signature draw the same graph
+def tree_signature(tree):
+    nodes = tuple(sorted((host, tuple(sorted(node.items()))) for host, node in tree["nodes"].items()))
+    links = tuple(sorted((link, tuple(sorted(ports))) for link, ports in tree["links"].items()))
+    return nodes, links, tuple(sorted(tree["edges"]))
+
+# Groups the VLANs by tree signature, returns [[vlan, ...], ...] in the order of the first VLAN of each class
+def tree_classes(trees):
+    classes = {}
+    for vlan in sorted(trees, key=lambda v: int(v) if str(v).isnumeric() else 0):
+        classes.setdefault(tree_signature(trees[vlan]), []).append(vlan)
+    return list(classes.values())
+
+# Quotes a DOT identifier or label, newlines become DOT line breaks
+def dot_quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+# Label of a link, the ports of each end with their state and role (ie. sw001:ge-0/0/1(BLK|ALT))
+def link_label(ports):
+    labels = []
+    for host, intf, state, role in sorted(ports):
+        if state or role:
+            labels.append("{}:{}({}|{})".format(host, intf, state, role))
+        else:
+            labels.append("{}:{}".format(host, intf))
+    return "\n".join(labels)
+
+# Renders the nodes and edges of a tree as DOT statements, shared by all the VLANs of its class
+def render_dot_body(tree):
+    lines = []
+    for host in sorted(tree["nodes"]):
+        node = tree["nodes"][host]
+        if node["external"]:
+            attrs = 'shape=box, style=dashed'
+            label = host
+        else:
+            label = "{}\nprio {} cost {}".format(host, node["priority"], node["root_cost"])
+            if node["root"]:
+                attrs = 'shape=doubleoctagon, style=filled, fillcolor=gold'
+                label = "{} (RB)\nprio {}".format(host, node["priority"])
+            else:
+                attrs = 'shape=box'
+        lines.append('  {} [label={}, {}];'.format(dot_quote(host), dot_quote(label), attrs))
+    for link in sorted(tree["links"]):
+        ports = tree["links"][link]
+        if link_blocked(ports):
+            attrs = 'color=red, style=dashed'
+        else:
+            attrs = 'color=black, penwidth=2'
+        lines.append('  {} -- {} [label={}, {}];'.format(dot_quote(link[0][0]), dot_quote(link[1][0]),
+                                                         dot_quote(link_label(ports)), attrs))
+    for host, intf, active in sorted(tree["edges"]):
+        edge_node = host + ":" + intf
+        lines.append('  {} [label={}, shape=plaintext, fontsize=8];'.format(dot_quote(edge_node), dot_quote(intf)))
+        lines.append('  {} -- {} [style=dotted{}];'.format(dot_quote(host), dot_quote(edge_node),
+                                                          "" if active else ", color=gray"))
+    return "\n".join(lines) + "\n"
+
+# GraphML attribute keys
+graphml_keys = (("d0", "node", "root", "boolean"), ("d1", "node", "priority", "string"),
+                ("d2", "node", "root_cost", "string"), ("d3", "node", "root_port", "string"),
+                ("d4", "node", "external", "boolean"), ("d5", "edge", "kind", "string"),
+                ("d6", "edge", "blocked", "boolean"), ("d7", "edge", "ports", "string"),
+                ("d8", "edge", "active", "boolean"))
+
+# Renders the nodes and edges of a tree as GraphML elements, shared by all the VLANs of its class
+def render_graphml_body(tree):
+    lines = []
+    for host in sorted(tree["nodes"]):
+        node = tree["nodes"][host]
+        lines.append('    <node id={}>'.format(quoteattr(host)))
+        lines.append('      <data key="d0">{}</data>'.format(str(node["root"]).lower()))
+        lines.append('      <data key="d1">{}</data>'.format(escape(str(node["priority"]))))
+        lines.append('      <data key="d2">{}</data>'.format(escape(str(node["root_cost"]))))
+        lines.append('      <data key="d3">{}</data>'.format(escape(str(node["root_port"]))))
+        lines.append('      <data key="d4">{}</data>'.format(str(node["external"]).lower()))
+        lines.append('    </node>')
+    for index, link in enumerate(sorted(tree["links"])):
+        ports = tree["links"][link]
+        lines.append('    <edge id="l{}" source={} target={}>'.format(index, quoteattr(link[0][0]),
+                                                                            quoteattr(link[1][0])))
+        lines.append('      <data key="d5">lldp</data>')
+        lines.append('      <data key="d6">{}</data>'.format(str(link_blocked(ports)).lower()))
+        lines.append('      <data key="d7">{}</data>'.format(escape(link_label(ports).replace("\n", " "))))
+        lines.append('    </edge>')
+    for index, (host, intf, active) in enumerate(sorted(tree["edges"])):
+        edge_node = host + ":" + intf
+        lines.append('    <node id={}><data key="d4">true</data></node>'.format(quoteattr(edge_node)))
+        lines.append('    <edge id="e{}" source={} target={}>'.format(index, quoteattr(host), quoteattr(edge_node)))
+        lines.append('      <data key="d5">non-lldp</data>')
+        lines.append('      <data key="d8">{}</data>'.format(str(active).lower()))
+        lines.append('    </edge>')
+    return "\n".join(lines) + "\n"
+
+# Writes a DOT file around a rendered body
+def write_dot(file_name, title, body):
+    with open(file_name, 'w') as f:
+        f.write('graph {} {{\n  label={};\n  labelloc=t;\n'.format(dot_quote(title), dot_quote(title)))
+        f.write(body)
+        f.write('}\n')
+
+# Writes a GraphML file around a rendered body
+def write_graphml(file_name, title, body):
+    with open(file_name, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        for key_id, domain, name, key_type in graphml_keys:
+            f.write('  <key id="{}" for="{}" attr.name="{}" attr.type="{}"/>\n'.format(key_id, domain, name,
+                                                                                     key_type))
+        f.write('  <graph id={} edgedefault="undirected">\n'.format(quoteattr(title)))
+        f.write(body)
+        f.write('  </graph>\n</graphml>\n')
+
+graph_formats = {"dot": (render_dot_body, write_dot), "graphml": (render_graphml_body, write_graphml)}
+
+# Writes the graphs of the VLAN trees to out_dir, one file per VLAN (vlan_<id>.<fmt>) or, with per_class, one file per
+# class of identical trees (class_<n>.<fmt>, titled with the class's VLANs). vlan_label formats a list of VLANs.
+# Returns {'vlans': 0, 'classes': 0, 'files': 0}
+def export_vlan_graphs(trees, out_dir, formats=("dot", "graphml"), per_class=False, workers=8,
+                       vlan_label=lambda vlans: ",".join(vlans)):
+    os.makedirs(out_dir, exist_ok=True)
+    classes = tree_classes(trees)
+    jobs = []
+    for class_num, vlans in enumerate(classes, 1):
+        tree = trees[vlans[0]]
+        for fmt in formats:
+            render, write = graph_formats[fmt]
+            body = render(tree)
+            if per_class:
+                title = "Class {}: VLANs {}".format(class_num, vlan_label(vlans))
+                jobs.append((write, os.path.join(out_dir, "class_{}.{}".format(class_num, fmt)), title, body))
+            else:
+                for vlan in vlans:
+                    title = "VLAN {} ({})".format(vlan, trees[vlan]["name"])
+                    jobs.append((write, os.path.join(out_dir, "vlan_{}.{}".format(vlan, fmt)), title, body))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda job: job[0](job[1], job[2], job[3]), jobs))
+    return {"vlans": len(trees), "classes": len(classes), "files": len(jobs)}
@@ -0,0 +1,117 @@
+# File: stp_history.py
+# Purpose: Time-series store of the per-host, per-VLAN spanning tree counters captured by each file or network run.
+#
+# Samples are kept in a SQLite database, keyed by (host, vlan, sample_time) so running an analysis twice against the
+# same captures doesn't add duplicate samples. Topology change deltas and rates are computed from consecutive samples
+# of the same host/VLAN, a counter that goes down (ie. the chassis rebooted) is treated as a reset.
+
+import sqlite3
+import time
+
+# Schema of the STP samples database
+history_schema = """
+CREATE TABLE IF NOT EXISTS stp_samples (
+    host TEXT NOT NULL,
+    vlan INTEGER NOT NULL,
+    sample_time INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    topo_change_count INTEGER,
+    time_since_last_tc INTEGER,
+    root_bridge_mac TEXT,
+    root_cost INTEGER,
+    PRIMARY KEY (host, vlan, sample_time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stp_samples_time ON stp_samples (sample_time);
+CREATE INDEX IF NOT EXISTS idx_stp_samples_vlan_time ON stp_samples (vlan, sample_time);
+"""
+
+# Consecutive samples of each host/VLAN within a window, with the previous counter value
+delta_query = """
+SELECT host, vlan, sample_time, topo_change_count,
+       LAG(topo_change_count) OVER (PARTITION BY host, vlan ORDER BY sample_time) AS prev_count
+FROM stp_samples
+WHERE sample_time BETWEEN ? AND ?
+"""
+
+# Opens (and creates if needed) the history database
+def open_history(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.executescript(history_schema)
+    return conn
+
+# Converts a counter value to an integer, None if it isn't available
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# Adds the STP info of one host to the history
+# stp_ld is the "all" output of the STP extractors, sample_time is the epoch time the data was captured
+def record_stp_samples(conn, host, stp_ld, sample_time=None, source="file"):
+    if sample_time is None:
+        sample_time = time.time()
+    rows = []
+    for stp_dict in stp_ld:
+        vlan = to_int(stp_dict.get("vlan_id"))
+        if vlan is None:
+            continue
+        rows.append((host, vlan, int(sample_time), source, to_int(stp_dict.get("topo_change_count")),
+                     to_int(stp_dict.get("time_since_last_tc")), stp_dict.get("vlan_rb_mac"),
+                     to_int(stp_dict.get("vlan_root_cost"))))
+    conn.executemany("INSERT OR IGNORE INTO stp_samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return len(rows)
+
+# Returns the topology change delta and rate of each host/VLAN between start and end (epoch seconds)
+# tc_ld [
+# tc_dict {'host': '', 'vlan': 0, 'tc_delta': 0, 'samples': 0, 'first': 0, 'last': 0, 'tc_per_hour': 0.0}
+# ]
+def tc_deltas(conn, start, end, host=None, vlan=None):
+    query = """
+    SELECT host, vlan,
+           SUM(CASE WHEN prev_count IS NULL THEN 0
+                    WHEN topo_change_count >= prev_count THEN topo_change_count - prev_count
+                    ELSE topo_change_count END) AS tc_delta,
+           COUNT(*), MIN(sample_time), MAX(sample_time)
+    FROM (""" + delta_query + """)
+    WHERE (? IS NULL OR host = ?) AND (? IS NULL OR vlan = ?)
+    GROUP BY host, vlan
+    ORDER BY tc_delta DESC, host, vlan
+    """
+    tc_ld = []
+    for row in conn.execute(query, (int(start), int(end), host, host, vlan, vlan)):
+        tc_dict = {"host": row[0], "vlan": row[1], "tc_delta": row[2], "samples": row[3], "first": row[4],
+                   "last": row[5]}
+        tc_dict["tc_per_hour"] = tc_rate(tc_dict["tc_delta"], tc_dict["first"], tc_dict["last"])
+        tc_ld.append(tc_dict)
+    return tc_ld
+
+# Returns the VLANs with the most topology changes between start and end, summed over all hosts
+# churn_ld [
+# churn_dict {'vlan': 0, 'tc_delta': 0, 'hosts': 0, 'first': 0, 'last': 0, 'tc_per_hour': 0.0}
+# ]
+def top_churn_vlans(conn, start, end, top=10):
+    query = """
+    SELECT vlan,
+           SUM(CASE WHEN prev_count IS NULL THEN 0
+                    WHEN topo_change_count >= prev_count THEN topo_change_count - prev_count
+                    ELSE topo_change_count END) AS tc_delta,
+           COUNT(DISTINCT host), MIN(sample_time), MAX(sample_time)
+    FROM (""" + delta_query + """)
+    GROUP BY vlan
+    ORDER BY tc_delta DESC, vlan
+    LIMIT ?
+    """
+    churn_ld = []
+    for row in conn.execute(query, (int(start), int(end), top)):
+        churn_dict = {"vlan": row[0], "tc_delta": row[1], "hosts": row[2], "first": row[3], "last": row[4]}
+        churn_dict["tc_per_hour"] = tc_rate(churn_dict["tc_delta"], churn_dict["first"], churn_dict["last"])
+        churn_ld.append(churn_dict)
+    return churn_ld
+
+# Topology changes per hour over the span of the samples
+def tc_rate(tc_delta, first, last):
+    if last <= first or not tc_delta:
+        return 0.0
+    return round(tc_delta * 3600.0 / (last - first), 2)
@@ -0,0 +1,611 @@
+# File: stpbench.py
+# Purpose: Generate synthetic JSON repositories and benchmark the file-based analysis functions.
+#
+# The generated repository has the same files as one captured from real chassis (see the header of stpmap.py):
+# - dev_list.json
+# - <host>_vlan-ext.json   (show vlans extensive | display json)
+# - <host>_stp.json        (show spanning-tree bridge | display json)
+# - <host>_stp-int.json    (show spanning-tree interface | display json)
+# - <host>_lldp.json       (show lldp neighbors | display json)
+#
+# Topology: two core switches (root bridges), then "depth" levels of switches. Every switch below the core is dual
+# homed to two switches of the level above, so each VLAN has a blocked (alternate) uplink on most switches. Trunk
+# ports carry all VLANs, the remaining ports are access ports spread over the VLANs.
+#
+# Styles:
+# - vstp: the root bridge alternates between the two cores per VLAN
+# - mstp: VLANs are mapped to a few instances, all VLANs of an instance share the root bridge and tree.
+#         The data is still written per VLAN, in the vst-bridge-parameters shape the extractors read.
+#
+# Usage:
+# python stpbench.py -g <repo dir> [--switches N] [--vlans N] [--ports N] [--depth N] [--style vstp|mstp]
+#                       [--format json|xml] [--pack gz|xz|zip|tgz]
+# python stpbench.py -b [--scales 10x100,50x500] [--ports N] [--depth N] [--style vstp|mstp] [--format json|xml]
+#                       [--pack gz|xz|zip|tgz]
+#   --format xml writes the captures as "| display xml" output (<host>_stp.xml, ...) instead of JSON
+#   --pack compresses the files of the repository (gz, xz) or archives it (zip, tgz), see repo_source.py
+# python stpbench.py -m [--scales 10x100,50x500] [--budget rss=1024,traced=512,<phase>=256] [--ports N] [--depth N]
+#   Memory benchmark: peak traced (tracemalloc) and RSS memory per phase and host, exits with 1 if a budget is exceeded
+# python stpbench.py -n [--switches N] [--vlans N] [--workers N] [--port N] [--latency S] [--jitter S]
+#                       [--fail-rate P] [--drop-rate P]
+#   Network load test: the generated repository is served by netconf_sim.py and collected concurrently
+
+import getopt
+import gzip
+import json
+import lzma
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+from prettytable import PrettyTable
+
+# Default benchmark scales, (switches, vlans)
+default_scales = [(10, 100), (50, 500), (100, 1000)]
+# Number of MSTP instances used by the mstp style
+mstp_instances = 4
+# Cost of each link, 1G in the Junos default
+link_cost = 20000
+
+# Wraps a value in the Junos JSON leaf format
+def jdata(value):
+    return [{"data": str(value)}]
+
+# Hostname of a switch by index
+def switch_name(index):
+    return "sw{:03d}".format(index)
+
+# Bridge MAC of a switch by index
+def switch_mac(index):
+    return "02:00:5e:{:02x}:{:02x}:{:02x}".format((index >> 16) & 255, (index >> 8) & 255, index & 255)
+
+# Builds the switch links, returns the level of each switch and the link list
+# links [ (switch a, port a, switch b, port b) ]
+def build_topology(switches, ports, depth, rand):
+    levels = [[0, 1]]
+    switch_level = {0: 0, 1: 0}
+    # Spread the remaining switches over the levels, more switches on the deeper levels
+    weights = [2 ** level for level in range(1, depth + 1)]
+    remaining = list(range(2, switches))
+    for level in range(1, depth + 1):
+        count = len(remaining) if level == depth else int(round((switches - 2) * weights[level - 1] / sum(weights)))
+        levels.append(remaining[:count])
+        remaining = remaining[count:]
+        for index in levels[level]:
+            switch_level[index] = level
+    next_port = [0] * switches
+    links = []
+
+    def add_link(a, b):
+        if next_port[a] >= ports or next_port[b] >= ports:
+            return
+        links.append((a, "ge-0/0/{}".format(next_port[a]), b, "ge-0/0/{}".format(next_port[b])))
+        next_port[a] += 1
+        next_port[b] += 1
+
+    add_link(0, 1)
+    for level in range(1, len(levels)):
+        uplinks = [index for index in levels[level - 1]]
+        if not uplinks:
+            uplinks = levels[0]
+        for num, index in enumerate(levels[level]):
+            first = uplinks[num % len(uplinks)]
+            add_link(first, index)
+            if len(uplinks) > 1:
+                second = uplinks[(num + 1 + rand.randrange(len(uplinks) - 1)) % len(uplinks)]
+                add_link(second, index)
+    return switch_level, links, next_port
+
+# Computes the spanning tree from a root, returns each switch's root cost, root port and the role of each link port
+# roles {(switch, port): (role, state, designated switch)}
+def build_tree(root, switches, links, priority):
+    neighbors = {index: [] for index in range(switches)}
+    for a, port_a, b, port_b in links:
+        neighbors[a].append((port_a, b, port_b))
+        neighbors[b].append((port_b, a, port_a))
+    bridge_id = {index: (priority(index), index) for index in range(switches)}
+    # Breadth first search, ties are broken by the lowest designated bridge id
+    cost = {root: 0}
+    root_port = {root: None}
+    frontier = [root]
+    while frontier:
+        next_frontier = {}
+        for index in sorted(frontier, key=lambda i: bridge_id[i]):
+            for port, peer, peer_port in neighbors[index]:
+                if peer in cost:
+                    continue
+                offer = (cost[index] + link_cost, bridge_id[index])
+                if peer not in next_frontier or offer < next_frontier[peer][0]:
+                    next_frontier[peer] = (offer, peer_port)
+        for peer, (offer, peer_port) in next_frontier.items():
+            cost[peer] = offer[0]
+            root_port[peer] = peer_port
+        frontier = list(next_frontier)
+    roles = {}
+    for a, port_a, b, port_b in links:
+        if root_port.get(b) == port_b:
+            roles[(a, port_a)] = ("DESG", "FWD", a)
+            roles[(b, port_b)] = ("ROOT", "FWD", a)
+        elif root_port.get(a) == port_a:
+            roles[(a, port_a)] = ("ROOT", "FWD", b)
+            roles[(b, port_b)] = ("DESG", "FWD", b)
+        else:
+            # The switch with the better path to the root is designated, the other one blocks
+            if (cost.get(a, 0), bridge_id[a]) < (cost.get(b, 0), bridge_id[b]):
+                roles[(a, port_a)] = ("DESG", "FWD", a)
+                roles[(b, port_b)] = ("ALT", "BLK", a)
+            else:
+                roles[(a, port_a)] = ("ALT", "BLK", b)
+                roles[(b, port_b)] = ("DESG", "FWD", b)
+    return cost, root_port, roles
+
+# Generates a complete JSON repository
+def generate_repository(repo, switches=10, vlans=100, ports=48, depth=2, style="vstp", seed=1):
+    if switches < 2:
+        raise ValueError("At least two switches are needed, the core pair")
+    rand = random.Random(seed)
+    os.makedirs(repo, exist_ok=True)
+    switch_level, links, used_ports = build_topology(switches, ports, depth, rand)
+    vlan_tags = list(range(100, 100 + vlans))
+
+    # Root of each VLAN, both styles alternate between the two cores
+    if style == "mstp":
+        vlan_root = {tag: (num % mstp_instances) % 2 for num, tag in enumerate(vlan_tags)}
+    else:
+        vlan_root = {tag: num % 2 for num, tag in enumerate(vlan_tags)}
+    trees = {}
+    for root in (0, 1):
+        backup = 1 - root
+
+        def priority(index, root=root, backup=backup):
+            return 4096 if index == root else 8192 if index == backup else 32768
+        trees[root] = (build_tree(root, switches, links, priority), priority)
+
+    # Link ports of each switch
+    link_ports = {index: [] for index in range(switches)}
+    for a, port_a, b, port_b in links:
+        link_ports[a].append((port_a, b, port_b))
+        link_ports[b].append((port_b, a, port_a))
+
+    dev_list = {}
+    for index in range(switches):
+        dev_list[switch_name(index)] = "10.{}.{}.{}".format(switch_level[index], (index >> 8) & 255, index & 255)
+    with open(os.path.join(repo, "dev_list.json"), 'w') as w:
+        json.dump(dev_list, w)
+
+    for index in range(switches):
+        host = switch_name(index)
+        trunk_ports = [port for port, peer, peer_port in link_ports[index]]
+        access_ports = ["ge-0/0/{}".format(num) for num in range(used_ports[index], ports)]
+        # Spread the access ports over the VLANs, some of them down
+        access_by_vlan = {}
+        for num, port in enumerate(access_ports):
+            access_by_vlan.setdefault(vlan_tags[(num + index) % len(vlan_tags)], []).append(
+                port + (".0*" if rand.random() > 0.2 else ".0"))
+
+        # Serialized STP interface entries of the trunk ports per root, shared by all the VLANs of that root
+        trunk_entries = {}
+        for root, ((cost, root_port, roles), priority) in trees.items():
+            trunk_entries[root] = []
+            for port, peer, peer_port in link_ports[index]:
+                role, state, desg = roles[(index, port)]
+                trunk_entries[root].append(json.dumps({
+                    "interface-name": jdata(port), "port-cost": jdata(link_cost), "port-state": jdata(state),
+                    "designated-bridge-mac": jdata(switch_mac(desg)),
+                    "designated-bridge-priority": jdata(priority(desg)), "port-role": jdata(role)}))
+
+        vlan_groups = []
+        stp_params = []
+        stp_instances = []
+        for tag in vlan_tags:
+            root = vlan_root[tag]
+            (cost, root_port, roles), priority = trees[root]
+            members = [port + ".0*" for port in trunk_ports] + access_by_vlan.get(tag, [])
+            group = {"l2ng-l2rtb-vlan-name": jdata("vlan{}".format(tag)), "l2ng-l2rtb-vlan-tag": jdata(tag),
+                     "l2ng-l2rtb-vlan-member": [{"l2ng-l2rtb-vlan-member-interface": jdata(member)}
+                                                for member in members]}
+            if index == root:
+                group["l2ng-l2rtb-vlan-l3-interface"] = jdata("irb.{}".format(tag))
+            vlan_groups.append(json.dumps(group))
+
+            tc_count = rand.choice([0, 0, 1, 2, 3, rand.randrange(100)])
+            params = {"vlan-id": jdata(tag),
+                      "root-bridge": [{"bridge-priority": jdata(priority(root)),
+                                       "bridge-mac": jdata(switch_mac(root))}],
+                      "this-bridge": [{"bridge-priority": jdata(priority(index)),
+                                       "bridge-mac": jdata(switch_mac(index))}],
+                      "topology-change-count": jdata(tc_count),
+                      "time-since-last-tc": jdata(rand.randrange(1, 2000000) if tc_count else 0)}
+            if index != root:
+                params["root-port"] = jdata(root_port.get(index))
+                params["root-cost"] = jdata(cost.get(index, 0))
+            stp_params.append(json.dumps(params))
+
+            # Access ports are designated edge ports
+            entries = list(trunk_entries[root])
+            for member in access_by_vlan.get(tag, []):
+                entries.append(json.dumps({"interface-name": jdata(member.split(".")[0]),
+                                           "port-cost": jdata(link_cost), "port-state": jdata("FWD"),
+                                           "designated-bridge-mac": jdata(switch_mac(index)),
+                                           "designated-bridge-priority": jdata(priority(index)),
+                                           "port-role": jdata("DESG")}))
+            stp_instances.append('{"vlan-id": ' + json.dumps(jdata(tag)) +
+                                 ', "stp-interfaces": [{"stp-interface-entry": [' + ", ".join(entries) + ']}]}')
+
+        write_json_list(os.path.join(repo, host + "_vlan-ext.json"),
+                        '{"l2ng-l2ald-vlan-instance-information": [{"l2ng-l2ald-vlan-instance-group": [', vlan_groups)
+        write_json_list(os.path.join(repo, host + "_stp.json"),
+                        '{"stp-bridge": [{"vst-bridge-parameters": [', stp_params)
+        write_json_list(os.path.join(repo, host + "_stp-int.json"),
+                        '{"stp-interface-information": [{"stp-instance": [', stp_instances)
+        neighbors = []
+        for port, peer, peer_port in link_ports[index]:
+            neighbors.append({"lldp-local-port-id": jdata(port), "lldp-local-parent-interface-name": jdata("-"),
+                              "lldp-remote-chassis-id-subtype": jdata("Mac address"),
+                              "lldp-remote-chassis-id": jdata(switch_mac(peer)),
+                              "lldp-remote-port-description": jdata(peer_port),
+                              "lldp-remote-system-name": jdata(switch_name(peer))})
+        with open(os.path.join(repo, host + "_lldp.json"), 'w') as w:
+            json.dump({"lldp-neighbors-information": [{"lldp-neighbor-information": neighbors}]}, w)
+    return dev_list
+
+# Writes a JSON document whose innermost list is given as already serialized items
+def write_json_list(file_name, head, items):
+    with open(file_name, 'w') as w:
+        w.write(head)
+        w.write(", ".join(items))
+        w.write("]}]}")
+
+# Namespaces of the "| display xml" captures
+junos_xmlns = "http://xml.juniper.net/junos/18.4R2/junos"
+capture_xmlns = {"l2ng-l2ald-vlan-instance-information": junos_xmlns + "-l2al", "stp-bridge": junos_xmlns + "-stp",
+                 "stp-interface-information": junos_xmlns + "-stp", "lldp-neighbors-information": junos_xmlns}
+
+# Writes an element of a Junos JSON document as XML, a {"data": value} leaf is the element's text
+def write_xml_element(w, tag, value, depth, xmlns=None):
+    indent = "    " * depth
+    attrs = ' xmlns="{}"'.format(xmlns) if xmlns else ""
+    if "data" in value:
+        w.write('{}<{}{}>{}</{}>\n'.format(indent, tag, attrs, escape(str(value["data"])), tag))
+        return
+    w.write('{}<{}{}>\n'.format(indent, tag, attrs))
+    for key, items in value.items():
+        if key != "attributes":
+            for item in items:
+                write_xml_element(w, key, item, depth + 1)
+    w.write('{}</{}>\n'.format(indent, tag))
+
+# Writes a Junos JSON document as the "| display xml" capture of the same command
+def write_xml_capture(file_name, doc):
+    with open(file_name, 'w') as w:
+        w.write('<rpc-reply xmlns:junos="{}">\n'.format(junos_xmlns))
+        for tag, items in doc.items():
+            for item in items:
+                write_xml_element(w, tag, item, 1, capture_xmlns.get(tag, junos_xmlns))
+        w.write('    <cli>\n        <banner>{master:0}</banner>\n    </cli>\n</rpc-reply>\n')
+
+# Replaces the JSON captures of a repository (all but dev_list.json) with XML captures
+def convert_repository_xml(repo):
+    for entry in os.scandir(repo):
+        if entry.name.endswith(".json") and entry.name != "dev_list.json":
+            with open(entry.path) as f:
+                doc = json.load(f)
+            write_xml_capture(entry.path[:-len(".json")] + ".xml", doc)
+            os.remove(entry.path)
+
+# Compresses the files of a repository in place (gz, xz) or replaces it with an archive (zip, tgz)
+# Returns the path of the packed repository
+def pack_repository(repo, pack):
+    if pack in ("gz", "xz"):
+        opener = gzip.open if pack == "gz" else lzma.open
+        for entry in os.scandir(repo):
+            with open(entry.path, 'rb') as f, opener(entry.path + "." + pack, 'wb') as w:
+                shutil.copyfileobj(f, w)
+            os.remove(entry.path)
+        return repo
+    if pack == "zip":
+        archive = repo + ".zip"
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as w:
+            for entry in os.scandir(repo):
+                w.write(entry.path, entry.name)
+    elif pack == "tgz":
+        archive = repo + ".tar.gz"
+        with tarfile.open(archive, 'w:gz') as w:
+            for entry in os.scandir(repo):
+                w.add(entry.path, entry.name)
+    else:
+        raise ValueError("Unknown pack format: {}".format(pack))
+    shutil.rmtree(repo)
+    return archive
+
+# Removes a generated repository, a directory or an archive
+def remove_repository(repo):
+    if os.path.isdir(repo):
+        shutil.rmtree(repo)
+    else:
+        os.remove(repo)
+
+# Size of a repository in MB
+def repository_size(repo):
+    if os.path.isfile(repo):
+        return os.path.getsize(repo) / 1048576.0
+    total = 0
+    for entry in os.scandir(repo):
+        total += entry.stat().st_size
+    return total / 1048576.0
+
+# Time the file based analysis paths on a repository
+# result {'collect_vlans': 0.0, 'stp_map': 0.0, 'root_bridge_analysis': 0.0}
+def benchmark_repository(repo, out_dir):
+    import stpmap
+    stpmap.detect_env()
+    stpmap.selected_repo = repo + "/"
+    stpmap.table_file = os.path.join(out_dir, "table_file.txt")
+    stpmap.stp_chart = os.path.join(out_dir, "stp_chart.txt")
+    stpmap.stp_stats = os.path.join(out_dir, "stp_stats.txt")
+    stpmap.history_db = os.path.join(out_dir, "stp_history.db")
+    # Cached results would be measured instead of the analyses
+    stpmap.result_cache_mb = 0
+    stpmap.result_cache = None
+    stpmap.dev_list = stpmap.json_to_dict(os.path.join(repo, "dev_list.json"))
+    stpmap.host_cache.clear()
+    result = {}
+    saved_stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            # Equivalent of "Scan Vlans (Files)" without the VLAN prompt, using the middle VLAN
+            start = time.perf_counter()
+            vlan_host_ld = stpmap.collect_all_vlans_json(stpmap.selected_repo)
+            result["collect_vlans"] = time.perf_counter() - start
+            vlan_list = stpmap.numeric_vlan_list(vlan_host_ld)
+            selected_vlan = vlan_list[len(vlan_list) // 2]
+            start = time.perf_counter()
+            stpmap.stp_map_vlan(selected_vlan, list(stpmap.hosts_for_vlan(vlan_host_ld, selected_vlan)),
+                                using_network=False)
+            result["stp_map"] = time.perf_counter() - start
+            start = time.perf_counter()
+            stpmap.root_bridge_analysis()
+            result["root_bridge_analysis"] = time.perf_counter() - start
+        finally:
+            sys.stdout = saved_stdout
+    return result
+
+# Generate a repository at each scale and benchmark it, with XML captures if capture_format is "xml" and packed with
+# pack if given
+def run_benchmarks(scales, ports=48, depth=2, style="vstp", pack="", capture_format="json"):
+    myTable = PrettyTable(["Switches", "VLANs", "Size (MB)", "Generate (s)", "Collect VLANs (s)", "STP Map (s)",
+                           "Root Bridge Analysis (s)"])
+    work_dir = tempfile.mkdtemp(prefix="stpbench_")
+    try:
+        for switches, vlans in scales:
+            repo = os.path.join(work_dir, "{}x{}".format(switches, vlans))
+            print("-> Generating {} switches x {} VLANs ...".format(switches, vlans))
+            start = time.perf_counter()
+            generate_repository(repo, switches, vlans, ports, depth, style)
+            if capture_format == "xml":
+                convert_repository_xml(repo)
+            if pack:
+                repo = pack_repository(repo, pack)
+            generate_time = time.perf_counter() - start
+            print("-> Benchmarking {} ...".format(repo))
+            result = benchmark_repository(repo, work_dir)
+            myTable.add_row([switches, vlans, "{:.1f}".format(repository_size(repo)), "{:.2f}".format(generate_time),
+                             "{:.3f}".format(result["collect_vlans"]), "{:.3f}".format(result["stp_map"]),
+                             "{:.3f}".format(result["root_bridge_analysis"])])
+            remove_repository(repo)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(myTable)
+
+# Generate a repository at each scale and report the peak memory of the file based analysis paths
+# Returns the budget violations, a list of messages
+def run_memory_benchmarks(scales, budgets, ports=48, depth=2, style="vstp"):
+    import profiler
+    profiler.enable_memory_profiling()
+    myTable = PrettyTable(["Switches", "VLANs", "Size (MB)", "Peak Traced (MB)", "Peak RSS (MB)", "Largest Phase",
+                           "Budget"])
+    violations = []
+    work_dir = tempfile.mkdtemp(prefix="stpbench_")
+    try:
+        for switches, vlans in scales:
+            repo = os.path.join(work_dir, "{}x{}".format(switches, vlans))
+            print("-> Generating {} switches x {} VLANs ...".format(switches, vlans))
+            generate_repository(repo, switches, vlans, ports, depth, style)
+            print("-> Measuring {} ...".format(repo))
+            # Only the analysis is measured, not the generation
+            profiler.reset_profile()
+            benchmark_repository(repo, work_dir)
+            memory_dict = profiler.memory_summary()
+            profiler.print_memory_report(top=5)
+            scale_violations = check_budgets(memory_dict, budgets)
+            for message in scale_violations:
+                violations.append("{}x{}: {}".format(switches, vlans, message))
+            largest = max(memory_dict["phases"], key=lambda p: memory_dict["phases"][p]["growth"])
+            myTable.add_row([switches, vlans, "{:.1f}".format(repository_size(repo)),
+                             "{:.1f}".format(memory_dict["peak_traced"]), "{:.1f}".format(memory_dict["peak_rss"]),
+                             largest, "FAIL" if scale_violations else "ok"])
+            shutil.rmtree(repo)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        profiler.enable_memory_profiling(False)
+    print(myTable)
+    return violations
+
+# Parses "rss=1024,traced=512,root_bridge_analysis=256" into a budget dictionary (MB)
+# "rss" and "traced" cap the peaks of the whole run, any other name caps the traced peak of that phase
+def parse_budgets(budget_str):
+    budgets = {}
+    for item in budget_str.split(","):
+        name, megabytes = item.split("=")
+        budgets[name.strip()] = float(megabytes)
+    return budgets
+
+# Compares the peaks of a memory summary with the budgets, returns a message for each budget exceeded
+def check_budgets(memory_dict, budgets):
+    violations = []
+    for name, limit in sorted(budgets.items()):
+        if name == "rss":
+            peak = memory_dict["peak_rss"]
+        elif name == "traced":
+            peak = memory_dict["peak_traced"]
+        elif name in memory_dict["phases"]:
+            peak = memory_dict["phases"][name]["traced"]
+        else:
+            continue
+        if peak > limit:
+            violations.append("{} peak {:.1f} MB exceeds the {:.1f} MB budget".format(name, peak, limit))
+    return violations
+
+# Collects the host model (VLAN, STP, STP interface and LLDP data) of one device with the stpmap network collector
+# result {'host': '', 'ok': True, 'error': '', 'vlans': 0}
+def collect_device(stpmap, host, ip):
+    result = {"host": host, "ok": True, "error": "", "vlans": 0}
+    stpmap.set_profile_host(host)
+    try:
+        with stpmap.device_session(ip) as jdev:
+            host_model = stpmap.collect_host_model(stpmap.NetconfCollector(jdev, ip, stpmap.stdout.write))
+            result["vlans"] = len(host_model["vlan"])
+    except Exception as err:
+        result["ok"] = False
+        result["error"] = type(err).__name__
+    return result
+
+# Simulates a generated repository with netconf_sim.py and collects every device concurrently
+def run_netload(switches, vlans, workers=20, sim_config=None, ports=48, depth=2, style="vstp"):
+    import stpmap
+    from netconf_sim import NetconfSimulator
+    work_dir = tempfile.mkdtemp(prefix="stpbench_")
+    try:
+        repo = os.path.join(work_dir, "{}x{}".format(switches, vlans))
+        print("-> Generating {} switches x {} VLANs ...".format(switches, vlans))
+        generate_repository(repo, switches, vlans, ports, depth, style)
+        with NetconfSimulator(repo, sim_config) as simulator:
+            stpmap.detect_env()
+            stpmap.username = "stpbench"
+            stpmap.password = "stpbench"
+            stpmap.netconf_port = simulator.sim_config["port"]
+            stpmap.dev_list = simulator.dev_list()
+            stpmap.device_metrics_file = os.path.join(work_dir, "device_metrics.json")
+            stpmap.reset_device_metrics()
+            print("-> Collecting {} simulated devices with {} workers ...".format(switches, workers))
+            # The "Pulling ..." progress lines of every device would interleave, so they are silenced
+            saved_stdout = stpmap.stdout
+            with open(os.devnull, 'w') as devnull:
+                stpmap.stdout = devnull
+                try:
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        results = list(executor.map(lambda item: collect_device(stpmap, item[0], item[1]),
+                                                    stpmap.dev_list.items()))
+                    wall_time = time.perf_counter() - start
+                finally:
+                    stpmap.stdout = saved_stdout
+            rpc_total = sum(simulator.rpc_counts().values())
+        failed = [result for result in results if not result["ok"]]
+        myTable = PrettyTable(["Devices", "Workers", "Collected", "Failed", "RPCs Served", "Wall Time (s)",
+                               "Devices/s"])
+        myTable.add_row([switches, workers, len(results) - len(failed), len(failed), rpc_total,
+                         "{:.2f}".format(wall_time), "{:.1f}".format(len(results) / wall_time)])
+        print(myTable)
+        if failed:
+            errors = {}
+            for result in failed:
+                errors[result["error"]] = errors.get(result["error"], 0) + 1
+            print("Failures: " + ", ".join("{} x{}".format(error, count) for error, count in sorted(errors.items())))
+        # The device metrics JSON is written to the work directory, removed with the generated repository
+        stpmap.print_device_report(stpmap.device_metrics_file, stpmap.dev_ip_names())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+# Parses "10x100,50x500" into [(10, 100), (50, 500)]
+def parse_scales(scale_str):
+    scales = []
+    for scale in scale_str.split(","):
+        switches, vlans = scale.lower().split("x")
+        scales.append((int(switches), int(vlans)))
+    return scales
+
+usage = ("stpbench.py -g <repo dir> [--switches N] [--vlans N] [--ports N] [--depth N] [--style vstp|mstp] "
+         "[--format json|xml] [--pack gz|xz|zip|tgz]\n"
+         "stpbench.py -b [--scales 10x100,50x500] [--ports N] [--depth N] [--style vstp|mstp] [--format json|xml] "
+         "[--pack gz|xz|zip|tgz]\n"
+         "stpbench.py -m [--scales 10x100,50x500] [--budget rss=MB,traced=MB,<phase>=MB] [--ports N] [--depth N]\n"
+         "stpbench.py -n [--switches N] [--vlans N] [--workers N] [--port N] [--latency S] [--jitter S] "
+         "[--fail-rate P] [--drop-rate P]")
+
+# Main execution
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hg:bmn", ["switches=", "vlans=", "ports=", "depth=", "style=",
+                                                           "scales=", "workers=", "port=", "latency=", "jitter=",
+                                                           "fail-rate=", "drop-rate=", "budget=", "pack=", "format="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    options = {"switches": 10, "vlans": 100, "ports": 48, "depth": 2, "style": "vstp", "scales": default_scales,
+               "workers": 20, "pack": "", "format": "json"}
+    # Settings passed to the NETCONF simulator of the network load test
+    sim_config = {"latency": {"default": 0.0}}
+    generate_dir = ""
+    benchmark = False
+    memory = False
+    budgets = {}
+    netload = False
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-g":
+            generate_dir = arg
+        elif opt == "-b":
+            benchmark = True
+        elif opt == "-m":
+            memory = True
+        elif opt == "--budget":
+            budgets = parse_budgets(arg)
+        elif opt == "-n":
+            netload = True
+        elif opt == "--port":
+            sim_config["port"] = int(arg)
+        elif opt == "--latency":
+            sim_config["latency"]["default"] = float(arg)
+        elif opt in ("--jitter", "--fail-rate", "--drop-rate"):
+            sim_config[opt.lstrip("-").replace("-", "_")] = float(arg)
+        elif opt in ("--style", "--pack", "--format"):
+            options[opt.lstrip("-")] = arg
+        elif opt == "--scales":
+            options["scales"] = parse_scales(arg)
+        else:
+            options[opt.lstrip("-")] = int(arg)
+    if generate_dir:
+        generate_repository(generate_dir, options["switches"], options["vlans"], options["ports"], options["depth"],
+                            options["style"])
+        if options["format"] == "xml":
+            convert_repository_xml(generate_dir)
+        if options["pack"]:
+            generate_dir = pack_repository(generate_dir, options["pack"])
+        print("Generated {} switches x {} VLANs in {}".format(options["switches"], options["vlans"], generate_dir))
+    elif benchmark:
+        run_benchmarks(options["scales"], options["ports"], options["depth"], options["style"], options["pack"],
+                       options["format"])
+    elif memory:
+        violations = run_memory_benchmarks(options["scales"], budgets, options["ports"], options["depth"],
+                                           options["style"])
+        for message in violations:
+            print("!! Memory budget exceeded, " + message)
+        if violations:
+            sys.exit(1)
+    elif netload:
+        run_netload(options["switches"], options["vlans"], options["workers"], sim_config, options["ports"],
+                    options["depth"], options["style"])
+    else:
+        print(usage)
@@ -1,17 +1,18 @@
 # STPMAP.PY
-# The network-based functions pull information from the actual chassis. It uses an RPC that pulls data formatted by a
-# YAML table/view:
-# The YAML table/views are located under ../python3.11/site-packages/jnpr/junos/op
-# The default YAML table/views may need to be modified so that the correct information can be pulled.
+# The network-based functions send the RPCs of the YAML table/views in yamls/, the file-based functions read captures of
+# the same commands. Both extract the replies with the plans compiled from those table/views (see capture_plan.py), so
+# a VLAN, spanning tree or LLDP record is the same whichever way it was collected. The table/views don't need to be
+# installed under jnpr/junos/op. The records of each host are collected into one host model (see host_model.py) that
+# the chart, stats and root bridge analysis read, whether the host was collected from files or the network. A network
+# scan of one VLAN, or a root bridge analysis limited with --vlans, passes the VLANs in the RPC arguments so the devices
+# only send the data of those VLANs.
 #
-# List of table/views Needed:
+# List of table/views used:
 # - vlan.yml
 # - stpbridge.yml
+# - stpint.yml
 # - lldp.yml
 #
-# Please find the included YAML files, they will need to be added to the path indicated for the network-based functions
-# to work correctly.
-#
 # The file-based functions use the data pulled from "show" commands using the " | display json | no-more" option to
 # correctly format the output. The files will likely need to be cleaned up. The output is in the form of .json files.
 # Ensure that the files are UTF-8. Any other formats may cause problems, including UTF-8 with BOM encoding.
@@ -19,13 +20,30 @@
 # List of commands used:
 # - show vlan extensive | display json | no-more
 # - show spanning-tree bridge | display json | no-more
+# - show spanning-tree interface | display json | no-more
 # - show lldp neighbors | display json | no-more
+# - show ethernet-switching table detail | display json | no-more   (MAC scan)
+# - show interfaces | display json | no-more                        (MAC scan)
 #
 # File Format:
 # The format of the file name is important. The Chassis Hostname must be the :
 # For LLDP file: <Chassis Hostname>_lldp.json
 # For Spanning Tree file: <Chassis Hostname>_stp.json
 # For VLAN file: <Chassis Hostname>_vlan-ext.json
+# For Ethernet Switching file: <Chassis Hostname>_ether-sw.json
+# For Interfaces file: <Chassis Hostname>_int.json
+# The repository index (repo_index.json) is written next to dev_list.json and kept up to date automatically. A
+# read-only repository keeps its index in memory, and its store (--store) in the script directory.
+#
+# XML captures:
+# The VLAN, spanning tree and LLDP commands may also be captured with " | display xml | no-more" instead, saved as
+# <Chassis Hostname>_vlan-ext.xml, _stp.xml, _stp-int.xml and _lldp.xml. They are streamed (lxml iterparse), one
+# record at a time, and give the same data as the JSON captures. A host's JSON capture is used if it has both.
+#
+# Compressed and archived repositories:
+# The files of a repository may be compressed one by one (<file>.json.gz, <file>.json.xz), or the whole repository may
+# be a .zip, .tar, .tar.gz or .tar.xz archive placed in the json folder next to the repository directories. They are
+# read as they are, nothing is extracted to disk. The index and store of an archived repository are written beside it.
 
 
 import getopt
@@ -43,24 +61,63 @@ import multiprocessing
 from jnpr.junos import Device
 from jnpr.junos.utils.sw import SW
 from jnpr.junos.exception import *
-from jnpr.junos.op.lldp import LLDPNeighborTable
-from jnpr.junos.op.stpbridge import STPBridgeTable
-from jnpr.junos.op.vlan import VlanTable
 from jnpr.junos.op.elsethernetswitchingtable import ElsEthernetSwitchingTable
 from jnpr.junos.op.phyport import PhyPortTable
 from ncclient.operations.errors import TimeoutExpiredError
 from utility import *
+from macs import MacTable, MacLocationIndex, mac_to_int, int_to_mac, bridge_mac
+from streamtable import StreamTable
+from export import export_rows, export_format, vlan_export_rows, chassis_export_rows
+from export import vlan_export_keys, chassis_export_keys, suspect_export_keys
+from suspect_rules import InterfaceTable, load_rules, evaluate_rules, suspect_rows
+from host_model import collect_host_model, model_vlan_records, host_file_suffixes, xml_file_suffixes
+from host_model import FileCollector, NetconfCollector, parse_vlan_range
+from stp_graph import build_vlan_trees, export_vlan_graphs
+from result_cache import ResultCache
+from repo_index import load_index, save_index, update_index, index_vlan_hosts
+from repo_store import open_store, stored_stamps, sync_hosts, load_host, store_vlan_list, vlan_hosts, vlan_stp_bridges
+from repo_store import vlan_stp_instances, host_vlan_records, host_bridge_macs, host_lldp_links, lldp_neighbors
+from repo_store import RowSource, StoreMacIndex, store_file_name
+from repo_source import source_exists, source_stamp, source_mtime, list_sources, prefetch_sources
+from repo_source import is_archive, open_source, writable_side_path, close_archives
+from stp_history import open_history, record_stp_samples, tc_deltas, top_churn_vlans
+from profiler import timed_phase, timed_span, enable_profiling, set_profile_host, reset_profile, print_profile_report
+from profiler import device_timer, record_device_metric, reset_device_metrics, print_device_report
+from profiler import enable_memory_profiling, print_memory_report
 from os.path import join
 from getpass import getpass
 from prettytable import PrettyTable
 from sys import stdout
 from lxml import etree
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Global Variables
 credsCSV = ""
 username = ""
 password = ""
 ssh_port = 22
+# Port of the NETCONF service, 830 unless changed with --port (ie. to reach netconf_sim.py)
+netconf_port = 830
+# Number of devices the MAC scan collects at the same time, changed with --workers
+mac_scan_workers = 20
+# Extension of the bulk exports of the analysis results (csv, jsonl, csv.gz or jsonl.gz), None to skip them
+export_ext = None
+# Size cap of the on-disk result cache in MB, changed with --cache-mb (0 disables the cache)
+result_cache_mb = 256
+# The result cache, opened on first use
+result_cache = None
+# File analyses query the SQLite repository store instead of holding the repository in memory, set with --store
+use_store = False
+# Connection to the repository store of the selected repository and its file, opened by ingest_repository()
+repo_store = None
+repo_store_file = None
+# VLANs the root bridge analysis is limited to, set with --vlans (ie. 100-120,300), None for all VLANs
+vlan_range = None
+# VLAN names learned from the devices {tag: name}, network scans of a VLAN pull it by name
+net_vlan_names = {}
+# Repository indexes that couldn't be saved in their repository (read-only or shared), {repo: index}
+unsaved_indexes = {}
 
 iplist_dir = ""
 log_dir = ""
@@ -78,6 +135,20 @@ dev_list = {}
 # Dictionary to hold chassis information
 all_chassis = {}
 
+# Suffixes of the files loaded into the repository store, the MAC table capture is optional
+store_file_suffixes = dict(host_file_suffixes, **{"ether-sw": "_ether-sw.json"})
+# Files tracked by the repository index, JSON or XML
+index_file_suffixes = dict(host_file_suffixes, **{key + "-xml": suffix for key, suffix in xml_file_suffixes.items()})
+# Files read by the MAC scan, in the order they are read
+ether_file_suffixes = {"ether-sw": "_ether-sw.json", "vlan": "_vlan-ext.json", "int": "_int.json", "lldp": "_lldp.json"}
+# Version of the host data layout, part of its result cache key
+host_data_version = 4
+# Version of the analysis results, part of their result cache keys with host_data_version. Bump it when a change of
+# the extraction or the analyses changes the cached results.
+analysis_version = 1
+# Parsed JSON files of each host, so unchanged hosts aren't parsed again
+host_cache = {}
+
 
 # Function to determine running environment (Windows/Linux/Mac) and use correct path syntax
 def detect_env():
@@ -102,6 +173,16 @@ def detect_env():
     global stp_stats
     global mac_scan_results
     global mac_scan_csv
+    global history_db
+    global history_report
+    global tc_storm_file
+    global profile_file
+    global device_metrics_file
+    global memory_file
+    global mac_flap_file
+    global suspect_rules_file
+    global graph_dir
+    global result_cache_dir
 
     dir_path = os.path.dirname(os.path.abspath(__file__))
     if platform.system().lower() == "windows":
@@ -132,21 +213,101 @@ def detect_env():
     stp_stats = os.path.join(dir_path, "stp_stats.txt")
     mac_scan_results = os.path.join(dir_path, "mac_scan_results.txt")
     mac_scan_csv = os.path.join(dir_path, "mac_scan_csv.csv")
+    history_db = os.path.join(dir_path, "stp_history.db")
+    history_report = os.path.join(dir_path, "stp_history.txt")
+    tc_storm_file = os.path.join(dir_path, "tc_storm.txt")
+    profile_file = os.path.join(dir_path, "profile_report.json")
+    device_metrics_file = os.path.join(dir_path, "device_metrics.json")
+    memory_file = os.path.join(dir_path, "memory_report.json")
+    mac_flap_file = os.path.join(dir_path, "mac_flaps.txt")
+    suspect_rules_file = os.path.join(dir_path, "suspect_rules.json")
+    graph_dir = os.path.join(dir_path, "graphs")
+    result_cache_dir = os.path.join(dir_path, "cache")
+
+# Integer value of a command line option, ValueError if it isn't a number from low to high (no upper bound if None)
+def option_int(arg, low, high=None):
+    try:
+        value = int(arg)
+    except ValueError:
+        raise ValueError("not a number")
+    if value < low:
+        raise ValueError("must be at least {}".format(low) if high is None else "must be {}-{}".format(low, high))
+    if high is not None and value > high:
+        raise ValueError("must be {}-{}".format(low, high))
+    return value
 
 # Handles arguments provided at the command line
 def getargs(argv):
     # Interprets and handles the command line arguments
+    global netconf_port
+    global mac_scan_workers
+    global export_ext
+    global result_cache_mb
+    global use_store
+    global vlan_range
+    user = None
+    usage = ("stpmap.py -u <username> [-p <netconf port>] [--workers N] [--export csv|jsonl[.gz]] [--cache-mb MB] "
+             "[--store] [--vlans 100-120,300] [--profile] [--memory]")
     try:
-        opts, args = getopt.getopt(argv, "hu:", ["user="])
+        opts, args = getopt.getopt(argv, "hu:p:", ["user=", "port=", "workers=", "export=", "cache-mb=", "store", "vlans=", "profile", "memory"])
     except getopt.GetoptError:
-        print("stpmap.py -u <username>")
+        print(usage)
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print("stpmap.py -u <username>")
+            print(usage)
             sys.exit()
         elif opt in ("-u", "--user"):
-            return arg
+            user = arg
+        elif opt in ("-p", "--port"):
+            try:
+                netconf_port = option_int(arg, 1, 65535)
+            except ValueError as err:
+                print("Invalid --port {}: {}".format(arg, err))
+                print(usage)
+                sys.exit(2)
+        elif opt == "--workers":
+            try:
+                mac_scan_workers = option_int(arg, 1)
+            except ValueError as err:
+                print("Invalid --workers {}: {}".format(arg, err))
+                print(usage)
+                sys.exit(2)
+        elif opt == "--export":
+            # Export the full results of each analysis, ie. --export jsonl.gz
+            export_ext = arg.lstrip(".")
+            try:
+                export_format("export." + export_ext)
+            except ValueError:
+                print("Invalid --export {}: must be csv or jsonl, optionally .gz".format(arg))
+                print(usage)
+                sys.exit(2)
+        elif opt == "--cache-mb":
+            # 0 turns the result cache off
+            try:
+                result_cache_mb = option_int(arg, 0)
+            except ValueError as err:
+                print("Invalid --cache-mb {}: {}".format(arg, err))
+                print(usage)
+                sys.exit(2)
+        elif opt == "--store":
+            # Load the repository into SQLite and run the file analyses as queries, for very large repositories
+            use_store = True
+        elif opt == "--vlans":
+            # Limit the root bridge analysis to some VLANs, the network RPCs are filtered to them
+            try:
+                vlan_range = parse_vlan_range(arg)
+            except ValueError as err:
+                print("Invalid --vlans {}: {}".format(arg, err))
+                print(usage)
+                sys.exit(2)
+        elif opt == "--profile":
+            # Time each phase of a run and report it when the run completes
+            enable_profiling()
+        elif opt == "--memory":
+            # Record the peak memory of each phase and host, and report it when the run completes
+            enable_memory_profiling()
+    return user
 
 
 # A function to open a connection to devices and capture any exceptions
@@ -157,12 +318,13 @@ def connect(ip):
     :param indbase:     -   Boolean if this device is in the database or not, defaults to False if not specified
     :return dev:        -   Returns the device handle if its successfully opened.
     """
-    dev = Device(host=ip, user=username, password=password, auto_probe=True)
+    dev = Device(host=ip, user=username, password=password, port=netconf_port, auto_probe=True)
     message = ""
 
     # Try to open a connection to the device
     try:
-        dev.open()
+        with device_timer(ip, "connect", "netconf"):
+            dev.open()
     # If there is an error when opening the connection, display error and exit upgrade process
     except ConnectRefusedError as err:
         message = "Host Reachable, but NETCONF not configured."
@@ -187,394 +349,36 @@ def connect(ip):
         return dev
 
 
+# Returns an ip -> hostname dictionary of the device list
+def dev_ip_names():
+    names = {}
+    for host, ip in dev_list.items():
+        names[ip] = host
+    return names
+
+# Opens a NETCONF session to a device, recording how long the connection took
+@contextmanager
+def device_session(ip):
+    jdev = Device(host=ip, user=username, password=password, port=netconf_port)
+    with device_timer(ip, "connect", "netconf"):
+        jdev.open()
+    try:
+        yield jdev
+    finally:
+        jdev.close()
+
+# Runs the RPC of a PyEZ table, recording the RPC latency and the size of the reply
+def timed_table_get(table, ip, name, **kvargs):
+    with device_timer(ip, "rpc", name):
+        table.get(**kvargs)
+    record_device_metric(ip, "payload", name, len(etree.tostring(table.xml)))
+    return table
+
 # Create a log
 def create_timestamped_log(prefix, extension):
     now = datetime.datetime.now()
     return log_dir + prefix + now.strftime("%Y%m%d-%H%M") + "." + extension
 
-# VLAN info captured via network
-def extract_vlan_info(vlaninfo, selected_vlan='all'):
-    vlan_ld = []
-    # print("******* VLAN INFO ******")
-    vlan_found = False
-    for name in vlaninfo:
-        vlan_dict = {}
-        if selected_vlan == 'all' or name.tag == selected_vlan:
-            # print("{} | {} | {} | {}".format(name.name, name.tag, name.members, name.l3interface))
-            vlan_dict["name"] = name.name
-            vlan_dict["tag"] = name.tag
-            vlan_dict["state"] = name.state
-            if name.members == None:
-                vlan_dict["members"] = []
-            else:
-                vlan_dict["members"] = name.members
-            if name.l3interface == None:
-                vlan_dict["l3interface"] = ""
-            else:
-                vlan_dict["l3interface"] = name.l3interface
-            vlan_found = True
-        if selected_vlan != 'all' and vlan_found:
-            return vlan_dict
-        elif selected_vlan == 'all':
-            vlan_ld.append(vlan_dict)
-    return vlan_ld
-
-# This function assumes capturing "show vlan extensive | display json" output
-# vlan_dict {'tag': '','name': '','members': [], 'l3-interface': ''}
-def extract_json_vlan_info(raw_dict, selected_vlan='all'):
-    vlan_ld = []
-    vlan_found = False
-    for l1 in raw_dict["l2ng-l2ald-vlan-instance-information"]:
-        for l2 in l1["l2ng-l2ald-vlan-instance-group"]:
-            vlan_dict = {}
-            if l2["l2ng-l2rtb-vlan-tag"]:
-                for vtag in l2["l2ng-l2rtb-vlan-tag"]:
-                    if selected_vlan == vtag["data"]:
-                        vlan_dict["tag"] = vtag["data"]
-                        #print("Found vlan {}".format(vtag["data"]))
-                        vlan_found = True
-                    elif selected_vlan == 'all':
-                        vlan_dict["tag"] = vtag["data"]
-                        vlan_found = True
-                if vlan_found:
-                    intf_list = []
-                    for vname in l2["l2ng-l2rtb-vlan-name"]:
-                        vlan_dict["name"] = vname["data"]
-                        break
-                    if "l2ng-l2rtb-vlan-member" in l2:
-                        for l3 in l2["l2ng-l2rtb-vlan-member"]:
-                            for vmember in l3["l2ng-l2rtb-vlan-member-interface"]:
-                                intf_list.append(vmember["data"])
-                                break
-                    vlan_dict["members"] = intf_list
-                    if "l2ng-l2rtb-vlan-l3-interface" in l2:
-                        for l3interface in l2["l2ng-l2rtb-vlan-l3-interface"]:
-                            vlan_dict["l3interface"] = l3interface["data"]
-                            break
-                    else:
-                        vlan_dict["l3interface"] = ""
-                if selected_vlan != 'all' and vlan_found:
-                    return vlan_dict
-                elif vlan_dict:
-                    vlan_ld.append(vlan_dict)
-                    vlan_found = False
-    return vlan_ld
-
-# Collects all VLANs from the provided VLAN output
-def collect_vlan_list_json(raw_dict):
-    vlan_list = []
-    for l1 in raw_dict["l2ng-l2ald-vlan-instance-information"]:
-        for l2 in l1["l2ng-l2ald-vlan-instance-group"]:
-            if l2["l2ng-l2rtb-vlan-tag"]:
-                for vtag in l2["l2ng-l2rtb-vlan-tag"]:
-                    if vtag["data"]:
-                        vlan_list.append(vtag["data"])
-                        break
-    return vlan_list
-
-def extract_span_info(stpbridge, selected_vlan='all'):
-    stp_ld = []
-    # print("\n******* STP BRIDGE INFO ******")
-    stp_found = False
-    for vlan_id in stpbridge:
-        stp_dict = {}
-        if selected_vlan == 'all' or vlan_id.vlan_id == selected_vlan:
-            stp_dict["vlan_id"] = vlan_id.vlan_id
-            stp_dict["vlan_rb_mac"] = vlan_id.root_bridge_mac
-            stp_dict["vlan_rb_prio"] = vlan_id.root_bridge_priority
-            stp_dict["vlan_local_mac"] = vlan_id.local_bridge_mac
-            stp_dict["vlan_local_prio"] = vlan_id.local_bridge_priority
-            stp_dict["vlan_root_port"] = vlan_id.root_port
-            stp_dict["vlan_root_cost"] = vlan_id.root_cost
-            stp_dict["topo_change_count"] = vlan_id.topo_change_count
-            stp_dict["time_since_last_tc"] = vlan_id.time_since_last_tc
-            stp_found = True
-        if selected_vlan != 'all' and stp_found:
-            return stp_dict
-        elif selected_vlan == 'all':
-            stp_ld.append(stp_dict)
-
-    return stp_ld
-
-def extract_json_stp_int(raw_dict, selected_vlan='all'):
-    stp_int_ld = []
-    match_vlan = False
-    if selected_vlan == 'all':
-        one_vlan = False
-    else:
-        one_vlan = True
-    for l1 in raw_dict["stp-interface-information"]:
-        # Loop over VLANs
-        for l2 in l1["stp-instance"]:
-            # Check if the "vlan-id" key exists
-            if "vlan-id" in l2.keys():
-                # Create dict for this vlan
-                for vlan_id in l2["vlan-id"]:
-                    #print("VLAN ID: {}".format(vlan_id["data"]))
-                    vlan_stp_dict = {}
-                    if one_vlan:
-                        if vlan_id["data"] == selected_vlan:
-                            vlan_stp_dict["vlan_id"] = vlan_id["data"]
-                            match_vlan = True
-                    else:
-                        vlan_stp_dict["vlan_id"] = vlan_id["data"]
-                        match_vlan = True
-                    # Check if the correct vlan was matched
-                    if match_vlan:
-                        # Loop over the interfaces for this specific VLAN
-                        for stp_ints in l2["stp-interfaces"]:
-                            vlan_stp_dict["interfaces"] = []
-                            for stp_int in stp_ints["stp-interface-entry"]:
-                                # Create a separate dict for each interface
-                                stp_intf_dict = {}
-                                for int_name in stp_int["interface-name"]:
-                                    stp_intf_dict["int_name"] = int_name["data"]
-                                    #print("Interface Name: {}".format(stp_intf_dict["int_name"]))
-                                    break
-                                for port_cost in stp_int["port-cost"]:
-                                    stp_intf_dict["port_cost"] = port_cost["data"]
-                                    break
-                                for port_state in stp_int["port-state"]:
-                                    stp_intf_dict["port_state"] = port_state["data"]
-                                    break
-                                for desg_bridge_mac in stp_int["designated-bridge-mac"]:
-                                    stp_intf_dict["desg_bridge_mac"] = desg_bridge_mac["data"]
-                                    break
-                                for desg_bridge_prio in stp_int["designated-bridge-priority"]:
-                                    stp_intf_dict["desg_bridge_prio"] = desg_bridge_prio["data"]
-                                    break
-                                for port_role in stp_int["port-role"]:
-                                    stp_intf_dict["port_role"] = port_role["data"]
-                                    break
-                                # Add interface to vlan interface list
-                                vlan_stp_dict["interfaces"].append(stp_intf_dict)
-                        # Append this to the larger LD or return the dictionary
-                        if selected_vlan != 'all' and one_vlan:
-                            return vlan_stp_dict
-                        elif vlan_stp_dict:
-                            stp_int_ld.append(vlan_stp_dict)
-                            match_vlan = False
-                    break
-            else:
-                pass
-                #print("Skipping RSTP instance...")
-    return stp_int_ld
-# This function assumes capturing "show spanning-tree bridge | display json" output
-# stp_dict {'vlan-id': '', 'vlan_rb_mac': '', 'vlan_rb_prio': '', 'vlan_local_mac': '', 'vlan_local_prio': '',
-#           'topology_change_count': '', 'time_since_last_tc': '', 'vlan_root_port': '', 'vlan_root_cost': ''}
-# Returns LD if selected_vlan is "all"
-# Returns Dict if selected_vlan is set
-def extract_json_stp_info(raw_dict, selected_vlan='all'):
-    stp_ld = []
-    match_vlan = False
-    if selected_vlan == 'all':
-        one_vlan = False
-    else:
-        one_vlan = True
-    for l1 in raw_dict["stp-bridge"]:
-        for l2 in l1["vst-bridge-parameters"]:
-            stp_dict = {}
-            for vlan_id in l2["vlan-id"]:
-                if one_vlan:
-                    if vlan_id["data"] == selected_vlan:
-                        stp_dict["vlan_id"] = vlan_id["data"]
-                        match_vlan = True
-                else:
-                    stp_dict["vlan_id"] = vlan_id["data"]
-                    match_vlan = True
-                if match_vlan:
-                    for rb_info in l2["root-bridge"]:
-                        for rb_mac in rb_info["bridge-mac"]:
-                            stp_dict["vlan_rb_mac"] = rb_mac["data"]
-                            break
-                        for rb_prio in rb_info["bridge-priority"]:
-                            stp_dict["vlan_rb_prio"] = rb_prio["data"]
-                            break
-                        break
-                    for local_info in l2["this-bridge"]:
-                        for local_mac in local_info["bridge-mac"]:
-                            stp_dict["vlan_local_mac"] = local_mac["data"]
-                            break
-                        for local_prio in local_info["bridge-priority"]:
-                            stp_dict["vlan_local_prio"] = local_prio["data"]
-                            break
-                        break
-                    for topo_change_count in l2["topology-change-count"]:
-                        stp_dict["topo_change_count"] = topo_change_count["data"]
-                        break
-                    # Check if the topology change number is 0, if it is TC doesn't exist
-                    if stp_dict["topo_change_count"] == "0":
-                        stp_dict["time_since_last_tc"] = "0"
-                    else:
-                        for time_since_last_tc in l2["time-since-last-tc"]:
-                            stp_dict["time_since_last_tc"] = time_since_last_tc["data"]
-                            break
-                    # Check if this device is the root bridge
-                    if stp_dict["vlan_rb_mac"] == stp_dict["vlan_local_mac"]:
-                        stp_dict["vlan_root_port"] = None
-                        stp_dict["vlan_root_cost"] = None
-                    # If this device is not root bridge
-                    else:
-                        for root_port in l2["root-port"]:
-                            stp_dict["vlan_root_port"] = root_port["data"]
-                            break
-                        for root_cost in l2["root-cost"]:
-                            stp_dict["vlan_root_cost"] = root_cost["data"]
-                            break
-                    # If a single vlan was provided return the stp_dict
-                    if one_vlan:
-                        #print("STP Dict")
-                        #print(stp_dict)
-                        return stp_dict
-                    # If 'all' was provided, add stp_dict to the list
-                    else:
-                        stp_ld.append(stp_dict)
-                    break
-    return stp_ld
-
-# Function to extract LLDP parameters from neighbors via Table/Views
-# lldp_ld [
-# lldp_dict {'local_int': '', 'remote_chassis_id': '', 'remote_sysname': ''}
-# ]
-def extract_lldp_info(lldpneigh, members='all'):
-    lldp_ld = []
-    # print("\n******* LLDP NEIGHBORS ******")
-    for li in lldpneigh:
-        # If the members are a list
-        if type(members) == list:
-            for item in members:
-                lldp_dict = {}
-                # This executes if the item matches and is an aggregate
-                if li.local_parent != "-" and li.local_parent == item.split(".")[0]:
-                    # print("{}: {}: {}".format(li.local_parent, li.remote_chassis_id,
-                    #                          li.remote_sysname))
-                    lldp_dict["local_int"] = li.local_parent
-                    lldp_dict["remote_chassis_id"] = li.remote_chassis_id
-                    lldp_dict["remote_sysname"] = li.remote_sysname
-                    lldp_ld.append(lldp_dict)
-                # If it is NOT an aggregate, check if it matches the item using local int
-                elif li.local_int == item.split(".")[0]:
-                    # print("{}: {}: {}".format(li.local_int, li.remote_chassis_id,
-                    #                          li.remote_sysname))
-                    lldp_dict["local_int"] = li.local_int
-                    lldp_dict["remote_chassis_id"] = li.remote_chassis_id
-                    lldp_dict["remote_sysname"] = li.remote_sysname
-                    lldp_ld.append(lldp_dict)
-        elif members == "all":
-            lldp_dict = {}
-            if li.local_parent != "-":
-                # print("{}: {}: {}".format(li.local_parent, li.remote_chassis_id,
-                #                         li.remote_sysname))
-                lldp_dict["local_int"] = li.local_parent
-                lldp_dict["remote_chassis_id"] = li.remote_chassis_id
-                lldp_dict["remote_sysname"] = li.remote_sysname
-                lldp_ld.append(lldp_dict)
-            else:
-                # print("{}: {}: {}".format(li.local_int, li.remote_chassis_id,
-                #                         li.remote_sysname))
-                lldp_dict["local_int"] = li.local_int
-                lldp_dict["remote_chassis_id"] = li.remote_chassis_id
-                lldp_dict["remote_sysname"] = li.remote_sysname
-                lldp_ld.append(lldp_dict)
-        # If the members is a string
-        else:
-            lldp_dict = {}
-            if li.local_parent != "-" and li.local_parent == members.split(".")[0]:
-                # print("{}: {}: {}".format(li.local_parent, li.remote_chassis_id,
-                #                         li.remote_sysname))
-                lldp_dict["local_int"] = li.local_parent
-                lldp_dict["remote_chassis_id"] = li.remote_chassis_id
-                lldp_dict["remote_sysname"] = li.remote_sysname
-                lldp_ld.append(lldp_dict)
-            elif li.local_int == members.split(".")[0]:
-                # print("{}: {}: {}".format(li.local_int, li.remote_chassis_id,
-                #                         li.remote_sysname))
-                lldp_dict["local_int"] = li.local_int
-                lldp_dict["remote_chassis_id"] = li.remote_chassis_id
-                lldp_dict["remote_sysname"] = li.remote_sysname
-                lldp_ld.append(lldp_dict)
-    # Return LLDP
-    # print("LLDP_LD")
-    # print(lldp_ld)
-    return lldp_ld
-
-# This function assumes capturing "show spanning-tree bridge | display json" output
-# lldp_ld [
-# lldp_dict {'local_int': '', 'remote_chassis_id': '', 'remote_sysname': ''}
-# ]
-def extract_json_lldp_info(raw_dict, members='all'):
-    lldp_ld = []
-    for l1 in raw_dict["lldp-neighbors-information"]:
-        for l2 in l1["lldp-neighbor-information"]:
-            # Reset the LLDP dictionary
-            parent_int = ""
-            local_int = ""
-            remote_chassis_id = ""
-            remote_sysname = ""
-            if "lldp-remote-system-name" in l2.keys():
-                for sysname in l2["lldp-remote-system-name"]:
-                    remote_sysname = sysname["data"]
-            for p_int in l2["lldp-local-parent-interface-name"]:
-                parent_int = p_int["data"]
-            for l_int in l2["lldp-local-port-id"]:
-                local_int = l_int["data"]
-            for rem_c_id in l2["lldp-remote-chassis-id"]:
-                remote_chassis_id = rem_c_id["data"]
-            member_match = False
-            # Loop over the members
-            if type(members) == list:
-                for member in members:
-                    lldp_dict = {}
-                    # print("Checking member: {}".format(member))
-                    if parent_int != "-" and parent_int == member.split(".")[0]:
-                        # print("Matched {}".format(local_port["data"]))
-                        lldp_dict["local_int"] = parent_int
-                        lldp_dict["remote_chassis_id"] = remote_chassis_id
-                        lldp_dict["remote_sysname"] = remote_sysname
-                        lldp_ld.append(lldp_dict)
-                        member_match = True
-                    elif local_int == member.split(".")[0]:
-                        lldp_dict["local_int"] = local_int
-                        lldp_dict["remote_chassis_id"] = remote_chassis_id
-                        lldp_dict["remote_sysname"] = remote_sysname
-                        lldp_ld.append(lldp_dict)
-                        member_match = True
-                    if member_match:
-                        break
-            elif members == 'all':
-                lldp_dict = {}
-                # print("Checking member: {}".format(member))
-                if parent_int != "-":
-                    # print("Matched {}".format(local_port["data"]))
-                    lldp_dict["local_int"] = parent_int
-                    lldp_dict["remote_chassis_id"] = remote_chassis_id
-                    lldp_dict["remote_sysname"] = remote_sysname
-                    lldp_ld.append(lldp_dict)
-                else:
-                    lldp_dict["local_int"] = local_int
-                    lldp_dict["remote_chassis_id"] = remote_chassis_id
-                    lldp_dict["remote_sysname"] = remote_sysname
-                    lldp_ld.append(lldp_dict)
-            elif members:
-                lldp_dict = {}
-                # print("Checking member: {}".format(member))
-                if parent_int != "-" and parent_int == members.split(".")[0]:
-                    # print("Matched {}".format(local_port["data"]))
-                    lldp_dict["local_int"] = parent_int
-                    lldp_dict["remote_chassis_id"] = remote_chassis_id
-                    lldp_dict["remote_sysname"] = remote_sysname
-                    lldp_ld.append(lldp_dict)
-                    member_match = True
-                elif local_int == members.split(".")[0]:
-                    lldp_dict["local_int"] = local_int
-                    lldp_dict["remote_chassis_id"] = remote_chassis_id
-                    lldp_dict["remote_sysname"] = remote_sysname
-                    lldp_ld.append(lldp_dict)
-                    member_match = True
-                if member_match:
-                    break
-    return lldp_ld
-
 # Function to extract non-lldp interface information from Table/Views
 # non_lldp_intf [
 # non_lldp_dict {'intf': '', 'active': ''}
@@ -643,103 +447,149 @@ def get_downstream_hosts(lldp_dict, root_port, stp_int_dict):
             downstream_list.append(i)
     return downstream_list
 
-def get_net_vlan_info(jdev, ip):
-    stdout.write("-> Pulling VLAN info from " + ip + " ... \n")
-    vlaninfo = VlanTable(jdev)
-    vlaninfo.get(extensive=True)
-    return vlaninfo
-
-def get_file_vlan_info(host):
-    vlan_json_file = os.path.join(selected_repo, (host + "_vlan-ext.json"))
-    raw_dict = json_to_dict(vlan_json_file)
-    return raw_dict
-
-def get_net_stp_info(jdev, ip):
-    stdout.write("-> Pulling Spanning-Tree info from " + ip + " ... \n")
-    stpbridge = STPBridgeTable(jdev)
-    stpbridge.get()
-    return stpbridge
-
-def get_file_stp_info(host):
-    stp_json_file = os.path.join(selected_repo, (host + "_stp.json"))
-    raw_dict = json_to_dict(stp_json_file)
-    return raw_dict
-
-def get_file_stp_int(host):
-    stp_int_json_file = os.path.join(selected_repo, (host + "_stp-int.json"))
-    raw_dict = json_to_dict(stp_int_json_file)
-    return raw_dict
-
-def get_net_lldp_info(jdev, ip):
-    stdout.write("-> Pulling LLDP info from " + ip + " ... \n")
-    lldpneigh = LLDPNeighborTable(jdev)
-    lldpneigh.get()
-    return lldpneigh
-
+@timed_phase()
 def get_net_ethersw_info(jdev, ip):
     stdout.write("-> Pulling Ethernet Switching Table info from " + ip + " ... \n")
     ethersw = ElsEthernetSwitchingTable(jdev)
-    ethersw.get()
+    timed_table_get(ethersw, ip, "ethernet_switching")
     return ethersw
 
-def get_file_lldp_info(host):
-    lldp_json_file = os.path.join(selected_repo, (host + "_lldp.json"))
-    raw_dict = json_to_dict(lldp_json_file)
-    return raw_dict
-
+@timed_phase()
 def get_net_facts(jdev, ip):
     facts_dict = {}
     stdout.write("-> Pulling basic facts from " + ip + " ... \n")
-    facts_dict["hostname"] = jdev.facts['hostname']
-    facts_dict["model"] = jdev.facts['model']
-    facts_dict["version"] = jdev.facts['version']
+    with device_timer(ip, "rpc", "facts"):
+        facts_dict["hostname"] = jdev.facts['hostname']
+        facts_dict["model"] = jdev.facts['model']
+        facts_dict["version"] = jdev.facts['version']
     return facts_dict
 
+@timed_phase()
 def get_net_interface(jdev, ip):
     stdout.write("-> Pulling basic interface info from " + ip + " ... \n")
     phyintf = PhyPortTable(jdev)
-    phyintf.get()
+    timed_table_get(phyintf, ip, "phy_port")
     return phyintf
 
+# Get the modification stamp of each of the host's JSON files (or the XML capture without a JSON one), None if the
+# file is missing
+def host_file_stamps(host, suffixes=host_file_suffixes):
+    stamps = {}
+    for key, suffix in suffixes.items():
+        stamps[key] = source_stamp(os.path.join(selected_repo, (host + suffix)))
+        if stamps[key] is None and key in xml_file_suffixes:
+            stamps[key] = source_stamp(os.path.join(selected_repo, (host + xml_file_suffixes[key])))
+    return stamps
+
+# True if the host's data will come from the in-memory or result cache, without reading its files
+def host_data_cached(host):
+    stamps = host_file_stamps(host)
+    if host in host_cache and host_cache[host]["stamps"] == stamps:
+        return True
+    cache = open_result_cache()
+    return bool(cache) and cache.contains(cache.key("host_data", [selected_repo, host, host_data_version], stamps))
+
+# Iterates over the hosts while their files are decompressed ahead, in parallel, if the repository is compressed or
+# archived (see repo_source.py). With skip_cached, the files of hosts whose data is cached aren't prefetched.
+# Hosts added to a hosts list while it is iterated are yielded too, without prefetch.
+def prefetched_hosts(hosts, suffixes=host_file_suffixes, skip_cached=True):
+    paths = []
+    for host in list(hosts):
+        if not skip_cached or not host_data_cached(host):
+            for key, suffix in suffixes.items():
+                paths.append(os.path.join(selected_repo, (host + suffix)))
+                if key in xml_file_suffixes:
+                    paths.append(os.path.join(selected_repo, (host + xml_file_suffixes[key])))
+    with prefetch_sources(paths):
+        for host in hosts:
+            yield host
+
+# Returns the model of a host collected from its files (see host_model.py) for all VLANs, plus the stamps of the files.
+# The files are only parsed again if their modification stamps changed since they were cached, in memory or in the
+# result cache.
+def load_host_data(host):
+    set_profile_host(host)
+    stamps = host_file_stamps(host)
+    if host in host_cache and host_cache[host]["stamps"] == stamps:
+        return host_cache[host]
+    cache = open_result_cache()
+    key = cache.key("host_data", [selected_repo, host, host_data_version], stamps) if cache else None
+    host_data = cache.get(key) if cache else None
+    if host_data is None:
+        try:
+            host_data = collect_host_model(FileCollector(selected_repo, host))
+        except (ValueError, OSError) as err:
+            # The collector may still be writing a file, keep the last good copy of the host
+            if host not in host_cache:
+                raise
+            print("-> Unable to parse files for {}, ERROR: {}".format(host, err))
+            return host_cache[host]
+        host_data["stamps"] = stamps
+        if cache:
+            cache.put(key, host_data)
+    host_cache[host] = host_data
+    return host_data
+
+# Opens the result cache on first use, None if it is disabled (--cache-mb 0)
+def open_result_cache():
+    global result_cache
+    if result_cache is None and result_cache_mb > 0:
+        result_cache = ResultCache(result_cache_dir, result_cache_mb << 20)
+    return result_cache
+
+# Returns the result of an analysis of the hosts' repository files. It comes from the result cache if the analysis was
+# run with the same parameters and none of the hosts' files changed since, otherwise it is computed and stored.
+@timed_phase()
+def cached_analysis(name, params, hosts, compute):
+    cache = open_result_cache()
+    if not cache:
+        return compute()
+    stamps = {}
+    for host in hosts:
+        stamps[host] = host_file_stamps(host)
+    key = cache.key(name, [selected_repo, params, host_data_version, analysis_version], stamps)
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    else:
+        print("-> Using cached {} results".format(name))
+    return result
+
+# Collects the model of a device of the device list over NETCONF, for all VLANs, the selected one or a list of VLANs.
+# The selected VLANs are filtered in the RPCs, see host_model.py.
+def net_host_model(host, selected_vlan='all'):
+    ip = dev_list[host]
+    try:
+        with device_session(ip) as jdev:
+            return collect_host_model(NetconfCollector(jdev, ip, stdout.write, net_vlan_names), selected_vlan)
+    except Exception as err:
+        print("Connection failed. ERROR: {}".format(err))
+        exit()
+
 def capture_chassis_info(selected_vlan, host, using_network):
+    set_profile_host(host)
     if host in dev_list.keys():
         ip = dev_list[host]
         chassis_dict = {"hostname": host, "ip": ip}
-        # For using network
+        # For using network, only the records of the selected VLAN are collected
         if using_network:
             print(starHeading(host, 5))
-            try:
-                with Device(host=ip, user=username, password=password) as jdev:
-                    # VLAN Info
-                    vlan_dict = extract_vlan_info(get_net_vlan_info(jdev, ip), selected_vlan)
-                    # STP Info (show spanning-tree bridge)
-                    stp_dict = extract_span_info(get_net_stp_info(jdev, ip), selected_vlan)
-                    # Check if vlan_dict and stp_dict are populated
-                    if vlan_dict:
-                        # LLDP Info (show lldp neighbors)
-                        lldp_dict = extract_lldp_info(get_net_lldp_info(jdev, ip), vlan_dict["members"])
-                    # If no vlan or stp information exists, provide an empty dict
-                    else:
-                        lldp_dict = {}
-            except Exception as err:
-                print("Connection failed. ERROR: {}".format(err))
-                exit()
+            host_model = net_host_model(host, selected_vlan)
+            vlan_dict, stp_dict, stp_int_dict, lldp_links = model_vlan_records(host_model, selected_vlan)
         # This will execute if we are using files for analysis
+        # Query the host's records of the VLAN from the repository store
+        elif use_store:
+            vlan_dict, stp_dict, stp_int_dict, lldp_links = host_vlan_records(repo_store, host, selected_vlan)
         else:
-            # Pull VLAN info from JSON file
-            vlan_dict = extract_json_vlan_info(get_file_vlan_info(host), selected_vlan)
-            # Pull STP info from JSON file
-            stp_dict = extract_json_stp_info(get_file_stp_info(host), selected_vlan)
-            # Pull STP Interface info from JSON file
-            stp_int_dict = extract_json_stp_int(get_file_stp_int(host), selected_vlan)
-            #print("STP INT DICT")
-            #print(stp_int_dict)
-
-            # Pull LLDP info from JSON file
-            if vlan_dict:
-                lldp_dict = extract_json_lldp_info(get_file_lldp_info(host), vlan_dict["members"])
-            else:
-                lldp_dict = {}
+            # Pull the host's files, re-parsed only if they changed since the last pass
+            host_model = load_host_data(host)
+            vlan_dict, stp_dict, stp_int_dict, lldp_links = model_vlan_records(host_model, selected_vlan)
+        # Pull the LLDP neighbors on the members of the VLAN
+        if vlan_dict:
+            lldp_dict = lldp_neighbors(lldp_links, vlan_dict["members"])
+        else:
+            lldp_dict = {}
 
         # Computed variables
         chassis_dict["vlan"] = vlan_dict
@@ -749,7 +599,7 @@ def capture_chassis_info(selected_vlan, host, using_network):
         # Check if vlan dict exists
         if vlan_dict:
             # Check if the mac of the RB and local mac is the same, to check if this is the RB
-            if stp_dict["vlan_rb_mac"] == stp_dict["vlan_local_mac"]:
+            if stp_dict.is_root():
                 chassis_dict["root_bridge"] = True
             else:
                 chassis_dict["root_bridge"] = False
@@ -761,6 +611,7 @@ def capture_chassis_info(selected_vlan, host, using_network):
     # Go here if the host is not in the device list (ie. Cisco)
     else:
         chassis_dict = {"hostname": host}
+    set_profile_host("")
 
     return chassis_dict
 
@@ -792,11 +643,14 @@ def create_stp_stats():
             host_content = [adj_name, "-", "-", "-"]
             myTable.add_row(host_content)
     # Print this to the screen
-    print(myTable)
+    with timed_span("table_render"):
+        table_str = str(myTable)
+    print(table_str)
 
     # Write it to a table
-    with open(stp_stats, 'w') as w:
-        w.write(str(myTable))
+    with timed_span("disk_write"):
+        with open(stp_stats, 'w') as w:
+            w.write(table_str)
 
 def create_chart():
     key = "upstream_peer"
@@ -868,60 +722,78 @@ def create_chart():
             host_content = [adj_name, "-", "-", "-", "-", "-", "-", "-"]
             myTable.add_row(host_content)
     # Print it to the screen
-    print(myTable)
+    with timed_span("table_render"):
+        table_str = str(myTable)
+    print(table_str)
 
     # Write it to a table
-    with open(stp_chart, 'w') as w:
-        w.write(str(myTable))
+    with timed_span("disk_write"):
+        with open(stp_chart, 'w') as w:
+            w.write(table_str)
 
 def stp_map_files():
     print("*" * 50 + "\n" + " " * 10 + "STP MAP using JSON Files\n" + "*" * 50)
-    # Provide selection for sending a single command or multiple commands from a file
-    hosts_list = []
-    # Capture the available devices
-    for a_host in dev_list.keys():
-        hosts_list.append(a_host)
-
     # Collect all the vlans via json files, using repo location
-    vlan_host_ld = collect_all_vlans_json(selected_repo)
+    vlan_host_ld = index_vlan_hosts(repository_index())
     #print("VLAN HOST LD")
     #print(vlan_host_ld)
 
-    # Select a VLAN from the host list then sort this list numerically
+    # Ask for a vlan to analyze
+    selected_vlan = getOptionAnswer("Select a VLAN to analyze", numeric_vlan_list(vlan_host_ld))
+
+    # Process to capture information from hosts
+    if selected_vlan:
+        stp_map_vlan(selected_vlan, hosts_for_vlan(vlan_host_ld, selected_vlan), using_network=False)
+    else:
+        exit()
+
+# Select the numeric VLANs from the VLAN/host list and sort them numerically
+def numeric_vlan_list(vlan_host_ld):
     vlan_list = []
     for vlan in vlan_host_ld:
         if vlan["vlan"].isnumeric():
             vlan_list.append(vlan["vlan"])
     # Sort the valid vlans
     vlan_list.sort(key=int)
+    return vlan_list
 
-    # Ask for a vlan to analyze
-    selected_vlan = getOptionAnswer("Select a VLAN to analyze", vlan_list)
-
-    # Get host list based on vlan selected
+# Get host list based on vlan selected
+def hosts_for_vlan(vlan_host_ld, selected_vlan):
     host_list = []
     for my_vlan in vlan_host_ld:
         if my_vlan["vlan"] == selected_vlan:
             host_list = my_vlan["hosts"]
+    return host_list
 
-    # Process to capture information from hosts
-    if selected_vlan:
-        scan_loop(selected_vlan, host_list, using_network=False)
-        # print("ALL CHASSIS")
-        # print(all_chassis)
-        # Print the table
-        print("***********************")
-        print("* Spanning Tree Chart *")
-        print("***********************")
-        create_chart()
-        print("***********************")
-        print("* Spanning Tree Stats *")
-        print("***********************")
-        create_stp_stats()
-        # create_stp_paths()
+# Capture the spanning tree of one VLAN and print the chart and stats tables
+def stp_map_vlan(selected_vlan, host_list, using_network):
+    if using_network:
+        scan_loop(selected_vlan, host_list, using_network)
     else:
-        exit()
-
+        # The chassis of a VLAN are reused until a file of one of its hosts changes
+        def vlan_scan():
+            if use_store:
+                ingest_repository()
+            scan_loop(selected_vlan, list(host_list), using_network)
+            return dict(all_chassis)
+        scanned = cached_analysis("vlan_chart", {"vlan": selected_vlan, "hosts": list(host_list)}, host_list,
+                                  vlan_scan)
+        all_chassis.clear()
+        all_chassis.update(scanned)
+    # print("ALL CHASSIS")
+    # print(all_chassis)
+    # Print the table
+    print("***********************")
+    print("* Spanning Tree Chart *")
+    print("***********************")
+    create_chart()
+    print("***********************")
+    print("* Spanning Tree Stats *")
+    print("***********************")
+    create_stp_stats()
+    # create_stp_paths()
+
+@timed_phase()
 def scan_loop(selected_vlan, hosts, using_network):
     # Loop over hosts list
     root_bridge_found = False
@@ -929,10 +801,15 @@ def scan_loop(selected_vlan, hosts, using_network):
 
     # Provide dictionary for determining backup root bridge
     backup_rb = {'name': 'None', 'priority': 62000}
+    history = open_history(history_db)
 
-    # Loop over hosts
-    for host in hosts:
+    # Loop over hosts, hosts re-added to the list below are scanned again
+    for host in hosts if using_network or use_store else prefetched_hosts(hosts):
         chassis_dict = capture_chassis_info(selected_vlan, host, using_network)
+        # Add the STP counters of this VLAN to the history
+        if chassis_dict.get("stp"):
+            record_stp_samples(history, host, [chassis_dict["stp"]], stp_sample_time(host, using_network),
+                               "net" if using_network else "file")
 
         # Check if this device is the root bridge
         if chassis_dict["vlan"]:
@@ -1016,46 +893,129 @@ def scan_loop(selected_vlan, hosts, using_network):
             my_dict["name"] = host
             my_dict["no_vlan"] = True
             all_chassis["chassis"].append(my_dict)
+    history.close()
+
+# Time the STP data of a host was captured, the STP file modification time when using files
+def stp_sample_time(host, using_network):
+    if using_network:
+        return time.time()
+    collector = FileCollector(selected_repo, host)
+    stp_file = collector.xml_file("stp") or collector.json.path("stp")
+    return source_mtime(stp_file)
 
 def combine_ether_vlan_data(ether_dict, vlan_ld, phy_ld):
-    # Find first two vlan / interface combinations
-    #print("Ether Dict Original")
-    #pprint(ether_dict)
-    #print("Vlan LD Original")
-    #pprint(vlan_ld)
+    # Index the interfaces by name, and the MACs by (interface, VLAN), so each VLAN interface is a lookup
+    ether_index = {}
+    mac_index = {}
+    for ether_intf in ether_dict["interfaces"]:
+        ether_index[ether_intf["name"]] = ether_intf
+        for ether_mac in ether_intf["macs"]:
+            mac_index.setdefault((ether_intf["name"], ether_mac["vlan_id"]), []).append(ether_mac)
+    # Physical interfaces by name, the last record of a name wins
+    phy_index = {}
+    for phy_int in phy_ld:
+        phy_index[phy_int["name"]] = phy_int
 
     # Loop over the vlan records
     for vlan_rec in vlan_ld:
-        vrec = {}
-        vrec["vlan_tag"] = vlan_rec["vlan_tag"]
         # Collect the necessary information to update the ether records
         for vlan_intf in vlan_rec["interfaces"]:
-            #print("Working on Intf: {} Vlan: {}".format(vlan_intf["name"], vlan_rec["vlan_tag"]))
-            vrec["vlan_intf"] = vlan_intf["name"]
-            vrec["tagged"] = vlan_intf["tagness"]
-            vrec["mode"] = vlan_intf["mode"]
-            vrec["active"] = vlan_intf["active"]
-            # Loop over the ether records and update if interface/vlan matches
-            for ether_intf in ether_dict["interfaces"]:
-                if ether_intf["name"] == vrec["vlan_intf"]:
-                    #print("Ether Intf...{}".format(ether_intf["name"]))
-                    # Extract Interface Specific Info
-                    for phy_int in phy_ld:
-                        # Match the interfaces, need to remove last two characters to match physical interface
-                        if phy_int["name"] == ether_intf["name"][:-2]:
-                            #print("Matched phy name...{}".format(ether_intf["name"]))
-                            ether_intf["oper_status"] = phy_int["oper_status"]
-                            ether_intf["admin_status"] = phy_int["admin_status"]
-                            ether_intf["speed"] = phy_int["speed"]
-                    # Add macs to the interface
-                    for ether_mac in ether_intf["macs"]:
-                        if ether_mac["vlan_id"] == vrec["vlan_tag"]:
-                            #print("Updating records for Intf: {} Vlan: {}".format(vrec["vlan_intf"], vrec["vlan_tag"]))
-                            ether_mac["tagged"] = vrec["tagged"]
-                            ether_mac["mode"] = vrec["mode"]
-                            ether_mac["active"] = vrec["active"]
+            ether_intf = ether_index.get(vlan_intf["name"])
+            if ether_intf is None:
+                continue
+            # Extract Interface Specific Info, need to remove last two characters to match physical interface
+            phy_int = phy_index.get(ether_intf["name"][:-2])
+            if phy_int is not None:
+                ether_intf["oper_status"] = phy_int["oper_status"]
+                ether_intf["admin_status"] = phy_int["admin_status"]
+                ether_intf["speed"] = phy_int["speed"]
+                ether_intf["duplex"] = phy_int.get("duplex")
+            # Add the VLAN interface info to the macs learned on this interface and VLAN
+            for ether_mac in mac_index.get((vlan_intf["name"], vlan_rec["vlan_tag"]), ()):
+                ether_mac["tagged"] = vlan_intf["tagness"]
+                ether_mac["mode"] = vlan_intf["mode"]
+                ether_mac["active"] = vlan_intf["active"]
     return ether_dict
 
+# Returns the "data" of the first entry of a key in a JSON capture, default if the key is missing
+def json_first(node, key, default=None):
+    for entry in node.get(key, []):
+        return entry.get("data", default)
+    return default
+
+# Function to extract the MAC table entries via Table/Views
+# ether_rows [
+# ether_row {'interface': '', 'mac': '', 'vlan_id': ''}
+# ]
+def extract_ether_info(etherswinfo):
+    ether_rows = []
+    for info in etherswinfo:
+        ether_row = {}
+        ether_row["interface"] = info.logical_interface
+        ether_row["mac"] = info.mac_address
+        ether_row["vlan_id"] = info.vlan_id
+        ether_rows.append(ether_row)
+    return ether_rows
+
+# This function assumes capturing "show ethernet-switching table detail | display json" output. The summary output,
+# with the entries grouped under each VLAN, also works.
+# ether_rows [
+# ether_row {'interface': '', 'mac': '', 'vlan_id': ''}
+# ]
+@timed_phase()
+def extract_json_ether_info(raw_dict):
+    ether_rows = []
+    for l1 in raw_dict.get("l2ng-l2ald-rtb-macdb", []):
+        for l2 in l1.get("l2ng-l2ald-mac-entry-vlan", []):
+            vlan_id = json_first(l2, "l2ng-l2-vlan-id")
+            for l3 in l2.get("l2ng-mac-entry", [l2]):
+                if "l2ng-l2-mac-address" not in l3:
+                    continue
+                ether_row = {}
+                ether_row["interface"] = json_first(l3, "l2ng-l2-mac-logical-interface")
+                ether_row["mac"] = json_first(l3, "l2ng-l2-mac-address")
+                ether_row["vlan_id"] = json_first(l3, "l2ng-l2-vlan-id", vlan_id)
+                ether_rows.append(ether_row)
+    return ether_rows
+
+# Function to extract the physical interface status via Table/Views
+# phy_ld [
+# phy_dict {'name': '', 'oper_status': '', 'admin_status': '', 'speed': '', 'duplex': ''}
+# ]
+def extract_phy_info(phyinfo):
+    phy_ld = []
+    for info in phyinfo:
+        phy_dict = {}
+        phy_dict["name"] = info.name
+        phy_dict["oper_status"] = info.oper
+        phy_dict["admin_status"] = info.admin
+        phy_dict["speed"] = info.speed
+        phy_dict["duplex"] = info.link_mode
+        phy_ld.append(phy_dict)
+    return phy_ld
+
+# This function assumes capturing "show interfaces | display json" output, "show interfaces terse" works too, but
+# doesn't include the speed. Only the Ethernet interfaces are kept, like PhyPortTable does.
+# phy_ld [
+# phy_dict {'name': '', 'oper_status': '', 'admin_status': '', 'speed': '', 'duplex': ''}
+# ]
+@timed_phase()
+def extract_json_phy_info(raw_dict):
+    phy_ld = []
+    for l1 in raw_dict.get("interface-information", []):
+        for l2 in l1.get("physical-interface", []):
+            name = json_first(l2, "name", "").strip()
+            if not re.match(r"[efgx][et]-", name):
+                continue
+            phy_dict = {}
+            phy_dict["name"] = name
+            phy_dict["oper_status"] = json_first(l2, "oper-status", "").strip()
+            phy_dict["admin_status"] = json_first(l2, "admin-status", "").strip()
+            phy_dict["speed"] = json_first(l2, "speed")
+            phy_dict["duplex"] = json_first(l2, "link-mode")
+            phy_ld.append(phy_dict)
+    return phy_ld
+
 # Ether_LD Format
 #ether_dict = { "interfaces": [
 #    { "name": "ge-0/0/0.0",
@@ -1069,22 +1029,25 @@ def combine_ether_vlan_data(ether_dict, vlan_ld, phy_ld):
 #          {}
 #        ],
 #    }
-#]
+#],
+#  "mac_table": MacTable (the same entries with the MACs as integers)
 #}
-def ether_switch_intf_data(raw_ether_data):
+# ether_rows is the output of extract_ether_info or extract_json_ether_info
+def ether_switch_intf_data(ether_rows):
     ether_dict = {}
     ether_dict["interfaces"] = []
     temp_ld = []
 
-    print("Performing Data Formatting...")
-    # Extract all info into a list of dictionaries
-    for info in raw_ether_data:
-        ether_row = {}
-        ether_row["interface"] = info.logical_interface
-        ether_row["mac"] = info.mac_address
-        ether_row["vlan_id"] = info.vlan_id
+    # MACs are parsed once into the MAC table, the records share the normalized MAC strings
+    mac_table = MacTable()
+    ether_dict["mac_table"] = mac_table
+    for ether_row in ether_rows:
+        if mac_table.add(ether_row["mac"], ether_row["vlan_id"], ether_row["interface"]):
+            ether_row["mac"] = int_to_mac(mac_table.macs[-1])
         temp_ld.append(ether_row)
 
+    # Interface dicts by name, in the order the interfaces are first seen
+    intf_index = {}
     # Loop over the record list
     for temp_rec in temp_ld:
         # Create new mac record
@@ -1094,44 +1057,17 @@ def ether_switch_intf_data(raw_ether_data):
         new_mac["tagged"] = None
         new_mac["mode"] = None
         new_mac["active"] = False
-        # If there are records currently in this LD
-        if ether_dict["interfaces"]:
-            intf_matched = False
-            # Loop over the interfaces to try to find a match
-            for ether_int_rec in ether_dict["interfaces"]:
-                # If the interfaces match, create and add a record to the
-                if ether_int_rec["name"] == temp_rec["interface"]:
-                    intf_matched = True
-                    # If "macs" key exists, create and add a dict to the list
-                    if "macs" in ether_int_rec.keys():
-                        ether_int_rec["macs"].append(new_mac)
-                    # If "macs" key doesn't exist,
-                    else:
-                        pass
-                        #print("The macs key doesn't exist")
-            # If the interface from temp does not match any existing interfaces, create a new interface dict
-            if not intf_matched:
-                # Create the new interface dict
-                new_intf = {}
-                new_intf["name"] = temp_rec["interface"]
-                new_intf["macs"] = []
-                # Add the new mac dict to the interface
-                new_intf["macs"].append(new_mac)
-                # Add the interface dict to the larger dict
-                ether_dict["interfaces"].append(new_intf)
-            else:
-                pass
-                #print("The new mac was added.")
-        # If there aren't any interfaces added to ether dict
-        else:
-            # Create a new interface dict
-            new_intf = {}
-            new_intf["name"] = temp_rec["interface"]
-            new_intf["macs"] = []
-            # Add the new mac dict to the interface
-            new_intf["macs"].append(new_mac)
+        ether_int_rec = intf_index.get(temp_rec["interface"])
+        # If the interface doesn't have a record yet, create a new interface dict
+        if ether_int_rec is None:
+            ether_int_rec = {}
+            ether_int_rec["name"] = temp_rec["interface"]
+            ether_int_rec["macs"] = []
+            intf_index[temp_rec["interface"]] = ether_int_rec
             # Add the interface dict to the larger dict
-            ether_dict["interfaces"].append(new_intf)
+            ether_dict["interfaces"].append(ether_int_rec)
+        # Add the new mac dict to the interface
+        ether_int_rec["macs"].append(new_mac)
     return ether_dict
 
 #vlan_ld = [ { "vlan_name": "vlan-100",
@@ -1145,20 +1081,17 @@ def ether_switch_intf_data(raw_ether_data):
 #                }
 #            ]
 #        } ]
-def vlan_intf_data(raw_vlan_data):
+# Returns the tagness or mode of the member at an index, None if the capture doesn't include it
+def member_value(values, index):
+    if type(values) == list:
+        if index < len(values):
+            return values[index]
+        return None
+    return values
+
+# temp_ld is the output of extract_vlan_intf_info
+def vlan_intf_data(temp_ld):
     vlan_ld = []
-    temp_ld = []
-
-    # Extract info from raw data structure
-    for info in raw_vlan_data:
-        vlan_dict = {}
-        vlan_dict["name"] = info.name
-        vlan_dict["tag"] = info.tag
-        vlan_dict["state"] = info.state
-        vlan_dict["interfaces"] = info.members
-        vlan_dict["tagness"] = info.tagness
-        vlan_dict["modes"] = info.mode
-        temp_ld.append(vlan_dict)
 
     # Loop over records
     for temp_rec in temp_ld:
@@ -1186,11 +1119,11 @@ def vlan_intf_data(raw_vlan_data):
                     temp_dict["name"] = temp_rec["interfaces"][list_num][:len(temp_rec["interfaces"][list_num])-1]
                 else:
                     temp_dict["name"] = temp_rec["interfaces"][list_num]
-                if temp_rec["tagness"][list_num] == "tagged":
+                if member_value(temp_rec["tagness"], list_num) == "tagged":
                     temp_dict["tagness"] = True
                 else:
                     temp_dict["tagness"] = False
-                temp_dict["mode"] = temp_rec["modes"][list_num]
+                temp_dict["mode"] = member_value(temp_rec["modes"], list_num)
                 list_num += 1
                 vlan_dict["interfaces"].append(temp_dict)
         # If interfaces is a string...
@@ -1225,136 +1158,193 @@ def vlan_intf_data(raw_vlan_data):
 #                      "tagged" : None,
 #                      "mode": None }
 #                ]
+# Builds the chassis record of the MAC scan from the extracted MAC table, VLAN, interface and LLDP data
+def build_ether_chassis(hostname, model, ether_rows, vlan_rows, phy_ld, lldp_ld):
+    temp_chassis = {}
+    temp_chassis["chassis"] = hostname
+    temp_chassis["model"] = model
+    ether_dict = ether_switch_intf_data(ether_rows)
+    vlan_ld = vlan_intf_data(vlan_rows)
+    temp_chassis["uplinks"] = uplink_ports(lldp_ld, vlan_ld)
+    parsed_results = combine_ether_vlan_data(ether_dict, vlan_ld, phy_ld)
+    temp_chassis["interfaces"] = parsed_results["interfaces"]
+    temp_chassis["mac_table"] = parsed_results["mac_table"]
+    return temp_chassis
+
+# Collects the MAC scan data of one device
+# result {'host': '', 'ok': True, 'error': '', 'chassis': {}}
+def collect_ether_chassis(host, ip):
+    result = {"host": host, "ok": True, "error": "", "chassis": {}}
+    # Runs in a worker thread, the profile host is kept per thread
+    set_profile_host(host)
+    try:
+        with device_session(ip) as jdev:
+            chassis_facts = get_net_facts(jdev, ip)
+            phyinfo = get_net_interface(jdev, ip)
+            with device_timer(ip, "parse", "phy_port"):
+                phy_ld = extract_phy_info(phyinfo)
+            etherswinfo = get_net_ethersw_info(jdev, ip)
+            with device_timer(ip, "parse", "ethernet_switching"):
+                ether_rows = extract_ether_info(etherswinfo)
+            collector = NetconfCollector(jdev, ip, stdout.write)
+            vlan_rows = collector.extract("vlan-intf")
+            # LLDP Info Collection, to tell the uplinks from the access edge ports
+            lldp_ld = lldp_neighbors(collector.extract("lldp"))
+        result["chassis"] = build_ether_chassis(chassis_facts["hostname"], chassis_facts["model"], ether_rows,
+                                                vlan_rows, phy_ld, lldp_ld)
+    except Exception as err:
+        result["ok"] = False
+        result["error"] = "{}: {}".format(type(err).__name__, err)
+    return result
+
+#all_chassis = [ { "chassis": "EX1",
+#                "model": "EX4300-48T",
+#                "interfaces": [ (see combine_ether_vlan_data) ],
+#                "mac_table": MacTable,
+#                "uplinks": {"ge-0/0/0", "ae0"}
+#              } ]
+# Scans every device of the device list, "mac_scan_workers" devices at a time
 def ether_switch_net():
     print("*" * 50 + "\n" + " " * 10 + "Ether Switching using Network\n" + "*" * 50)
-    # Provide selection for sending a single command or multiple commands from a file
     all_chassis = []
+    reset_device_metrics()
+
+    if dev_list:
+        print("-> Scanning {} devices with {} workers ...".format(len(dev_list), mac_scan_workers))
+        with ThreadPoolExecutor(max_workers=mac_scan_workers) as executor:
+            results = list(executor.map(lambda item: collect_ether_chassis(item[0], item[1]), dev_list.items()))
+        for result in results:
+            if result["ok"]:
+                all_chassis.append(result["chassis"])
+            else:
+                print("!! Unable to scan {}: {}".format(result["host"], result["error"]))
+        mac_index = report_ether_switching(all_chassis)
+        print_device_report(device_metrics_file, dev_ip_names())
+        locate_macs(mac_index)
+    else:
+        print("\n!! MAC scan aborted... No devices defined !!!\n")
+
+# Scans the ethernet switching, VLAN, interface and LLDP captures of each host in the selected repository
+def ether_switch_files():
+    print("*" * 50 + "\n" + " " * 10 + "Ether Switching using Files\n" + "*" * 50)
+    if use_store:
+        ether_switch_store()
+        return
+    all_chassis = []
+    for host in prefetched_hosts(dev_list.keys(), ether_file_suffixes, skip_cached=False):
+        ether_json_file = os.path.join(selected_repo, (host + "_ether-sw.json"))
+        intf_json_file = os.path.join(selected_repo, (host + "_int.json"))
+        if not source_exists(ether_json_file) or not source_exists(intf_json_file):
+            print("!! Skipping {}: missing {} or {}".format(host, os.path.basename(ether_json_file),
+                                                           os.path.basename(intf_json_file)))
+            continue
+        set_profile_host(host)
+        ether_rows = extract_json_ether_info(json_to_dict(ether_json_file))
+        vlan_rows = extract_host_file(host, "vlan-intf")
+        phy_ld = extract_json_phy_info(json_to_dict(intf_json_file))
+        lldp_ld = lldp_neighbors(extract_host_file(host, "lldp"))
+        all_chassis.append(build_ether_chassis(host, "", ether_rows, vlan_rows, phy_ld, lldp_ld))
+    set_profile_host("")
+    mac_index = report_ether_switching(all_chassis)
+    locate_macs(mac_index)
+
+# MAC scan of the repository store, the MAC flaps and lookups are queries on its macs table
+# The suspect interface rules need the interface data of the in-memory scan, run without --store for them
+def ether_switch_store():
+    conn = ingest_repository()
+    print("-> Suspect interface rules are skipped when using the repository store")
+    mac_index = StoreMacIndex(conn)
+    print_mac_flaps(mac_index)
+    locate_macs(mac_index)
+
+# Print the suspect interfaces and MAC flaps of the scanned chassis, returns the MAC location index
+def report_ether_switching(all_chassis):
+    results_ld = get_suspect_interfaces(all_chassis)
+    print_suspect_interfaces(results_ld)
+    export_results("mac_scan_chassis", chassis_export_rows(all_chassis), chassis_export_keys)
+    export_results("mac_scan_suspects", results_ld, suspect_export_keys)
+    mac_index = build_mac_index(all_chassis)
+    print_mac_flaps(mac_index)
+    return mac_index
+
+# Physical ports facing other switches: LLDP neighbor ports and trunk members of any VLAN (ie. ge-0/0/0, ae0)
+def uplink_ports(lldp_ld, vlan_ld):
+    uplinks = set()
+    for lldp_dict in lldp_ld:
+        uplinks.add(lldp_dict["local_int"].split(".")[0])
+    for vlan_dict in vlan_ld:
+        for intf in vlan_dict["interfaces"]:
+            if intf["mode"] == "trunk":
+                uplinks.add(intf["name"].split(".")[0])
+    return uplinks
+
+# Build the repository-wide MAC location index from the MAC tables of all chassis
+@timed_phase()
+def build_mac_index(all_chassis):
+    mac_index = MacLocationIndex()
+    for chassis in all_chassis:
+        mac_index.add_table(chassis["chassis"], chassis["mac_table"], chassis.get("uplinks", set()))
+    return mac_index.sort()
+
+# Print the MACs learned on more than one access edge port, in the same VLAN
+def print_mac_flaps(mac_index):
+    myTable = PrettyTable(["Host Mac", "Vlan", "Chassis", "Interface"])
+    flap_count = 0
+    for mac, vlan, edge_ports in mac_index.flaps():
+        flap_count += 1
+        for chassis, interface in edge_ports:
+            myTable.add_row([int_to_mac(mac), vlan, chassis, interface])
+
+    stats = mac_index.stats()
+    print("MAC Index: {} entries ({} on edge ports), {} MAC/VLAN pairs on {} chassis".format(
+        stats["entries"], stats["edge_entries"], stats["mac_vlans"], stats["chassis"]))
+    if not flap_count:
+        print("No MACs found on more than one edge port")
+        return
+    print("MACs found on more than one edge port: {}".format(flap_count))
+    with timed_span("table_render"):
+        table_str = str(myTable)
+    print(table_str)
 
-    #my_ips = chooseDevices(iplist_dir)
-    my_ips = ['132.32.254.2', '132.32.255.1']
-    if my_ips:
-        # Loop over commands and devices
-        for ip in my_ips:
-            stdout.write("-> Connecting to " + ip + " ... ")
-            jdev = connect(ip)
-            # Chassis Facts
-            chassis_facts = get_net_facts(jdev, ip)
-            #print("Hostname: {} Model: {}".format(chassis_facts["hostname"], chassis_facts["model"]))
-            temp_chassis = {}
-            temp_chassis["chassis"] = chassis_facts["hostname"]
-            temp_chassis["model"] = chassis_facts["model"]
-            temp_chassis["interfaces"] = []
-
-            # Interface Information
-            phyinfo = get_net_interface(jdev, ip)
-            phy_ld = []
-            for info in phyinfo:
-                phy_dict = {}
-                #print("Interface Name: {} Oper Status: {} Admin Status: {} Speed: {}".format(info.name, info.oper, info.admin, info.speed))
-                phy_dict["name"] = info.name
-                phy_dict["oper_status"] = info.oper
-                phy_dict["admin_status"] = info.admin
-                phy_dict["speed"] = info.speed
-                phy_ld.append(phy_dict)
-
-            # Ethernet Switching Info Collection
-            etherswinfo = get_net_ethersw_info(jdev, ip)
-            #for info in etherswinfo:
-            #    print("Logical Interface: {} MAC: {} VLAN: {}".format(info.logical_interface, info.mac_address, info.vlan_id))
-            #print("Ether Switching Data")
-            ether_dict = ether_switch_intf_data(etherswinfo)
-
-            # Vlan Info Collection
-            vlanextinfo = get_net_vlan_info(jdev, ip)
-            #for info in vlanextinfo:
-            #    print("Vlan Name(Tag): {}({}) State: {} Member: {} Tagness: {} Mode: {}".format(info.name, info.tag, info.state, info.members, info.tagness, info.mode))
-            #print("VLAN INTF Data")
-            vlan_ld = vlan_intf_data(vlanextinfo)
-
-            # Combine Data
-            parsed_results = combine_ether_vlan_data(ether_dict, vlan_ld, phy_ld)
-            #print("Parsed Results")
-            #pprint(parsed_results)
-
-            # Add data to chassis data structure
-            for intf in parsed_results["interfaces"]:
-                temp_chassis["interfaces"].append(intf)
-
-            # Add to all chassis structure
-            all_chassis.append(temp_chassis)
-        #print("All chassis")
-        #pprint(all_chassis)
-
-        # Print the results to the CLI
-        print_suspect_interfaces(get_suspect_interfaces(all_chassis))
-
-# - Extract the problems
+    # Write it to a text table
+    with timed_span("disk_write"):
+        with open(mac_flap_file, 'w') as w:
+            w.write(table_str)
+
+# Look up where MACs are learned, in any MAC format
+def locate_macs(mac_index):
+    while getYNAnswer("Locate MAC addresses") == 'y':
+        for mac in getMultiInputAnswer("Enter a MAC (blank to finish)"):
+            if mac_to_int(mac) is None:
+                print("{} is not a MAC address".format(mac))
+                continue
+            locations = mac_index.locate(mac)
+            if not locations:
+                print("{} was not found".format(mac))
+                continue
+            myTable = PrettyTable(["Host Mac", "Vlan", "Chassis", "Interface", "Port"])
+            for location in locations:
+                myTable.add_row([int_to_mac(location["mac"]), location["vlan"], location["chassis"],
+                                 location["interface"], "Edge" if location["edge"] else "Uplink"])
+            print(myTable)
+
+# - Extract the problems, using the rules of suspect_rules.py (or suspect_rules.json if it exists)
 #   - interfaces that have two mac addresses on the same vlan
 #   - interfaces that are running at a speed less than 1G
+#   - half duplex, admin up/oper down with MACs, trunks with a single MAC
+@timed_phase()
 def get_suspect_interfaces(all_chassis):
-    results_ld = []
-
+    rules = load_rules(suspect_rules_file)
+    intf_table = InterfaceTable()
     for chassis in all_chassis:
-        # Loop over the interfaces in the chassis
-        for intf in chassis["interfaces"]:
-            found_speed_discrep = False
-            found_mac_discrep = False
-            # Check if the interface is up/up
-            if intf["admin_status"] == "up" and \
-                    intf["oper_status"] == "up" and \
-                    len(intf["macs"]) > 1:
-                access_num = 0
-                vlan_id = {}
-                vlan_matched = "0"
-                # Loop over macs
-                for one_mac in intf["macs"]:
-                    if one_mac["mode"] == "access":
-                        access_num += 1
-                        if one_mac["vlan_id"] in vlan_id.keys():
-                            vlan_id[one_mac["vlan_id"]] += 1
-                        else:
-                            vlan_id[one_mac["vlan_id"]] = 1
-                for key in vlan_id:
-                    if vlan_id[key] > 1:
-                        #print("Found {} MACs in VLAN ID: {}".format(vlan_id[key], key))
-                        found_mac_discrep = True
-                        vlan_matched = key
-                if intf["speed"] == "100mbps" or intf["speed"] == "10mbps":
-                    #print("Found interface speed at {}".format(intf["speed"]))
-                    found_speed_discrep = True
-                if found_mac_discrep:
-                    for one_mac in intf["macs"]:
-                        if one_mac["vlan_id"] == vlan_matched:
-                            #print("One Mac: {}".format(one_mac["mac"]))
-                            captured_macs = {}
-                            captured_macs["chassis"] = chassis["chassis"]
-                            captured_macs["interface"] = intf["name"]
-                            captured_macs["speed"] = intf["speed"]
-                            captured_macs["admin-oper"] = intf["admin_status"] + "|" + intf["oper_status"]
-                            captured_macs["vlan_id"] = one_mac["vlan_id"]
-                            captured_macs["mac"] = one_mac["mac"]
-                            captured_macs["mode"] = one_mac["mode"]
-                            #print("Captured Macs:")
-                            #pprint(captured_macs)
-                            results_ld.append(captured_macs)
-                elif found_speed_discrep:
-                    captured_macs = {}
-                    captured_macs["chassis"] = chassis["chassis"]
-                    captured_macs["interface"] = intf["name"]
-                    captured_macs["speed"] = intf["speed"]
-                    captured_macs["admin-oper"] = intf["admin_status"] + "|" + intf["oper_status"]
-                    captured_macs["vlan_id"] = None
-                    captured_macs["mac"] = None
-                    captured_macs["mode"] = None
-                    results_ld.append(captured_macs)
-    #print("Results LD")
-    #pprint(results_ld)
-    return results_ld
+        intf_table.add_chassis(chassis)
+    matches = evaluate_rules(intf_table, rules)
+    return suspect_rows(intf_table, rules, matches)
 
 def print_suspect_interfaces(results_ld):
     # Define the table column headings
-    myTable = PrettyTable(["Chassis", "Interface", "Status", "Speed", "Host Mac", "Vlan", "Mode"])
-    breakrow = ['------', '---------', '------', '-----', '----------------', '-----', '-----']
+    myTable = PrettyTable(["Chassis", "Interface", "Status", "Speed", "Host Mac", "Vlan", "Mode", "Rule"])
+    breakrow = ['------', '---------', '------', '-----', '----------------', '-----', '-----', '-----']
     first_pass = True
     last_intf = None
 
@@ -1375,17 +1365,21 @@ def print_suspect_interfaces(results_ld):
         row_list.append(row["mac"])
         row_list.append(row["vlan_id"])
         row_list.append(row["mode"])
+        row_list.append(row["rule"])
         myTable.add_row(row_list)
 
     # Print the complete table
-    print(myTable)
+    with timed_span("table_render"):
+        table_str = str(myTable)
+    print(table_str)
 
     # Write it to a text table
-    with open(mac_scan_results, 'w') as w:
-        w.write(str(myTable))
+    with timed_span("disk_write"):
+        with open(mac_scan_results, 'w') as w:
+            w.write(table_str)
 
     # Write it to a CSV file
-    keys = ['chassis', 'interface', 'admin-oper', 'speed', 'mac', 'vlan_id', 'mode']
+    keys = ['chassis', 'interface', 'admin-oper', 'speed', 'mac', 'vlan_id', 'mode', 'rule']
     listDictCSV(results_ld, mac_scan_csv, keys)
 
 
@@ -1395,6 +1389,7 @@ def stp_map_net():
     # Provide selection for sending a single command or multiple commands from a file
     selected_vlan = "None"
     hosts = []
+    reset_device_metrics()
 
     my_ips = chooseDevices(iplist_dir)
     if my_ips:
@@ -1404,147 +1399,57 @@ def stp_map_net():
             stdout.write("-> Connecting to " + ip + " ... ")
             jdev = connect(ip)
             vlan_list = []
-            vlaninfo = VlanTable(jdev)
-            vlaninfo.get()
-            for name in vlaninfo:
-                vlan_list.append(name.tag)
+            for vlan_dict in NetconfCollector(jdev, ip, stdout.write).extract("vlan"):
+                if vlan_dict["tag"]:
+                    vlan_list.append(vlan_dict["tag"])
+                    # The scan pulls the VLAN from each device by name, get-vlan-information can't filter by tag
+                    if vlan_dict.get("name"):
+                        net_vlan_names.setdefault(vlan_dict["tag"], vlan_dict["name"])
             selected_vlan = getOptionAnswer("Choose a VLAN", vlan_list)
             hosts.append(host_from_ip(dev_list, ip))
 
-        # Captures the information into data structures
-        scan_loop(selected_vlan, hosts, using_network=True)
-
-        # Print the table
-        print("***********************")
-        print("* Spanning Tree Chart *")
-        print("***********************")
-        create_chart()
-        print("***********************")
-        print("* Spanning Tree Stats *")
-        print("***********************")
-        create_stp_stats()
-        # create_stp_paths()
+        # Captures the information into data structures and print the tables
+        stp_map_vlan(selected_vlan, hosts, using_network=True)
+        print_device_report(device_metrics_file, dev_ip_names())
     else:
         print("\n!! Configuration deployment aborted... No IPs defined !!!\n")
 
 # Function to analyze the spanning tree domains of VLANs in the network
+@timed_phase()
 def root_bridge_analysis(myselect="file"):
     print("*" * 50 + "\n" + " " * 10 + "Root Bridge Analysis\n" + "*" * 50)
-    mac_ld = []
-    vlans_ld = []
     all_vlans = []
-    # Collect all vlans via network
+    reset_device_metrics()
+    # Collect all vlans via network, each device is collected once and its model analyzed like the files. With
+    # --vlans, only the VLANs of the range are pulled from the devices.
     if myselect == "net":
-        raw_vlan_list = []
+        host_models = []
+        vlan_only = []
         for host in dev_list:
             print("Host: {} IP: {}".format(host, dev_list[host]))
-            try:
-                with Device(host=dev_list[host], user=username, password=password) as jdev:
-                    more_vlans = extract_vlan_info(get_net_vlan_info(jdev, dev_list[host]))
-                    raw_vlan_list = raw_vlan_list + more_vlans
-            except Exception as err:
-                print("Connection failed. ERROR: {}".format(err))
-                exit()
-        vlan_only = []
-        for one_vlan in raw_vlan_list:
-            vlan_only.append(one_vlan["tag"])
+            host_model = net_host_model(host, vlan_range or 'all')
+            host_models.append((host, host_model))
+            for one_vlan in host_model["vlan"]:
+                vlan_only.append(one_vlan["tag"])
         nodup_vlans = remove_duplicates(vlan_only)
-    # Collect all vlans via json files
+        vlans_ld, mac_ld = collect_root_analysis(nodup_vlans, host_models, myselect)
+    # Query the VLANs one at a time from the repository store, the results are never all in memory
+    elif use_store:
+        conn = ingest_repository()
+        vlans_ld = RowSource(store_root_vlans, conn)
+        mac_ld = host_bridge_macs(conn)
+    # Collect all vlans via json files, the results are reused until a file of the repository changes
     else:
-        nodup_vlans = []
-        vlan_host_ld = collect_all_vlans_json(selected_repo)
-        for vh in vlan_host_ld:
-            nodup_vlans.append(vh["vlan"])
-
-    # Create base of data structure to store all info
-    for vlan in nodup_vlans:
-        vlan_dict = {'vlan': vlan, 'chassis': []}
-        vlans_ld.append(vlan_dict)
-    # Loop over hosts and get STP info for each VLAN
-    for host in dev_list.keys():
-        print("Processing host {} ...".format(host))
-        # Capture needed information from host
-        first_pass = True
-        stp_temp_ld = []
-        stp_int_temp_ld = []
-        vlan_temp_ld = []
-        lldp_dict = {}
-        if myselect == "file":
-            stp_temp_ld = extract_json_stp_info(get_file_stp_info(host))
-            stp_int_temp_ld = extract_json_stp_int(get_file_stp_int(host))
-            vlan_temp_ld = extract_json_vlan_info(get_file_vlan_info(host))
-            lldp_dict = remove_duplicates(extract_json_lldp_info(get_file_lldp_info(host)))
-        else:
-            ip = dev_list[host]
-            print(starHeading(host, 5))
-            try:
-                with Device(host=ip, user=username, password=password) as jdev:
-                    # VLAN Info
-                    vlan_temp_ld = extract_vlan_info(get_net_vlan_info(jdev, ip))
-                    # STP Info (show spanning-tree bridge)
-                    stp_temp_ld = extract_span_info(get_net_stp_info(jdev, ip))
-                    # Check if vlan_dict and stp_dict are populated
-                    if vlan_dict:
-                        # LLDP Info (show lldp neighbors)
-                        lldp_dict = extract_lldp_info(get_net_lldp_info(jdev, ip))
-                    # If no vlan or stp information exists, provide an empty dict
-                    else:
-                        lldp_dict = {}
-            except Exception as err:
-                print("Connection failed. ERROR: {}".format(err))
-                exit()
-        # Loop over the vlan data captured for this host
-        for vlan_dict in vlan_temp_ld:
-            # Loop over the vlans in the data structure
-            for vlan in vlans_ld:
-                # If the vlan data capture and data structure matches...
-                if vlan["vlan"] == vlan_dict["tag"]:
-                    temp_dict = {"host": host, "l3-interface": vlan_dict["l3interface"]}
-                    # Loop over the spanning tree data collected
-                    for stp_dict in stp_temp_ld:
-                        # If the vlan_id info for this host matches the stp vlan_id
-                        if vlan_dict["tag"] == stp_dict["vlan_id"]:
-                            temp_dict["root-bridge-mac"] = stp_dict["vlan_rb_mac"]
-                            temp_dict["root-bridge-priority"] = stp_dict["vlan_rb_prio"]
-                            temp_dict["local-mac"] = stp_dict["vlan_local_mac"]
-                            temp_dict["local-priority"] = stp_dict["vlan_local_prio"]
-                            # Make root cost 0 if None is the value
-                            if stp_dict["vlan_root_cost"] is None:
-                                temp_dict["root-cost"] = "0"
-                            else:
-                                temp_dict["root-cost"] = stp_dict["vlan_root_cost"]
-                            # Make root port "-" if its None
-                            if stp_dict["vlan_root_port"] is None:
-                                temp_dict["root-port"] = "None"
-                            else:
-                                temp_dict["root-port"] = stp_dict["vlan_root_port"]
-                            temp_dict["topo-changes"] = stp_dict["topo_change_count"]
-                            temp_dict["time-since-last-tc"] = stp_dict["time_since_last_tc"]
-                            # Add the chassis to the LD
-                            if first_pass:
-                                mac_dict = {"hostname": host, "mac": stp_dict["vlan_local_mac"]}
-                                mac_ld.append(mac_dict)
-                                first_pass = False
-                            # Select the downstream peers associated with the VLAN only
-                            for stp_int_dict in stp_int_temp_ld:
-                                if stp_int_dict["vlan_id"] == vlan_dict["tag"]:
-                                    #print("Matched VLAN: {}".format(vlan_dict["tag"]))
-                                    downstream_ld = get_downstream_hosts(lldp_dict, stp_dict["vlan_root_port"], stp_int_dict)
-                                    temp_dict["downstream-peers"] = []
-                                    for down_dict in downstream_ld:
-                                        for member in vlan_dict["members"]:
-                                            if down_dict["intf"] == member.split(".")[0] and "*" in member:
-                                                temp_dict["downstream-peers"].append(down_dict["name"])
-                                                break
-                                    break
-                    # Check if downstream-peers is in the dictionary
-                    if "downstream-peers" not in temp_dict.keys():
-                        #print(temp_dict)
-                        temp_dict["downstream-peers"] = []
-                    # Add the chassis dict to the "chassis" list
-                    vlan["chassis"].append(temp_dict)
+        def file_analysis():
+            host_models = ((host, load_host_data(host)) for host in prefetched_hosts(dev_list.keys()))
+            return collect_root_analysis(range_vlans(repository_index()["vlans"]), host_models, myselect)
+        vlans_ld, mac_ld = cached_analysis("root_bridge_analysis", {"vlans": vlan_range}, list(dev_list.keys()),
+                                           file_analysis)
     # Print table to CLI
     create_root_analysis(vlans_ld, mac_ld)
+    export_results("root_analysis", vlan_export_rows(vlans_ld), vlan_export_keys)
+    if myselect == "net":
+        print_device_report(device_metrics_file, dev_ip_names())
     #vlans = [ { 'vlan': '4001',
     #            'chassis': [
     #                { 'host': 'SF-A',
@@ -1573,6 +1478,99 @@ def root_bridge_analysis(myselect="file"):
     #         { 'hostname': 'SF-B', 'mac': '2c:88:77:ab:bc:cd'}
     #       ]
 
+# The VLANs of a list that are in the --vlans range, in list order, all of them without a range
+def range_vlans(vlans):
+    if vlan_range is None:
+        return list(vlans)
+    selected = set(vlan_range)
+    return [vlan for vlan in vlans if vlan in selected]
+
+# Builds the root analysis chassis dict of a host for one of its VLANs, from the host's STP, STP interface and LLDP data
+# Returns (chassis dict, the host's STP record of the VLAN or None if it has none)
+def root_chassis_dict(host, vlan_dict, stp_temp_ld, stp_int_temp_ld, lldp_dict):
+    temp_dict = {"host": host, "l3-interface": vlan_dict["l3interface"]}
+    matched_stp = None
+    # Loop over the spanning tree data collected
+    for stp_dict in stp_temp_ld:
+        # If the vlan_id info for this host matches the stp vlan_id
+        if vlan_dict["tag"] == stp_dict["vlan_id"]:
+            temp_dict["root-bridge-mac"] = stp_dict["vlan_rb_mac"]
+            temp_dict["root-bridge-priority"] = stp_dict["vlan_rb_prio"]
+            temp_dict["local-mac"] = stp_dict["vlan_local_mac"]
+            temp_dict["local-priority"] = stp_dict["vlan_local_prio"]
+            # Make root cost 0 if None is the value
+            if stp_dict["vlan_root_cost"] is None:
+                temp_dict["root-cost"] = "0"
+            else:
+                temp_dict["root-cost"] = stp_dict["vlan_root_cost"]
+            # Make root port "-" if its None
+            if stp_dict["vlan_root_port"] is None:
+                temp_dict["root-port"] = "None"
+            else:
+                temp_dict["root-port"] = stp_dict["vlan_root_port"]
+            temp_dict["topo-changes"] = stp_dict["topo_change_count"]
+            temp_dict["time-since-last-tc"] = stp_dict["time_since_last_tc"]
+            if matched_stp is None:
+                matched_stp = stp_dict
+            # Select the downstream peers associated with the VLAN only
+            for stp_int_dict in stp_int_temp_ld:
+                if stp_int_dict["vlan_id"] == vlan_dict["tag"]:
+                    #print("Matched VLAN: {}".format(vlan_dict["tag"]))
+                    downstream_ld = get_downstream_hosts(lldp_dict, stp_dict["vlan_root_port"], stp_int_dict)
+                    temp_dict["downstream-peers"] = []
+                    for down_dict in downstream_ld:
+                        for member in vlan_dict["members"]:
+                            if down_dict["intf"] == member.split(".")[0] and "*" in member:
+                                temp_dict["downstream-peers"].append(down_dict["name"])
+                                break
+                    break
+    # Check if downstream-peers is in the dictionary
+    if "downstream-peers" not in temp_dict.keys():
+        #print(temp_dict)
+        temp_dict["downstream-peers"] = []
+    return temp_dict, matched_stp
+
+# Builds the root bridge analysis of the VLANs from the models of the hosts, collected from files or the network
+# host_models [(host, host_model)], in device list order, see host_model.py
+# Returns (vlans_ld, mac_ld), see root_bridge_analysis()
+def collect_root_analysis(nodup_vlans, host_models, myselect):
+    mac_ld = []
+    vlans_ld = []
+    # Create base of data structure to store all info
+    for vlan in nodup_vlans:
+        vlan_dict = {'vlan': vlan, 'chassis': []}
+        vlans_ld.append(vlan_dict)
+    history = open_history(history_db)
+    # Loop over hosts and get STP info for each VLAN
+    for host, host_model in host_models:
+        print("Processing host {} ...".format(host))
+        set_profile_host(host)
+        # Capture needed information from host
+        first_pass = True
+        stp_temp_ld = host_model["stp"]
+        stp_int_temp_ld = host_model["stp-int"]
+        vlan_temp_ld = host_model["vlan"]
+        lldp_dict = remove_duplicates(lldp_neighbors(host_model["lldp"]))
+        # Add the STP counters of all VLANs to the history
+        record_stp_samples(history, host, stp_temp_ld, stp_sample_time(host, myselect != "file"), myselect)
+        set_profile_host("")
+        # Loop over the vlan data captured for this host
+        for vlan_dict in vlan_temp_ld:
+            # Loop over the vlans in the data structure
+            for vlan in vlans_ld:
+                # If the vlan data capture and data structure matches...
+                if vlan["vlan"] == vlan_dict["tag"]:
+                    temp_dict, stp_dict = root_chassis_dict(host, vlan_dict, stp_temp_ld, stp_int_temp_ld, lldp_dict)
+                    # Add the chassis to the LD
+                    if first_pass and stp_dict is not None:
+                        mac_dict = {"hostname": host, "mac": stp_dict["vlan_local_mac"]}
+                        mac_ld.append(mac_dict)
+                        first_pass = False
+                    # Add the chassis dict to the "chassis" list
+                    vlan["chassis"].append(temp_dict)
+    history.close()
+    return vlans_ld, mac_ld
+
 def collect_vlan_list_net(vlan_ld):
     vlan_list = []
     for vlan in vlan_ld:
@@ -1583,9 +1581,8 @@ def collect_vlan_list_net(vlan_ld):
 def collect_all_vlans_json(selected_repo):
     vlan_host_ld = []
     # Collect all the vlans via json files, using repo location
-    for host in dev_list.keys():
-        vlan_json_file = os.path.join(selected_repo, (host + "_vlan-ext.json"))
-        v_list = collect_vlan_list_json(json_to_dict(vlan_json_file))
+    for host in prefetched_hosts(dev_list.keys(), {"vlan": "_vlan-ext.json"}, skip_cached=False):
+        v_list = extract_host_file(host, "vlan-list")
         # Loop over the complete VLAN list
         for this_vlan in v_list:
             vlan_found = False
@@ -1610,15 +1607,136 @@ def collect_all_vlans_json(selected_repo):
 
     return vlan_host_ld
 
-def create_root_analysis(vlans_ld, mac_ld):
-    key = "upstream_peer"
-    rb_key = "root_bridge"
+# Extracts a kind of data (see host_extractors in host_model.py) from a host's JSON capture, or from its XML capture if it only has that
+def extract_host_file(host, kind):
+    return FileCollector(selected_repo, host).extract(kind)
+
+# Extracts the files of a host for the repository store, the MAC table only if the host has an ether-sw capture
+# MACs learned on a port that isn't an uplink (LLDP or trunk port) are flagged as edge MACs
+def store_host_data(host):
+    set_profile_host(host)
+    host_data = {}
+    host_data["vlan"] = extract_host_file(host, "vlan")
+    host_data["lldp"] = extract_host_file(host, "lldp")
+    host_data["stp"] = extract_host_file(host, "stp")
+    host_data["stp-int"] = extract_host_file(host, "stp-int")
+    ether_json_file = os.path.join(selected_repo, (host + "_ether-sw.json"))
+    if source_exists(ether_json_file):
+        uplinks = uplink_ports(lldp_neighbors(host_data["lldp"]), vlan_intf_data(extract_host_file(host, "vlan-intf")))
+        host_data["macs"] = []
+        for ether_row in extract_json_ether_info(json_to_dict(ether_json_file)):
+            edge = ether_row["interface"].split(".")[0] not in uplinks
+            host_data["macs"].append((ether_row["mac"], ether_row["vlan_id"], ether_row["interface"], edge))
+    set_profile_host("")
+    return host_data
+
+# Loads the hosts of the device list into the repository store of the selected repository (repo_store.db), only the
+# hosts whose files changed since they were loaded are extracted, one host at a time. Returns the store connection.
+@timed_phase()
+def ingest_repository():
+    global repo_store
+    global repo_store_file
+    # The store is kept next to the repository, or in the script directory if the repository is read-only
+    db_file = writable_side_path(selected_repo, store_file_name, dir_path)
+    if repo_store_file != db_file:
+        if repo_store is not None:
+            repo_store.close()
+        repo_store = open_store(db_file)
+        repo_store_file = db_file
+    hosts = list(dev_list.keys())
+    sync_hosts(repo_store, hosts)
+    history = open_history(history_db)
+    # Hosts whose files changed since they were loaded, with the stamps as they read back from the store
+    changed = []
+    for position, host in enumerate(hosts):
+        stamps = json.loads(json.dumps(host_file_stamps(host, store_file_suffixes)))
+        if stored_stamps(repo_store, host) != stamps:
+            changed.append((position, host, stamps))
+    paths = [os.path.join(selected_repo, (host + suffix)) for position, host, stamps in changed
+             for suffix in ("_vlan-ext.json", "_lldp.json", "_stp.json", "_stp-int.json", "_ether-sw.json")]
+    loaded = 0
+    with prefetch_sources(paths):
+        for position, host, stamps in changed:
+            if None in [stamps[key] for key in host_file_suffixes]:
+                print("-> Skipping {}, capture files incomplete".format(host))
+                continue
+            host_data = store_host_data(host)
+            load_host(repo_store, host, position, stamps, host_data)
+            # Add the STP counters of all VLANs to the history
+            record_stp_samples(history, host, host_data["stp"], stp_sample_time(host, False), "file")
+            loaded += 1
+    history.close()
+    if loaded:
+        print("-> Loaded {} host(s) into {}".format(loaded, db_file))
+    return repo_store
+
+# Yields the root bridge analysis of each VLAN of the repository store, like collect_root_analysis() but one VLAN
+# at a time, only the LLDP neighbors of the hosts are kept between VLANs
+def store_root_vlans(conn):
+    lldp_by_host = {}
+    for vlan in range_vlans(store_vlan_list(conn)):
+        bridges = vlan_stp_bridges(conn, vlan)
+        instances = vlan_stp_instances(conn, vlan)
+        vlan_entry = {"vlan": vlan, "chassis": []}
+        for host, vlan_dict in vlan_hosts(conn, vlan):
+            if host not in lldp_by_host:
+                lldp_by_host[host] = remove_duplicates(lldp_neighbors(host_lldp_links(conn, host)))
+            stp_temp_ld = [bridges[host]] if host in bridges else []
+            stp_int_temp_ld = [instances[host]] if host in instances else []
+            temp_dict, stp_dict = root_chassis_dict(host, vlan_dict, stp_temp_ld, stp_int_temp_ld,
+                                                    lldp_by_host[host])
+            vlan_entry["chassis"].append(temp_dict)
+        yield vlan_entry
+
+# Index entry of a host: the VLANs it carries, its bridge MAC and its LLDP neighbors, from whichever files it has
+def index_host_entry(host):
+    host_entry = {"vlans": [], "bridge_mac": None, "lldp": []}
+    stamps = host_file_stamps(host)
+    if stamps["vlan"]:
+        host_entry["vlans"] = extract_host_file(host, "vlan-list")
+    if stamps["stp"]:
+        for stp_dict in extract_host_file(host, "stp"):
+            if stp_dict["vlan_local_mac"]:
+                host_entry["bridge_mac"] = stp_dict["vlan_local_mac"]
+                break
+    if stamps["lldp"]:
+        neighbors = []
+        for lldp_dict in lldp_neighbors(extract_host_file(host, "lldp")):
+            neighbors.append(lldp_dict["remote_sysname"])
+        host_entry["lldp"] = remove_duplicates(neighbors)
+    return host_entry
+
+# Loads the index of the selected repository and brings it up to date with the device list, only the hosts whose
+# files changed are read. The index is written back if anything changed, or kept in memory for this run if the
+# repository can't be written to.
+@timed_phase()
+def repository_index():
+    index = unsaved_indexes.get(selected_repo) or load_index(selected_repo)
+    indexed, updated = update_index(selected_repo, index, list(dev_list.keys()), index_file_suffixes,
+                                    index_host_entry)
+    if updated:
+        try:
+            save_index(selected_repo, index)
+            unsaved_indexes.pop(selected_repo, None)
+        except OSError as err:
+            if selected_repo not in unsaved_indexes:
+                print("-> Unable to save the repository index, keeping it for this run. ERROR: {}".format(err))
+            unsaved_indexes[selected_repo] = index
+    return index
+
+# Export the rows of an analysis to <name>.<export_ext> when --export is used
+@timed_phase()
+def export_results(name, rows, keys):
+    if not export_ext:
+        return
+    export_file = os.path.join(dir_path, name + "." + export_ext)
+    count = export_rows(rows, export_file, keys)
+    print("Exported {} rows to {}".format(count, export_file))
+
+# Yields the rows of the root analysis table, VLAN by VLAN, each VLAN followed by a break row
+def root_analysis_rows(vlans_ld, mac_hosts):
     # Replacement strings to remove ot pare down system names
     replace_strs = {'FXBM-': '', '.ellsworth.af.mil': ''}
-    # Specify the Column Names while initializing the Table
-    # Specify the Column Names while initializing the Table
-    myTable = PrettyTable(["VLAN", "Chassis", "Root Bridge (Cost)", "Local Priority", "Root Port", "Downstream Peers",
-                           "Topo Changes (D|H|M)", "L3 Interface"])
     breakrow = ['----', '-------', '--------------------', '-----', '------------', '--------', '--------', '-------']
     # Loop over VLAN hierarchy
     for vlan in vlans_ld:
@@ -1632,13 +1750,10 @@ def create_root_analysis(vlans_ld, mac_ld):
             # Populate Root Bridge cell
             if "local-mac" in chassis:
                 if "root-bridge-mac" in chassis:
-                    matched_mac = False
-                    for mac_dict in mac_ld:
-                        if mac_dict["mac"] == chassis["root-bridge-mac"]:
-                            row_contents.append(remove_substrings(mac_dict["hostname"], replace_strs) + " (" + chassis["root-cost"] + ")")
-                            matched_mac = True
-                            break
-                    if not matched_mac:
+                    rb_host = mac_hosts.get(mac_to_int(chassis["root-bridge-mac"]))
+                    if rb_host is not None:
+                        row_contents.append(remove_substrings(rb_host, replace_strs) + " (" + chassis["root-cost"] + ")")
+                    else:
                         row_contents.append(chassis["root-bridge-mac"] + " (" + chassis["root-cost"] + ")")
                 # Populate Local Priority
                 row_contents.append(chassis["local-priority"])
@@ -1682,27 +1797,313 @@ def create_root_analysis(vlans_ld, mac_ld):
         # Sort the rows for this VLAN so that 0 root costs are first
         sorted_list = sorted(vlan_sort_list, key=itemgetter(8))
 
-        # Put all the sorted rows in the table and remove the last element used for sorting
+        # Yield the sorted rows and remove the last element used for sorting
         for row in sorted_list:
             ele = row.pop()
-            myTable.add_row(row)
+            yield row
         # Add this row to breakup the VLANs
-        myTable.add_row(breakrow)
+        yield breakrow
+
+# The table is streamed to the screen and table_file as the rows are produced, the column widths are measured by a
+# first pass over the rows, so the rows are never all in memory
+@timed_phase()
+def create_root_analysis(vlans_ld, mac_ld):
+    # Hostname of each chassis MAC, the first host listed with a MAC wins
+    mac_hosts = {}
+    for mac_dict in mac_ld:
+        mac_hosts.setdefault(mac_to_int(mac_dict["mac"]), mac_dict["hostname"])
+    # Specify the Column Names while initializing the Table
+    myTable = StreamTable(["VLAN", "Chassis", "Root Bridge (Cost)", "Local Priority", "Root Port", "Downstream Peers",
+                           "Topo Changes (D|H|M)", "L3 Interface"])
+    with timed_span("table_measure"):
+        myTable.measure_rows(root_analysis_rows(vlans_ld, mac_hosts))
+
+    # Print the table and write it to a table file, row by row
+    with timed_span("table_render"):
+        with open(table_file, 'w') as w:
+            myTable.outputs = [sys.stdout, w]
+            for row in root_analysis_rows(vlans_ld, mac_hosts):
+                myTable.add_row(row)
+            myTable.finish()
+    sys.stdout.write("\n")
+
+# Locate the likely origin of a topology change storm in the selected repository, per class of VLANs.
+# VLANs whose hosts saw their last topology change at the same times (within "tolerance" seconds) form one class and
+# are analyzed once. If the captures include the TC source ("detail" output), the "last received from" bridges are
+# followed back to the initiator, otherwise the LLDP tree is walked towards the most recent, busiest host.
+def tc_storm_analysis(tolerance=10):
+    print("*" * 50 + "\n" + " " * 10 + "Topology Change Storm Origin\n" + "*" * 50)
+    hosts = list(dev_list.keys())
+    stp_by_host = {}
+    members_by_host = {}
+    lldp_by_host = {}
+    mac_host = {}
+    for host in prefetched_hosts(hosts):
+        host_data = load_host_data(host)
+        stp_by_host[host] = {}
+        for stp_dict in host_data["stp"]:
+            stp_by_host[host][stp_dict["vlan_id"]] = stp_dict
+            mac_host[mac_to_int(stp_dict["vlan_local_mac"])] = host
+        members_by_host[host] = {}
+        for vlan_dict in host_data["vlan"]:
+            members_by_host[host][vlan_dict["tag"]] = vlan_dict["members"]
+        lldp_by_host[host] = {}
+        for lldp_dict in lldp_neighbors(host_data["lldp"]):
+            lldp_by_host[host][lldp_dict["local_int"]] = lldp_dict["remote_sysname"]
+
+    # Group the VLANs by the hosts that changed and when, relative to the VLAN's most recent change
+    classes = {}
+    all_vlans = set()
+    for host in hosts:
+        all_vlans.update(stp_by_host[host].keys())
+    for vlan in sorted(all_vlans, key=lambda v: int(v) if v.isnumeric() else 0):
+        changes = []
+        for host in hosts:
+            stp_dict = stp_by_host[host].get(vlan)
+            if stp_dict and int(stp_dict["topo_change_count"]):
+                changes.append((int(stp_dict["time_since_last_tc"]), host))
+        if not changes:
+            continue
+        changes.sort()
+        latest = changes[0][0]
+        signature = (latest // tolerance,) + tuple((host, (tslt - latest) // tolerance) for tslt, host in changes)
+        classes.setdefault(signature, []).append(vlan)
+
+    myTable = PrettyTable(["VLANs", "Origin Bridge", "Origin Port", "Last TC (D|H|M)", "Topo Changes",
+                           "Hosts in Storm", "Method"])
+    for signature, vlans in classes.items():
+        origin = locate_tc_origin(vlans, stp_by_host, members_by_host, lldp_by_host, mac_host, tolerance)
+        myTable.add_row([compress_vlan_list(vlans), origin["host"], origin["port"], seconds_to_dhm(origin["tslt"]),
+                         origin["tc_count"], origin["storm_hosts"], origin["method"]])
     # Print the table
-    print(myTable)
+    with timed_span("table_render"):
+        table_str = str(myTable)
+    print(table_str)
 
     # Write it to a table
-    with open(table_file, 'w') as w:
-        w.write(str(myTable))
+    with timed_span("disk_write"):
+        with open(tc_storm_file, 'w') as w:
+            w.write(table_str)
+
+# Find the origin bridge and port of the last topology change of a class of VLANs
+# origin {'host': '', 'port': '', 'tslt': 0, 'tc_count': 0, 'storm_hosts': 0, 'method': ''}
+def locate_tc_origin(vlans, stp_by_host, members_by_host, lldp_by_host, mac_host, tolerance):
+    # Sum the counters over the VLANs of the class, the time since the last TC is the most recent of them
+    tc_counts = {}
+    last_tc = {}
+    for vlan in vlans:
+        for host in stp_by_host:
+            stp_dict = stp_by_host[host].get(vlan)
+            if stp_dict and int(stp_dict["topo_change_count"]):
+                tc_counts[host] = tc_counts.get(host, 0) + int(stp_dict["topo_change_count"])
+                tslt = int(stp_dict["time_since_last_tc"])
+                if host not in last_tc or tslt < last_tc[host]:
+                    last_tc[host] = tslt
+    latest = min(last_tc.values())
+    storm_hosts = [host for host in last_tc if last_tc[host] - latest <= tolerance]
+    # Most recent first, then the busiest
+    ranked = sorted(storm_hosts, key=lambda h: (last_tc[h], -tc_counts[h], h))
+    vlan = vlans[0]
+
+    # Follow the bridges the TC was last received from, back to the initiator
+    origin = ranked[0]
+    method = "LLDP/TC correlation"
+    visited = set()
+    while origin not in visited:
+        visited.add(origin)
+        stp_dict = stp_by_host[origin][vlan]
+        recvd_from = mac_host.get(bridge_mac(stp_dict.get("tc_last_recvd_from")))
+        if recvd_from and recvd_from != origin and recvd_from in last_tc:
+            origin = recvd_from
+            method = "TC received-from chain"
+        else:
+            break
+
+    # Without the TC source, climb the LLDP tree while a neighbor in the VLAN changed more recently or more often
+    if method != "TC received-from chain":
+        rank = {host: num for num, host in enumerate(ranked)}
+        climbing = True
+        while climbing:
+            climbing = False
+            for member in members_by_host[origin].get(vlan, []):
+                peer = lldp_by_host[origin].get(member.split(".")[0])
+                if peer in rank and rank[peer] < rank[origin]:
+                    origin = peer
+                    climbing = True
+                    break
+
+    # Pick the origin port, the initiator if captured, otherwise the active interfaces without an LLDP neighbor
+    port = stp_by_host[origin][vlan].get("tc_initiator")
+    if not port:
+        edge_ports = []
+        for member in members_by_host[origin].get(vlan, []):
+            if "*" in member and member.split(".")[0] not in lldp_by_host[origin]:
+                edge_ports.append(member.split("*")[0])
+        if len(edge_ports) == 1:
+            port = edge_ports[0]
+        elif edge_ports:
+            port = "edge ({})".format(len(edge_ports))
+        else:
+            port = "-"
+    return {"host": origin, "port": port, "tslt": last_tc[origin], "tc_count": tc_counts[origin],
+            "storm_hosts": len(storm_hosts), "method": method}
+
+# Export the spanning tree of every VLAN in the selected repository as DOT and GraphML files in graph_dir.
+# VLANs with identical trees are rendered once, and written either per VLAN or once per class.
+@timed_phase()
+def export_graphs():
+    print("*" * 50 + "\n" + " " * 10 + "VLAN Graph Export\n" + "*" * 50)
+    host_data = {}
+    for host in prefetched_hosts(dev_list.keys()):
+        cached = load_host_data(host)
+        host_data[host] = {"vlan": cached["vlan"], "stp": cached["stp"], "stp-int": cached["stp-int"],
+                           "lldp": cached["lldp"]}
+    set_profile_host("")
+    trees = build_vlan_trees(host_data)
+    per_class = getYNAnswer("Write one graph per class of identical VLAN trees") == 'y'
+    summary = export_vlan_graphs(trees, graph_dir, per_class=per_class, vlan_label=compress_vlan_list)
+    print("Wrote {} files for {} VLANs ({} distinct trees) to {}".format(summary["files"], summary["vlans"],
+                                                                       summary["classes"], graph_dir))
+
+# Report the topology change deltas and rates stored in the STP history over a window of hours
+def stp_history_report(top=20):
+    print("*" * 50 + "\n" + " " * 10 + "STP History Report\n" + "*" * 50)
+    hours = getInputAnswer("Enter the report window in hours")
+    try:
+        end = time.time()
+        start = end - float(hours) * 3600
+    except ValueError:
+        print("Invalid number of hours: {}".format(hours))
+        return
+    history = open_history(history_db)
+    vlan_table = PrettyTable(["VLAN", "Topo Changes", "TC/Hour", "Hosts", "First Sample", "Last Sample"])
+    for churn in top_churn_vlans(history, start, end, top):
+        vlan_table.add_row([churn["vlan"], churn["tc_delta"], churn["tc_per_hour"], churn["hosts"],
+                            time.strftime("%Y-%m-%d %H:%M", time.localtime(churn["first"])),
+                            time.strftime("%Y-%m-%d %H:%M", time.localtime(churn["last"]))])
+    host_table = PrettyTable(["Host", "VLAN", "Topo Changes", "TC/Hour", "Samples"])
+    for tc_dict in tc_deltas(history, start, end)[:top]:
+        host_table.add_row([tc_dict["host"], tc_dict["vlan"], tc_dict["tc_delta"], tc_dict["tc_per_hour"],
+                            tc_dict["samples"]])
+    history.close()
+    print("Top {} churn VLANs in the last {} hours".format(top, hours))
+    print(vlan_table)
+    print("Top {} churn Host/VLANs in the last {} hours".format(top, hours))
+    print(host_table)
+
+    # Write it to a table
+    with open(history_report, 'w') as w:
+        w.write(str(vlan_table) + "\n" + str(host_table))
 
 # Used to choose the repository for selecting
 def select_repository():
     global selected_repo
-    dirs = [d for d in os.listdir(json_dir) if os.path.isdir(os.path.join(json_dir, d))]
+    # Directories and archived repositories (.zip, .tar.gz, ...)
+    dirs = [d for d in os.listdir(json_dir) if os.path.isdir(os.path.join(json_dir, d)) or is_archive(d)]
     answer = getOptionAnswer('Choose a source repository', dirs)
+    # Drop the archives of the previous repository
+    close_archives()
     selected_repo = os.path.join(dir_path, 'json', (answer + "/"))
     print("Path: {}".format(selected_repo))
 
+# Capture the modification stamps of the JSON and XML files in a repository, compressed files under their plain name
+def repo_snapshot(repo):
+    snapshot = {}
+    for name, stamp in list_sources(repo).items():
+        if name.endswith((".json", ".xml")):
+            snapshot[name] = stamp
+    return snapshot
+
+# Returns the hosts whose files changed between two repository snapshots, "dev_list" if the device list changed
+def changed_hosts(old_snapshot, new_snapshot):
+    hosts = set()
+    for file_name in set(old_snapshot) | set(new_snapshot):
+        if old_snapshot.get(file_name) != new_snapshot.get(file_name):
+            if file_name == "dev_list.json":
+                hosts.add("dev_list")
+            for suffix in index_file_suffixes.values():
+                if file_name.endswith(suffix):
+                    hosts.add(file_name[:-len(suffix)])
+                    break
+    return hosts
+
+# Build the VLAN/host LD from the cached host data, only parsing hosts that changed
+def collect_all_vlans_cache():
+    vlan_hosts = {}
+    for host in prefetched_hosts(dev_list.keys()):
+        # Skip hosts whose files haven't all landed yet
+        if None in host_file_stamps(host).values():
+            print("-> Skipping {}, capture files incomplete".format(host))
+            continue
+        try:
+            host_data = load_host_data(host)
+        except (ValueError, OSError) as err:
+            # The collector is still writing a file of a host that was never parsed
+            print("-> Unable to parse files for {}, ERROR: {}".format(host, err))
+            continue
+        for vlan_dict in host_data["vlan"]:
+            if vlan_dict["tag"]:
+                vlan_hosts.setdefault(vlan_dict["tag"], []).append(host)
+    vlan_host_ld = []
+    for vlan, hosts in vlan_hosts.items():
+        vlan_host_ld.append({"vlan": vlan, "hosts": hosts})
+    return vlan_host_ld
+
+# Reads the device list of the repository again, keeps the current one while dev_list.json is missing or half-written
+def reload_dev_list(current):
+    dev_list_file = os.path.join(selected_repo, 'dev_list.json')
+    try:
+        with open_source(dev_list_file) as f:
+            return json.loads(f.read())
+    except (ValueError, OSError) as err:
+        print("-> Unable to read {}, keeping the current device list. ERROR: {}".format(dev_list_file, err))
+        return current
+
+# Watch a repository and refresh the chart and stats of a VLAN as capture files land
+# Bursts of writes are debounced, the refresh runs once the repository has been quiet for "debounce" seconds
+def watch_repository(interval=2, debounce=5):
+    global dev_list
+    print("*" * 50 + "\n" + " " * 10 + "Watch Repository (Files)\n" + "*" * 50)
+    vlan_host_ld = collect_all_vlans_cache()
+    selected_vlan = getOptionAnswer("Select a VLAN to watch", numeric_vlan_list(vlan_host_ld))
+    if not selected_vlan:
+        return
+    stp_map_vlan(selected_vlan, list(hosts_for_vlan(vlan_host_ld, selected_vlan)), using_network=False)
+
+    snapshot = repo_snapshot(selected_repo)
+    pending = set()
+    last_change = 0
+    print("-> Watching {} for changes, press Ctrl-C to stop".format(selected_repo))
+    try:
+        while True:
+            time.sleep(interval)
+            new_snapshot = repo_snapshot(selected_repo)
+            changed = changed_hosts(snapshot, new_snapshot)
+            snapshot = new_snapshot
+            # Keep collecting changes until the writes stop
+            if changed:
+                pending.update(changed)
+                last_change = time.time()
+            elif pending and time.time() - last_change >= debounce:
+                print("\n" + "*" * 50)
+                print("-> {} Changes detected: {}".format(get_now_time(), ", ".join(sorted(pending))))
+                if "dev_list" in pending:
+                    dev_list = reload_dev_list(dev_list)
+                    # Drop hosts that were removed from the device list
+                    for host in list(host_cache):
+                        if host not in dev_list:
+                            del host_cache[host]
+                pending = set()
+                # Only the changed hosts are parsed again, the rest come from the cache
+                try:
+                    vlan_host_ld = collect_all_vlans_cache()
+                    stp_map_vlan(selected_vlan, list(hosts_for_vlan(vlan_host_ld, selected_vlan)), using_network=False)
+                except (ValueError, OSError) as err:
+                    # A host without a good copy yet, try again on the next change
+                    print("-> Refresh failed, waiting for the next change. ERROR: {}".format(err))
+    except KeyboardInterrupt:
+        print("\n-> Stopped watching {}".format(selected_repo))
+
 # Main execution loop
 if __name__ == "__main__":
 
@@ -1717,7 +2118,9 @@ if __name__ == "__main__":
 
     # Define menu options
     my_options = ['Scan Vlans (Files)', 'Scan Vlans (Network)', 'Root Bridge Analysis (File)',
-                  'Root Bridge Analysis (Network)', 'Mac Address Function', 'Quit']
+                  'Root Bridge Analysis (Network)', 'Mac Address Function (Network)', 'Watch Repository (Files)',
+                  'STP History Report', 'TC Storm Origin (File)', 'Mac Address Function (File)',
+                  'Export VLAN Graphs (File)', 'Quit']
 
     # Get menu selection
     while True:
@@ -1739,8 +2142,34 @@ if __name__ == "__main__":
             password = getpass(prompt="\nEnter your password: ")
             root_bridge_analysis('net')
         elif answer == "5":
-            password = 'f0r5ak3n'
-            #password = getpass(prompt="\nEnter your password: ")
+            # The devices are the device list of the selected repository
+            select_repository()
+            dev_list = json_to_dict(os.path.join(selected_repo, 'dev_list.json'))
+            password = getpass(prompt="\nEnter your password: ")
             ether_switch_net()
         elif answer == "6":
+            select_repository()
+            dev_list = json_to_dict(os.path.join(selected_repo, 'dev_list.json'))
+            watch_repository()
+        elif answer == "7":
+            stp_history_report()
+        elif answer == "8":
+            select_repository()
+            dev_list = json_to_dict(os.path.join(selected_repo, 'dev_list.json'))
+            tc_storm_analysis()
+        elif answer == "9":
+            select_repository()
+            dev_list = json_to_dict(os.path.join(selected_repo, 'dev_list.json'))
+            ether_switch_files()
+        elif answer == "10":
+            select_repository()
+            dev_list = json_to_dict(os.path.join(selected_repo, 'dev_list.json'))
+            export_graphs()
+        elif answer == "11":
             quit()
+        # Report the timing and memory of this run if profiling was requested
+        print_profile_report(profile_file)
+        print_memory_report(memory_file)
+        reset_profile()
+        # The analysis is done, its archived repository isn't held open until the next one
+        close_archives()
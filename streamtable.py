@@ -0,0 +1,67 @@
+# File: streamtable.py
+# Purpose: Fixed-width table renderer that writes each row as it is produced.
+#
+# PrettyTable keeps every row and builds the whole table as one string before anything is printed, for reports with
+# hundreds of thousands of rows that is a large string and a long pause. StreamTable writes the same layout as
+# PrettyTable's default style (centered cells, "+---+" rules), a line at a time to any number of outputs, so memory
+# doesn't grow with the number of rows. The column widths are either given, or measured in a pre-pass over the rows
+# before the table is started. A cell wider than its column isn't truncated, it just breaks the alignment.
+
+class StreamTable(object):
+    """ Writes a PrettyTable style table row by row to one or more outputs (ie. stdout and a file). """
+
+    def __init__(self, field_names, outputs=(), widths=None):
+        self.field_names = [str(name) for name in field_names]
+        self.outputs = list(outputs)
+        if widths is None:
+            widths = [len(name) for name in self.field_names]
+        self.widths = list(widths)
+        self.rows = 0
+        self.started = False
+
+    # Widens the columns to fit a row, call it for every row before start() when the widths aren't fixed
+    def measure(self, row):
+        widths = self.widths
+        for index, cell in enumerate(row):
+            cell_len = len(str(cell))
+            if cell_len > widths[index]:
+                widths[index] = cell_len
+
+    # Widens the columns to fit all the rows of an iterable
+    def measure_rows(self, rows):
+        for row in rows:
+            self.measure(row)
+        return self
+
+    def hrule(self):
+        return "+" + "+".join("-" * (width + 2) for width in self.widths) + "+"
+
+    def format_row(self, row):
+        return "|" + "|".join(" " + str(cell).center(width) + " " for cell, width in zip(row, self.widths)) + "|"
+
+    # Writes a line to every output, lines are separated (not terminated) by newlines like str(PrettyTable)
+    def write_line(self, line):
+        if self.started:
+            line = "\n" + line
+        for output in self.outputs:
+            output.write(line)
+        self.started = True
+
+    # Writes the header
+    def start(self):
+        self.write_line(self.hrule())
+        self.write_line(self.format_row(self.field_names))
+        self.write_line(self.hrule())
+        return self
+
+    def add_row(self, row):
+        if not self.started:
+            self.start()
+        self.write_line(self.format_row(row))
+        self.rows += 1
+
+    # Writes the closing rule
+    def finish(self):
+        if not self.started:
+            self.start()
+        self.write_line(self.hrule())
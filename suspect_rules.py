@@ -0,0 +1,216 @@
+# File: suspect_rules.py
+# Purpose: Declarative rules for the suspect interfaces of the MAC scan, evaluated over a columnar interface table.
+#
+# The interfaces of all chassis are flattened once into columns (status, speed, duplex and the MAC counts per mode and
+# VLAN), that is the only pass over the MAC lists. A rule is a list of conditions on those columns. Each distinct
+# condition is evaluated once over its whole column into a mask, so rules sharing a condition (ie. admin up) share the
+# mask and adding a rule doesn't walk the MACs again.
+#
+# Rule format:
+# {'name': '', 'description': '', 'conditions': [[column, operator, value], ...], 'report': 'interface', 'unless': []}
+#  - operator: ==, !=, >, >=, <, <=, in, not in
+#  - report: "interface" (one row), "macs" (one row per MAC) or "vlan_macs" (one row per MAC of the VLANs whose
+#    access MAC count meets the rule's "vlan_access_macs" conditions)
+#  - unless: optional names of rules that, if they match an interface, take its report over from this rule
+# The rules can be replaced with a JSON file holding a list of rules, see load_rules().
+
+import json
+import operator
+import os
+
+# Columns of the interface table
+interface_columns = ("chassis", "interface", "admin_status", "oper_status", "speed", "duplex", "mac_count",
+                     "access_macs", "trunk_macs", "vlan_access_macs", "vlan_count")
+
+# Condition operators
+rule_operators = {"==": operator.eq, "!=": operator.ne, ">": operator.gt, ">=": operator.ge, "<": operator.lt,
+                  "<=": operator.le, "in": lambda value, options: value in options,
+                  "not in": lambda value, options: value not in options}
+
+# Default rules, the first two are the original checks of get_suspect_interfaces: the low speed of an interface is only
+# reported if it doesn't have multiple access MACs in a VLAN. Unlike the original check, which only listed the MACs of
+# the last such VLAN, the MACs of every VLAN with multiple access MACs are listed.
+default_rules = [
+    {"name": "multiple_access_macs", "description": "More than one access MAC in a VLAN",
+     "conditions": [["admin_status", "==", "up"], ["oper_status", "==", "up"], ["mac_count", ">", 1],
+                    ["vlan_access_macs", ">", 1]],
+     "report": "vlan_macs"},
+    {"name": "low_speed", "description": "Up/up at less than 1G with more than one MAC",
+     "conditions": [["admin_status", "==", "up"], ["oper_status", "==", "up"], ["mac_count", ">", 1],
+                    ["speed", "in", ["10mbps", "100mbps"]]],
+     "report": "interface", "unless": ["multiple_access_macs"]},
+    {"name": "half_duplex", "description": "Up/up in half duplex",
+     "conditions": [["admin_status", "==", "up"], ["oper_status", "==", "up"], ["duplex", "==", "half-duplex"]],
+     "report": "interface"},
+    {"name": "down_with_macs", "description": "Admin up, oper down, with learned MACs",
+     "conditions": [["admin_status", "==", "up"], ["oper_status", "==", "down"], ["mac_count", ">", 0]],
+     "report": "macs"},
+    {"name": "trunk_single_mac", "description": "Trunk port with a single MAC",
+     "conditions": [["trunk_macs", ">", 0], ["mac_count", "==", 1]],
+     "report": "macs"},
+]
+
+# Reports of a rule
+rule_reports = ("interface", "macs", "vlan_macs")
+
+# Checks the rules of a rules file, raises ValueError on the first malformed rule
+def check_rules(rules):
+    if type(rules) is not list:
+        raise ValueError("The rules must be a list")
+    names = [rule.get("name") for rule in rules if type(rule) is dict]
+    for number, rule in enumerate(rules, 1):
+        if type(rule) is not dict or not rule.get("name"):
+            raise ValueError("Rule {}: not a rule with a name".format(number))
+        conditions = rule.get("conditions")
+        if type(conditions) is not list:
+            raise ValueError("Rule {}: conditions must be a list".format(rule["name"]))
+        for condition in conditions:
+            if type(condition) is not list or len(condition) != 3:
+                raise ValueError("Rule {}: condition {} isn't [column, operator, value]".format(rule["name"],
+                                                                                               condition))
+            column, op, value = condition
+            if column not in interface_columns:
+                raise ValueError("Rule {}: unknown column {}".format(rule["name"], column))
+            if op not in rule_operators:
+                raise ValueError("Rule {}: unknown operator {}".format(rule["name"], op))
+        if rule.get("report", "interface") not in rule_reports:
+            raise ValueError("Rule {}: unknown report {}".format(rule["name"], rule["report"]))
+        for name in rule.get("unless", []):
+            if name not in names:
+                raise ValueError("Rule {}: unknown rule {} in unless".format(rule["name"], name))
+
+# Loads the rules from a JSON file, the default rules if the file doesn't exist or can't be used
+def load_rules(rules_file):
+    if not rules_file or not os.path.isfile(rules_file):
+        return default_rules
+    try:
+        with open(rules_file) as f:
+            rules = json.load(f)
+        check_rules(rules)
+    except (OSError, ValueError) as err:
+        print("Unable to load the rules file: {}".format(rules_file))
+        print("ERROR: {}".format(err))
+        print("-> Using the default rules")
+        return default_rules
+    for rule in rules:
+        rule.setdefault("report", "interface")
+    return rules
+
+class InterfaceTable(object):
+    """ The interfaces of all chassis as columns, one list per column plus the interface dicts for reporting. """
+
+    def __init__(self):
+        self.columns = {}
+        for column in interface_columns:
+            self.columns[column] = []
+        # Access MAC count of each VLAN, per interface
+        self.vlan_counts = []
+        self.interfaces = []
+
+    def __len__(self):
+        return len(self.interfaces)
+
+    # Adds the interfaces of a chassis, each interface's MACs are walked once here
+    def add_chassis(self, chassis):
+        columns = self.columns
+        for intf in chassis["interfaces"]:
+            access_macs = 0
+            trunk_macs = 0
+            vlan_counts = {}
+            vlans = set()
+            for one_mac in intf["macs"]:
+                vlans.add(one_mac["vlan_id"])
+                if one_mac["mode"] == "access":
+                    access_macs += 1
+                    vlan_counts[one_mac["vlan_id"]] = vlan_counts.get(one_mac["vlan_id"], 0) + 1
+                elif one_mac["mode"] == "trunk":
+                    trunk_macs += 1
+            columns["chassis"].append(chassis["chassis"])
+            columns["interface"].append(intf["name"])
+            columns["admin_status"].append(intf.get("admin_status"))
+            columns["oper_status"].append(intf.get("oper_status"))
+            columns["speed"].append(intf.get("speed"))
+            columns["duplex"].append((intf.get("duplex") or "").lower() or None)
+            columns["mac_count"].append(len(intf["macs"]))
+            columns["access_macs"].append(access_macs)
+            columns["trunk_macs"].append(trunk_macs)
+            columns["vlan_access_macs"].append(max(vlan_counts.values()) if vlan_counts else 0)
+            columns["vlan_count"].append(len(vlans))
+            self.vlan_counts.append(vlan_counts)
+            self.interfaces.append(intf)
+        return self
+
+# Evaluates a condition over its whole column, None values never match
+def condition_mask(column_values, op, value):
+    compare = rule_operators[op]
+    if type(value) == list:
+        value = frozenset(value)
+    return [v is not None and compare(v, value) for v in column_values]
+
+# Evaluates the rules over the interface table
+# Returns {rule name: [row index, ...]}, each distinct condition is evaluated once for all rules
+def evaluate_rules(intf_table, rules):
+    masks = {}
+    matches = {}
+    for rule in rules:
+        rule_mask = None
+        for column, op, value in rule["conditions"]:
+            key = (column, op, json.dumps(value))
+            if key not in masks:
+                masks[key] = condition_mask(intf_table.columns[column], op, value)
+            if rule_mask is None:
+                rule_mask = masks[key]
+            else:
+                rule_mask = [a and b for a, b in zip(rule_mask, masks[key])]
+        if rule_mask is None:
+            rule_mask = [True] * len(intf_table)
+        matches[rule["name"]] = [index for index, matched in enumerate(rule_mask) if matched]
+    return matches
+
+# The VLANs of an interface whose access MAC count meets the rule's "vlan_access_macs" conditions
+def matching_vlans(rule, vlan_counts):
+    vlans = []
+    for vlan_id, count in vlan_counts.items():
+        if all(rule_operators[op](count, value) for column, op, value in rule["conditions"]
+               if column == "vlan_access_macs"):
+            vlans.append(vlan_id)
+    return vlans
+
+# Builds the suspect rows of the matched interfaces, in interface order
+# results_ld [
+# captured_macs {'chassis': '', 'interface': '', 'speed': '', 'admin-oper': '', 'vlan_id': '', 'mac': '', 'mode': '',
+#                'rule': ''}
+# ]
+def suspect_rows(intf_table, rules, matches):
+    matched = {}
+    for name, indexes in matches.items():
+        matched[name] = set(indexes)
+    row_rules = {}
+    for rule in rules:
+        unless = [matched[name] for name in rule.get("unless", ())]
+        for index in matches[rule["name"]]:
+            if not any(index in indexes for indexes in unless):
+                row_rules.setdefault(index, []).append(rule)
+
+    results_ld = []
+    for index in sorted(row_rules):
+        intf = intf_table.interfaces[index]
+        base = {"chassis": intf_table.columns["chassis"][index], "interface": intf["name"],
+                "speed": intf.get("speed"),
+                "admin-oper": "{}|{}".format(intf.get("admin_status"), intf.get("oper_status"))}
+        for rule in row_rules[index]:
+            if rule["report"] == "interface":
+                macs = [None]
+            elif rule["report"] == "vlan_macs":
+                vlans = matching_vlans(rule, intf_table.vlan_counts[index])
+                macs = [one_mac for one_mac in intf["macs"] if one_mac["vlan_id"] in vlans]
+            else:
+                macs = intf["macs"]
+            for one_mac in macs:
+                captured_macs = dict(base)
+                captured_macs["vlan_id"] = one_mac["vlan_id"] if one_mac else None
+                captured_macs["mac"] = one_mac["mac"] if one_mac else None
+                captured_macs["mode"] = one_mac["mode"] if one_mac else None
+                captured_macs["rule"] = rule["name"]
+                results_ld.append(captured_macs)
+    return results_ld
@@ -0,0 +1,132 @@
+# File: test_capture_plan.py
+# Purpose: Regression checks of the extraction plans of yamls/ (capture_plan.py) against known JSON and XML captures.
+#
+# The XML captures are written from the JSON ones with stpbench.py, so both formats must give the same records.
+# Run with: python -m pytest -q
+
+import json
+import os
+import shutil
+
+from host_model import extract_records, extract_keys, source_plans, vlan_intf_plan
+from host_model import host_file_suffixes, xml_file_suffixes
+from stpbench import generate_repository, convert_repository_xml, write_xml_capture
+
+def jdata(value):
+    return [{"data": value}]
+
+# A capture as JSON (dict) and as a "| display xml" capture (file name)
+def capture_sources(tmp_path, name, doc):
+    xml_file = os.path.join(str(tmp_path), name + ".xml")
+    write_xml_capture(xml_file, doc)
+    return json.loads(json.dumps(doc)), xml_file
+
+def test_stp_bridge_capture(tmp_path):
+    doc = {"stp-bridge": [{"vst-bridge-parameters": [
+        {"vlan-id": jdata("100"),
+         "root-bridge": [{"bridge-priority": jdata("4096"), "bridge-mac": jdata("02:00:5e:00:00:00")}],
+         "this-bridge": [{"bridge-priority": jdata("8192"), "bridge-mac": jdata("02:00:5e:00:00:01")}],
+         "topology-change-count": jdata("3"), "time-since-last-tc": jdata("120"),
+         "topology-change-initiator": jdata("ge-0/0/1"), "root-port": jdata("ge-0/0/0"),
+         "root-cost": jdata("20000")},
+        # No key (ie. an RSTP instance), skipped
+        {"root-bridge": [{"bridge-priority": jdata("4096"), "bridge-mac": jdata("02:00:5e:00:00:00")}]},
+        {"vlan-id": jdata("101"),
+         "root-bridge": [{"bridge-priority": jdata("4096"), "bridge-mac": jdata("02:00:5e:00:00:01")}],
+         "this-bridge": [{"bridge-priority": jdata("4096"), "bridge-mac": jdata("02:00:5e:00:00:01")}],
+         "topology-change-count": jdata("0"), "time-since-last-tc": jdata("0")}]}]}
+    expected = [{"vlan_id": "100", "vlan_rb_prio": "4096", "vlan_rb_mac": "02:00:5e:00:00:00",
+                 "vlan_local_prio": "8192", "vlan_local_mac": "02:00:5e:00:00:01", "topo_change_count": "3",
+                 "time_since_last_tc": "120", "tc_initiator": "ge-0/0/1", "tc_last_recvd_from": "",
+                 "vlan_root_port": "ge-0/0/0", "vlan_root_cost": "20000"},
+                {"vlan_id": "101", "vlan_rb_prio": "4096", "vlan_rb_mac": "02:00:5e:00:00:01",
+                 "vlan_local_prio": "4096", "vlan_local_mac": "02:00:5e:00:00:01", "topo_change_count": "0",
+                 "time_since_last_tc": "0", "tc_initiator": "", "tc_last_recvd_from": ""}]
+    for source in capture_sources(tmp_path, "sw_stp", doc):
+        assert extract_records(source_plans["stp"], source) == expected
+        assert extract_keys(source_plans["stp"], source) == ["100", "101"]
+        assert extract_records(source_plans["stp"], source, "101") == expected[1]
+        assert extract_records(source_plans["stp"], source, "999") == []
+
+def test_stp_interface_capture(tmp_path):
+    doc = {"stp-interface-information": [{"stp-instance": [
+        {"vlan-id": jdata("100"), "stp-interfaces": [{"stp-interface-entry": [
+            {"interface-name": jdata("ge-0/0/0"), "port-cost": jdata("20000"), "port-state": jdata("FWD"),
+             "designated-bridge-mac": jdata("02:00:5e:00:00:00"), "designated-bridge-priority": jdata("4096"),
+             "port-role": jdata("ROOT")},
+            {"interface-name": jdata("ae0"), "port-cost": jdata("10000"), "port-state": jdata("BLK"),
+             "designated-bridge-mac": jdata("02:00:5e:00:00:02"), "designated-bridge-priority": jdata("32768"),
+             "port-role": jdata("ALT")}]}]},
+        {"vlan-id": jdata("101"), "stp-interfaces": [{}]}]}]}
+    expected = [{"vlan_id": "100", "interfaces": [
+                    {"int_name": "ge-0/0/0", "port_cost": "20000", "port_state": "FWD",
+                     "desg_bridge_mac": "02:00:5e:00:00:00", "desg_bridge_prio": "4096", "port_role": "ROOT"},
+                    {"int_name": "ae0", "port_cost": "10000", "port_state": "BLK",
+                     "desg_bridge_mac": "02:00:5e:00:00:02", "desg_bridge_prio": "32768", "port_role": "ALT"}]},
+                {"vlan_id": "101", "interfaces": []}]
+    for source in capture_sources(tmp_path, "sw_stp-int", doc):
+        assert extract_records(source_plans["stp-int"], source) == expected
+
+def test_vlan_capture(tmp_path):
+    doc = {"l2ng-l2ald-vlan-instance-information": [{"l2ng-l2ald-vlan-instance-group": [
+        {"l2ng-l2rtb-vlan-name": jdata("users"), "l2ng-l2rtb-vlan-tag": jdata("100"),
+         "l2ng-l2rtb-instance-state": jdata("Active"),
+         "l2ng-l2rtb-vlan-member": [
+             {"l2ng-l2rtb-vlan-member-interface": jdata("ge-0/0/0.0*"),
+              "l2ng-l2rtb-vlan-member-tagness": jdata("tagged"),
+              "l2ng-l2rtb-vlan-member-interface-mode": jdata("trunk")},
+             {"l2ng-l2rtb-vlan-member-interface": jdata("ge-0/0/5.0"),
+              "l2ng-l2rtb-vlan-member-tagness": jdata("untagged"),
+              "l2ng-l2rtb-vlan-member-interface-mode": jdata("access")}],
+         "l2ng-l2rtb-vlan-l3-interface": jdata("irb.100")},
+        {"l2ng-l2rtb-vlan-name": jdata("spare"), "l2ng-l2rtb-vlan-tag": jdata("200")},
+        # A VLAN group without a tag, skipped
+        {"l2ng-l2rtb-vlan-name": jdata("default")}]}]}
+    expected = [{"tag": "100", "name": "users", "l3interface": "irb.100", "members": ["ge-0/0/0.0*", "ge-0/0/5.0"]},
+                {"tag": "200", "name": "spare", "l3interface": "", "members": []}]
+    # The plain dict records of the VLAN interfaces have every field, None if the item doesn't have it
+    expected_intf = [{"name": "users", "tag": "100", "state": "Active", "interfaces": ["ge-0/0/0.0*", "ge-0/0/5.0"],
+                      "tagness": ["tagged", "untagged"], "modes": ["trunk", "access"]},
+                     {"name": "spare", "tag": "200", "state": None, "interfaces": [], "tagness": [], "modes": []}]
+    for source in capture_sources(tmp_path, "sw_vlan-ext", doc):
+        assert extract_records(source_plans["vlan"], source) == expected
+        assert extract_keys(source_plans["vlan"], source) == ["100", "200"]
+        assert extract_records(vlan_intf_plan, source) == expected_intf
+
+def test_lldp_capture(tmp_path):
+    doc = {"lldp-neighbors-information": [{"lldp-neighbor-information": [
+        {"lldp-local-port-id": jdata("ge-0/0/0"), "lldp-local-parent-interface-name": jdata("ae0"),
+         "lldp-remote-chassis-id": jdata("02:00:5e:00:00:00"), "lldp-remote-system-name": jdata("sw000"),
+         "lldp-remote-port-description": jdata("ge-0/0/2")},
+        # Older releases name the local port lldp-local-interface, read first
+        {"lldp-local-interface": jdata("ge-0/0/1"), "lldp-local-port-id": jdata("514"),
+         "lldp-remote-chassis-id": jdata("02:00:5e:00:00:02")}]}]}
+    expected = [{"parent_int": "ae0", "local_port": "ge-0/0/0", "remote_chassis_id": "02:00:5e:00:00:00",
+                 "remote_sysname": "sw000", "remote_port": "ge-0/0/2"},
+                {"parent_int": "", "local_port": "ge-0/0/1", "remote_chassis_id": "02:00:5e:00:00:02",
+                 "remote_sysname": "", "remote_port": ""}]
+    for source in capture_sources(tmp_path, "sw_lldp", doc):
+        assert extract_records(source_plans["lldp"], source) == expected
+
+# Every plan gives the same records from the JSON and XML captures of a generated repository
+def test_generated_repository_json_matches_xml(tmp_path):
+    json_repo = os.path.join(str(tmp_path), "json")
+    xml_repo = os.path.join(str(tmp_path), "xml")
+    generate_repository(json_repo, switches=4, vlans=12, ports=24, depth=2, style="vstp")
+    shutil.copytree(json_repo, xml_repo)
+    convert_repository_xml(xml_repo)
+    hosts = sorted(json.load(open(os.path.join(json_repo, "dev_list.json"))))
+    plans = dict(source_plans, **{"vlan-intf": vlan_intf_plan})
+    for host in hosts:
+        for kind, plan in plans.items():
+            file_kind = "vlan" if kind == "vlan-intf" else kind
+            with open(os.path.join(json_repo, host + host_file_suffixes[file_kind])) as f:
+                raw_dict = json.load(f)
+            xml_file = os.path.join(xml_repo, host + xml_file_suffixes[file_kind])
+            records = extract_records(plan, raw_dict)
+            assert records
+            assert extract_records(plan, xml_file) == records
+            keys = extract_keys(plan, raw_dict)
+            assert extract_keys(plan, xml_file) == keys
+            if plan.json_key is not None:
+                assert extract_records(plan, xml_file, keys[-1]) == extract_records(plan, raw_dict, keys[-1])
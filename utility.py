@@ -23,6 +23,8 @@ from jnpr.junos.exception import CommitError
 from ncclient import manager  # https://github.com/ncclient/ncclient
 from ncclient.transport import errors
 from sys import stdout
+from profiler import timed_phase, timed_span
+from repo_source import open_source
 
 # --------------------------------------
 # ANSWER METHODS
@@ -305,29 +307,17 @@ def check_sort(ip_list):
 # The key are the headings for the CSV
 # The file will be overwritten
 def listDictCSV(myListDict, filePathName, keys):
-    addKeys = True
-    if (os.path.isfile(filePathName)):
-        addKeys = False
     try:
-        f = open(filePathName, 'w')
+        f = open(filePathName, 'w', newline='', buffering=1 << 20)
     except Exception as err:
         print("Failure opening file in write mode - ERROR: {0}".format(err))
         print("Be sure {0} isn't open in another program.".format(filePathName))
     else:
-        if addKeys:
-            #Write all the headings in the CSV
-            for akey in keys[:-1]:							# Runs for every element, except the last
-                f.write(akey + ",")							# Writes most elements
-            f.write(keys[-1])								# Writes last element
-            f.write("\n")
-
-        for part in myListDict:
-            for bkey in keys[:-1]:
-                #print "BKey: " + bkey + "  Value: " + part[bkey]
-                f.write(str(part[bkey]) + ",")
-            f.write(str(part[keys[-1]]))
-            f.write("\n")
-        f.close()
+        # The file is rewritten, so it always gets the headings. csv.writer quotes values with commas or quotes.
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(keys)
+            writer.writerows([part[bkey] for bkey in keys] for part in myListDict)
         print("\nCompleted appending to CSV.")
 
 # Adds a dictionary to a CSV file
@@ -336,23 +326,17 @@ def dictCSV(myDict, filePathName, keys):
     if (os.path.isfile(filePathName)):
         addKeys = False
     try:
-        f = open(filePathName, 'a')
+        f = open(filePathName, 'a', newline='')
     except Exception as err:
         print("Failure opening file in append mode - ERROR: {0}".format(err))
         print("Be sure {0} isn't open in another program.".format(filePathName))
     else:
-        if addKeys:
-            #Write all the headings in the CSV
-            for akey in keys[:-1]:							# Runs for every element, except the last
-                f.write(akey + ",")							# Writes most elements
-            f.write(keys[-1])								# Writes last element
-            f.write("\n")
-
-        for key in keys[:-1]:
-            f.write(str(myDict[key]) + ",")
-        f.write(str(myDict[keys[-1]]))
-        f.write("\n")
-        f.close()
+        with f:
+            writer = csv.writer(f)
+            if addKeys:
+                #Write all the headings in the CSV
+                writer.writerow(keys)
+            writer.writerow([myDict[key] for key in keys])
         print("\nCompleted appending to CSV.")
 
 # Converts CSV file to listDict. First line is considered column headers.
@@ -376,10 +360,12 @@ def csvListDict(fileName, keys=''):
     return myListDict
 
 # Converts JSON file to Dictionary
+# The file may also be stored compressed (.gz, .xz) or in an archived repository, see repo_source.py
+@timed_phase()
 def json_to_dict(fileName):
     #print("File Name: {}".format(fileName))
     try:
-        file = open(fileName, 'r')
+        file = open_source(fileName)
     except FileNotFoundError as err:
         print("Unable to find the file: {}".format(fileName))
         print("ERROR: {}".format(err))
@@ -389,8 +375,11 @@ def json_to_dict(fileName):
         print("ERROR: {}".format(err))
         exit()
     else:
-        json_data = json.load(file)
+        with timed_span("file_read"):
+            raw_data = file.read()
         file.close()
+        with timed_span("json_decode"):
+            json_data = json.loads(raw_data)
     return json_data
 
 # Converts CSV file to Dictionary
@@ -844,6 +833,23 @@ def remove_substrings(cur_string, replace_strs):
 
     return(cur_string)
 
+# Compresses a list of VLAN tags into ranges, ie. ['100', '101', '102', '110'] -> "100-102,110"
+def compress_vlan_list(vlans):
+    tags = sorted(int(vlan) for vlan in vlans if str(vlan).isnumeric())
+    ranges = []
+    for tag in tags:
+        if ranges and tag == ranges[-1][1] + 1:
+            ranges[-1][1] = tag
+        else:
+            ranges.append([tag, tag])
+    range_list = []
+    for start, end in ranges:
+        if start == end:
+            range_list.append(str(start))
+        else:
+            range_list.append("{}-{}".format(start, end))
+    return ",".join(range_list)
+
 def seconds_to_dhm(time):
     seconds_to_minute = 60
     seconds_to_hour = 60 * seconds_to_minute